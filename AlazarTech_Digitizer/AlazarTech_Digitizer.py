@@ -24,6 +24,19 @@ class Driver(InstrumentDriver.InstrumentWorker):
         # add single-frequency values
         for n in range(9):
             self.signal_index['FFT - Value %d' % (n+1)] = 0
+        # on-the-fly demodulated values, per channel
+        self.lDemod = [np.zeros((0, 0), dtype=complex)] * 2
+        self.demod_index = {
+            'Ch1 - Demodulated values': 0,
+            'Ch2 - Demodulated values': 1}
+        # statistics from last DMA readout
+        self.stats_index = {
+            'Buffers completed': 'buffers_completed',
+            'Buffers dropped': 'buffers_dropped',
+            'Time - Waiting for data': 'time_wait',
+            'Time - Copy and re-post': 'time_transfer',
+            'Time - Averaging': 'time_average',
+            'Time - Total': 'time_total'}
         self.dt = 1.0
         # open connection
         boardId = int(self.comCfg.address)
@@ -62,7 +75,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
     def performGetValue(self, quant, options={}):
         """Perform the Get Value instrument operation"""
         # only implmeneted for traces
-        if quant.name in self.signal_index:
+        if quant.name in self.signal_index or quant.name in self.demod_index:
             # special case for hardware looping
             if self.isHardwareLoop(options):
                 return self.getSignalHardwareLoop(quant, options)
@@ -70,12 +83,15 @@ class Driver(InstrumentDriver.InstrumentWorker):
             if self.isFirstCall(options):
                 # clear trace buffer
                 self.lTrace = [np.array([]), np.array([])]
+                self.lDemod = [np.zeros((0, 0), dtype=complex)] * 2
                 # read traced to buffer, proceed depending on model
                 if self.getModel() in ('9870',):
                     self.getTracesNonDMA()
                 else:
                     self.getTracesDMA(hardware_trig=self.isHardwareTrig(options))
             value = self.extract_trace_value(quant)
+        elif quant.name in self.stats_index:
+            value = self.dig.acquisition_stats[self.stats_index[quant.name]]
         else:
             # just return the quantity value
             value = quant.getValue()
@@ -88,7 +104,8 @@ class Driver(InstrumentDriver.InstrumentWorker):
         if self.getModel() in ('9870',):
             return
         # make sure we are arming for reading traces, if not return
-        signals = [name in self.signal_index for name in quant_names]
+        signals = [name in self.signal_index or name in self.demod_index
+                   for name in quant_names]
         if not np.any(signals):
             return
         # get config
@@ -101,6 +118,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
         nMemSize = int(self.getValue('Max buffer size'))
         nMaxBuffer = int(self.getValue('Max number of buffers'))
         fft_config = self.get_fft_config()
+        demod_config = self.get_demod_config()
         if (not bGetCh1) and (not bGetCh2):
             return
         # configure and start acquisition
@@ -113,13 +131,15 @@ class Driver(InstrumentDriver.InstrumentWorker):
             self.dig.readTracesDMA(bGetCh1, bGetCh2, nSample, n_seq, nBuffer, nAverage,
                                    bConfig=True, bArm=True, bMeasure=False, 
                                    bufferSize=nMemSize, maxBuffers=nMaxBuffer,
-                                   fft_config=fft_config)
+                                   fft_config=fft_config,
+                                   demod_config=demod_config)
         else:
             # if not hardware looping, just trig the card, buffers are already configured 
             self.dig.readTracesDMA(bGetCh1, bGetCh2, nSample, nRecord, nBuffer, nAverage,
                                    bConfig=False, bArm=True, bMeasure=False,
                                    bufferSize=nMemSize, maxBuffers=nMaxBuffer,
-                                   fft_config=fft_config)
+                                   fft_config=fft_config,
+                                   demod_config=demod_config)
 
 
     def _callbackProgress(self, progress):
@@ -141,6 +161,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
             nMemSize = int(self.getValue('Max buffer size'))
             nMaxBuffer = int(self.getValue('Max number of buffers'))
             fft_config = self.get_fft_config()
+            demod_config = self.get_demod_config()
             # show status before starting acquisition
             self.reportStatus('Digitizer - Waiting for signal')
             # get data
@@ -152,11 +173,16 @@ class Driver(InstrumentDriver.InstrumentWorker):
                            firstTimeout=self.dComCfg['Timeout']+180.0,
                            bufferSize=nMemSize,
                            maxBuffers=nMaxBuffer,
-                           fft_config=fft_config)
+                           fft_config=fft_config,
+                           demod_config=demod_config)
             # re-shape data and place in trace buffer
-            nSample = len(vCh1) / n_seq
-            self.lTrace[0] = vCh1.reshape((n_seq, nSample))
-            self.lTrace[1] = vCh2.reshape((n_seq, nSample))
+            if demod_config['enabled']:
+                # demodulated values already have one row per record
+                self.lDemod = [vCh1, vCh2]
+            else:
+                nSample = len(vCh1) // n_seq
+                self.lTrace[0] = vCh1.reshape((n_seq, nSample))
+                self.lTrace[1] = vCh2.reshape((n_seq, nSample))
         # after getting data, pick values to return
         value = self.extract_trace_value(quant, seq_no)
         return value
@@ -262,16 +288,19 @@ class Driver(InstrumentDriver.InstrumentWorker):
         nMemSize = int(self.getValue('Max buffer size'))
         nMaxBuffer = int(self.getValue('Max number of buffers'))
         fft_config = self.get_fft_config()
+        demod_config = self.get_demod_config()
         # set ignore error flag
         self.dig.ignore_buffer_overflow = bool(
             self.getValue('Ignore buffer overflow'))
+        self.dig.pipelined = bool(self.getValue('Pipelined readout'))
         # configure DMA read
         self.dig.readTracesDMA(bGetCh1, bGetCh2,
                                nPostSize, nRecord, nBuffer, nAverage,
                                bConfig=True, bArm=False, bMeasure=False,
                                bufferSize=nMemSize,
                                maxBuffers=nMaxBuffer,
-                               fft_config=fft_config)
+                               fft_config=fft_config,
+                               demod_config=demod_config)
 
 
     def getTracesDMA(self, hardware_trig=False):
@@ -286,17 +315,23 @@ class Driver(InstrumentDriver.InstrumentWorker):
         nMemSize = int(self.getValue('Max buffer size'))
         nMaxBuffer = int(self.getValue('Max number of buffers'))
         fft_config = self.get_fft_config()
+        demod_config = self.get_demod_config()
         # in hardware trig mode, there is no noed to re-arm the card
         bArm = not hardware_trig
         # get data
-        self.lTrace[0], self.lTrace[1] = self.dig.readTracesDMA(
+        data = self.dig.readTracesDMA(
             bGetCh1, bGetCh2,
             nPostSize, nRecord, nBuffer, nAverage,
             bConfig=False, bArm=bArm, bMeasure=True,
             funcStop=self.isStopped,
             bufferSize=nMemSize,
             maxBuffers=nMaxBuffer,
-            fft_config=fft_config)
+            fft_config=fft_config,
+            demod_config=demod_config)
+        if demod_config['enabled']:
+            self.lDemod = list(data)
+        else:
+            self.lTrace[0], self.lTrace[1] = data
 
 
     def getTracesNonDMA(self):
@@ -350,6 +385,44 @@ class Driver(InstrumentDriver.InstrumentWorker):
         d['df'] = 1 / (self.dt*fft_length)
         return d
 
+    def get_demod_config(self):
+        """Get configuration and integration weights for demodulation in the
+        DMA readout, with the same scaling as the SignalDemodulation driver"""
+        d = {}
+        d['enabled'] = (bool(self.getValue('Demodulation - Enabled')) and
+                        self.getModel() not in ('9870',) and
+                        not self.get_fft_config()['enabled'])
+        if not d['enabled']:
+            return d
+        # integration window
+        n_sample = int(self.getValue('Number of samples'))
+        start = int(round(self.getValue('Demodulation - Skip start')/self.dt))
+        length = 1 + int(round(self.getValue('Demodulation - Length')/self.dt))
+        length = min(length, n_sample - start)
+        if length <= 1:
+            raise Error('Demodulation window must contain at least 2 samples')
+        n_freq = int(self.getValue('Demodulation - Number of frequencies'))
+        freqs = np.array([self.getValue('Demodulation - Frequency %d' % (n+1))
+                          for n in range(n_freq)])
+        # trapezoidal integration weights
+        envelope = np.full(length, 2. / (length - 1))
+        envelope[[0, -1]] /= 2
+        vTime = self.dt * (start + np.arange(length))
+        vExp = np.exp(2j*np.pi * vTime[:, np.newaxis] * freqs)
+        d['start'] = start
+        d['weights'] = []
+        for n in range(2):
+            weights = envelope
+            if self.getValue('Demodulation - Use custom weights'):
+                # pad or truncate custom weights to window length
+                custom = self.getValue('Ch%d - Integration weights' % (n+1))
+                custom = np.asarray(custom.get('y', []))[:length]
+                if len(custom) > 0:
+                    weights = envelope * np.pad(custom,
+                                                (0, length - len(custom)))
+            d['weights'].append(weights[:, np.newaxis] * vExp)
+        return d
+
     def extract_trace_value(self, quant, record=None):
         """Get value from traces, either as pure data, fft, or fft value
         
@@ -360,6 +433,11 @@ class Driver(InstrumentDriver.InstrumentWorker):
         record : int, optional
             Record to get, by default None
         """
+        if quant.name in self.demod_index:
+            # demodulated values, flattened as (record, frequency)
+            data = self.lDemod[self.demod_index[quant.name]]
+            value = data.flatten() if record is None else data[record]
+            return quant.getTraceDict(value, dt=1.0)
         indx = self.signal_index[quant.name]
         # return correct data
         fft_config = self.get_fft_config()
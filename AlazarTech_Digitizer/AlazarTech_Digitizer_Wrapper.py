@@ -8,6 +8,8 @@ import numpy as np
 import logging
 log = logging.getLogger('LabberDriver')
 import time
+import threading
+import queue
 
 # define constants
 ADMA_NPT = 0x200
@@ -76,6 +78,192 @@ class DMABuffer:
         else:
             raise Exception("Unsupported OS")
 
+
+class BufferWorker:
+    """Process DMA buffers, in a worker thread or directly when added.
+
+    Parameters
+    ----------
+    maxQueue : int
+        Maximum number of buffers waiting to be processed. `put` blocks if the
+        queue is full.
+    threaded : bool
+        If False, buffers are processed directly in `put`.
+
+    """
+    def __init__(self, maxQueue, threaded=True):
+        self.threaded = threaded
+        self.time = 0.0
+        self.error = None
+        if threaded:
+            self.queue = queue.Queue(maxsize=max(1, maxQueue))
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def put(self, data):
+        """Add buffer to queue, the buffer must not be modified afterwards"""
+        if self.threaded:
+            self.queue.put(data)
+        else:
+            self._process(data)
+
+    def stop(self):
+        """Wait for all queued buffers to be processed, then stop worker"""
+        if self.threaded and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def process(self, data):
+        """Process a single buffer, implemented by subclasses"""
+        raise NotImplementedError()
+
+    def _process(self, data):
+        # keep draining the queue after errors, to not block producer
+        if self.error is not None:
+            return
+        t0 = time.perf_counter()
+        try:
+            self.process(data)
+        except Exception as e:
+            self.error = e
+        self.time += time.perf_counter() - t0
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            self._process(data)
+
+
+class BufferAverager(BufferWorker):
+    """Average DMA buffers in a worker thread.
+
+    Raw sample codes are summed as integers (or double precision for float
+    data), conversion to volts is done once the acquisition is complete.
+
+    Parameters
+    ----------
+    nAvPerBuffer : int
+        Number of averages contained in each buffer.
+    maxQueue : int
+        Maximum number of buffers waiting to be averaged.
+
+    """
+    def __init__(self, nAvPerBuffer, maxQueue):
+        self.nAvPerBuffer = nAvPerBuffer
+        self.total = None
+        self.count = 0
+        super().__init__(maxQueue)
+
+    def process(self, data):
+        dtype = np.float64 if data.dtype.kind == 'f' else np.int64
+        rs = data.reshape((self.nAvPerBuffer, -1))
+        if self.total is None:
+            self.total = rs.sum(0, dtype=dtype)
+        else:
+            self.total += rs.sum(0, dtype=dtype)
+        self.count += 1
+
+    def get_result(self):
+        """Get summed sample codes and number of summed buffers
+
+        Returns
+        -------
+        total : np.ndarray or None
+            Sum over all averages of all buffers.
+        count : int
+            Number of buffers in the sum.
+
+        """
+        if self.error is not None:
+            raise self.error
+        return (self.total, self.count)
+
+
+class BufferDemodulator(BufferWorker):
+    """Demodulate and integrate the records of DMA buffers.
+
+    Each record is multiplied with a set of complex integration weights, one
+    column per demodulation frequency. Results are summed per record index
+    in units of sample codes, raw records are not kept.
+
+    Parameters
+    ----------
+    weights : list of np.ndarray
+        Complex weights for each channel in the buffer, with shape
+        (n_samples, n_frequencies).
+    start : int
+        Index of first sample in record to integrate.
+    samplesPerRecord : int
+        Number of samples per record in the buffer, for each channel.
+    nRecord : int
+        Number of records in the output, records are averaged modulo nRecord.
+    nRecordTotal : int
+        Total number of records to process, extra records are ignored.
+    maxQueue : int
+        Maximum number of buffers waiting to be processed.
+    threaded : bool
+        If False, buffers are processed directly in `put`.
+
+    """
+    def __init__(self, weights, start, samplesPerRecord, nRecord,
+                 nRecordTotal, maxQueue, threaded=True):
+        self.start = start
+        self.samplesPerRecord = samplesPerRecord
+        self.nRecord = nRecord
+        self.nRecordTotal = nRecordTotal
+        # real and imaginary parts side by side, for a single real product
+        self.weights = [np.hstack((w.real, w.imag)) for w in weights]
+        self.total = [np.zeros((nRecord, w.shape[1]), dtype=complex)
+                      for w in weights]
+        self.counts = np.zeros(nRecord, dtype=int)
+        self.nProcessed = 0
+        super().__init__(maxQueue, threaded)
+
+    def process(self, data):
+        nChannel = len(self.weights)
+        rs = data.reshape((-1, self.samplesPerRecord, nChannel))
+        # skip records acquired beyond the requested number
+        n = min(rs.shape[0], self.nRecordTotal - self.nProcessed)
+        if n <= 0:
+            return
+        for c, weights in enumerate(self.weights):
+            nFreq = weights.shape[1] // 2
+            x = rs[:n, self.start:self.start + weights.shape[0], c]
+            y = np.dot(x.astype(float), weights)
+            self._accumulate(
+                self.total[c], y[:, :nFreq] + 1j * y[:, nFreq:], n)
+        self._accumulate(self.counts, 1, n)
+        self.nProcessed += n
+
+    def _accumulate(self, total, values, n):
+        """Add values of n consecutive records, wrapping around at nRecord"""
+        pos = self.nProcessed
+        i = 0
+        while i < n:
+            r = pos % self.nRecord
+            m = min(self.nRecord - r, n - i)
+            total[r:r + m] += values if np.isscalar(values) else values[i:i + m]
+            pos += m
+            i += m
+
+    def get_result(self):
+        """Get demodulated values summed per record and number of averages
+
+        Returns
+        -------
+        total : list of np.ndarray
+            Complex sums for each channel, with shape (nRecord, n_frequencies).
+        counts : np.ndarray
+            Number of averages for each record.
+
+        """
+        if self.error is not None:
+            raise self.error
+        return (self.total, self.counts)
+
+
 # error type returned by this class
 class Error(Exception):
     pass
@@ -120,6 +308,9 @@ class AlazarTechDigitizer():
             self.fft_enabled = False
             self.fft_module = None
         self.ignore_buffer_overflow = False
+        # average buffers in a worker thread during DMA readout
+        self.pipelined = True
+        self.acquisition_stats = self.getEmptyStatistics()
 
     def testLED(self):
         import time
@@ -365,10 +556,20 @@ class AlazarTechDigitizer():
                       bConfig=True, bArm=True, bMeasure=True,
                       funcStop=None, funcProgress=None, timeout=None, bufferSize=512,
                       firstTimeout=None, maxBuffers=1024,
-                      fft_config={'enabled': False}):
-        """read traces in NPT AutoDMA mode, convert to float, average to single trace"""
+                      fft_config={'enabled': False},
+                      demod_config={'enabled': False}):
+        """read traces in NPT AutoDMA mode, convert to float, average to single trace
+
+        If demodulation is enabled in `demod_config`, each record is
+        integrated with the complex weights in demod_config['weights'] (one
+        array per channel, shape (n_samples, n_frequencies)), starting at
+        sample demod_config['start']. The data is then returned as one
+        complex array per channel, with shape (nRecord, n_frequencies).
+        """
         t0 = time.perf_counter()
-        lT = []
+        # on-the-fly demodulation is not available in FFT mode
+        bDemod = (demod_config.get('enabled', False) and
+                  not fft_config.get('enabled', False))
 
         # use global timeout if not given
         timeout = self.timeout if timeout is None else timeout
@@ -395,7 +596,7 @@ class AlazarTechDigitizer():
 
         #Select the number of records per DMA buffer.
         nRecordTotal = nRecord * nAverage
-        if nRecord > 1:
+        if nRecord > 1 and not bDemod:
             # if multiple records wanted, set records per buffer to match
             recordsPerBuffer = nRecord 
         else:
@@ -455,16 +656,10 @@ class AlazarTechDigitizer():
         # don't allocate more buffers than needed for all data
         bufferCount = min(bufferCount, buffersPerAcquisition, maxBuffers)
         # initialize data array, if measure
-        if bMeasure:
+        if bMeasure and not bDemod:
             vData = [np.zeros(nPtsOut, dtype=float),
                      np.zeros(nPtsOut, dtype=float)]
 
-        lT.append('Total buffers needed: %d' % buffersPerAcquisition)
-        lT.append('Buffer count: %d' % bufferCount)
-        lT.append('Buffer size: %d' % bytesPerBuffer)
-        lT.append('Buffer size, memory: %d' % bytesPerBufferMem)
-        lT.append('Records per buffer: %d' % recordsPerBuffer)
-    
         # configure board, if wanted
         if bConfig:
             # special case for FFT
@@ -546,12 +741,27 @@ class AlazarTechDigitizer():
         if not bMeasure:
             return
 
-        lT.append('Post: %.1f ms' % ((time.perf_counter()-t0)*1000))
+        # reset statistics
+        self.acquisition_stats = stats = self.getEmptyStatistics()
+        stats['buffers_total'] = buffersPerAcquisition
+        stats['buffer_count'] = len(self.buffers)
+        stats['buffer_size'] = bytesPerBuffer
+        stats['records_per_buffer'] = recordsPerBuffer
+        stats['time_arm'] = time.perf_counter() - t0
+        buffersCompleted = 0
+        bytesTransferred = 0
+        nAvPerBuffer = int(recordsPerBuffer // nRecord)
+        # worker for demodulation, or for averaging if running pipelined
+        worker = None
+        if bDemod:
+            weights = [w for (w, b) in zip(demod_config['weights'],
+                                           (bGetCh1, bGetCh2)) if b]
+            worker = BufferDemodulator(
+                weights, demod_config['start'], samplesPerRecord, nRecord,
+                nRecordTotal, len(self.buffers), threaded=self.pipelined)
+        elif self.pipelined:
+            worker = BufferAverager(nAvPerBuffer, len(self.buffers))
         try:
-            lT.append('Start: %.1f ms' % ((time.perf_counter()-t0)*1000))
-            buffersCompleted = 0
-            bytesTransferred = 0
-            nAvPerBuffer = int(recordsPerBuffer // nRecord)
             # range and zero for conversion to voltages
             if fft_config.get('enabled', False):
                 range1 = self.fft_scale
@@ -569,22 +779,17 @@ class AlazarTechDigitizer():
             while (buffersCompleted < buffersPerAcquisition):
                 # Wait for the buffer at the head of the list of available
                 # buffers to be filled by the board.
+                t1 = time.perf_counter()
                 buf = self.buffers[buffersCompleted % len(self.buffers)]
                 self.AlazarWaitAsyncBufferComplete(buf.addr, timeout_ms=timeout_ms)
-                # lT.append('Wait: %.1f ms' % ((time.perf_counter()-t0)*1000))
+                t2 = time.perf_counter()
+                stats['time_wait'] += t2 - t1
 
                 # reset timeout time, can be different than first call
                 timeout_ms = int(timeout*1000)
 
                 buffersCompleted += 1
                 bytesTransferred += buf.size_bytes
-    
-                # break if stopped from outside
-                if funcStop is not None and funcStop():
-                    break
-                # report progress
-                if funcProgress is not None:
-                    funcProgress(float(buffersCompleted)/float(buffersPerAcquisition))
 
                 # remove extra elements for getting even 256*16 buffer sizes
                 if bytesPerBuffer == bytesPerBufferMem:
@@ -592,7 +797,37 @@ class AlazarTechDigitizer():
                 else:
                     buf_truncated = buf.buffer[:int(bytesPerBuffer//bytesPerSample)]
 
+                if worker is not None and worker.threaded:
+                    # copy data and give the buffer back to the board at once,
+                    # processing is done by the worker thread
+                    data = buf_truncated.copy()
+                    if (buffersCompleted < buffersPerAcquisition):
+                        self.AlazarPostAsyncBuffer(buf.addr, buf.size_bytes)
+                    t3 = time.perf_counter()
+                    stats['time_transfer'] += t3 - t2
+                    # blocks if the worker is behind by more than the number
+                    # of DMA buffers
+                    worker.put(data)
+                    stats['time_queue'] += time.perf_counter() - t3
+                elif worker is not None:
+                    # process data before giving the buffer back
+                    worker.put(buf_truncated)
+                    t3 = time.perf_counter()
+                    if (buffersCompleted < buffersPerAcquisition):
+                        self.AlazarPostAsyncBuffer(buf.addr, buf.size_bytes)
+                    stats['time_transfer'] += time.perf_counter() - t3
+
+                # break if stopped from outside
+                if funcStop is not None and funcStop():
+                    break
+                # report progress
+                if funcProgress is not None:
+                    funcProgress(float(buffersCompleted)/float(buffersPerAcquisition))
+                if worker is not None:
+                    continue
+
                 # reshape, sort and average data
+                t3 = time.perf_counter()
                 if nAverage > 1:
                     if channels == 1:
                         rs = buf_truncated.reshape((nAvPerBuffer, nPtsOut))
@@ -613,10 +848,8 @@ class AlazarTechDigitizer():
                         rs = buf_truncated.reshape((nPtsOut, 2))
                         vData[0] = range1 * (rs[:, 0] - offset)
                         vData[1] = range2 * (rs[:, 1] - offset)
-
-                # lT.append('Sort/Avg: %.1f ms' % ((time.perf_counter()-t0)*1000))
-                # log.info(str(lT))
-                # lT = []
+                t4 = time.perf_counter()
+                stats['time_average'] += t4 - t3
                 #
                 # Sample codes are unsigned by default. As a result:
                 # - 0x00 represents a negative full scale input signal.
@@ -626,6 +859,7 @@ class AlazarTechDigitizer():
                 # Add the buffer to the end of the list of available buffers.
                 if (buffersCompleted < buffersPerAcquisition):
                     self.AlazarPostAsyncBuffer(buf.addr, buf.size_bytes)
+                stats['time_transfer'] += time.perf_counter() - t4
         except Exception as e:
             if not self.ignore_buffer_overflow:
                 try:
@@ -633,6 +867,9 @@ class AlazarTechDigitizer():
                 except Exception:
                     pass
                 raise e
+            # buffers that were never received are reported as dropped
+            log.warning('DMA readout failed, ignoring error: %s' % str(e))
+            stats['buffers_dropped'] = buffersPerAcquisition - buffersCompleted
         finally:
             # release resources
             try:
@@ -642,14 +879,53 @@ class AlazarTechDigitizer():
                     self.AlazarAbortAsyncRead()
             except Exception:
                 pass
-            lT.append('Abort: %.1f ms' % ((time.perf_counter()-t0)*1000))
+            # wait for worker to process remaining buffers
+            if worker is not None:
+                worker.stop()
+        stats['buffers_completed'] = buffersCompleted
+        stats['bytes_transferred'] = bytesTransferred
         # normalize
-        # log.info('Average: %.1f ms' % np.mean(lAvTime))
-        vData[0] /= buffersPerAcquisition
-        vData[1] /= buffersPerAcquisition
-        # # log timing information
-        lT.append('Done: %.1f ms' % ((time.perf_counter()-t0)*1000))
-        log.info(str(lT))
+        t1 = time.perf_counter()
+        if bDemod:
+            stats['time_average'] = worker.time
+            (totals, counts) = worker.get_result()
+            stats['buffers_averaged'] = buffersCompleted
+            # convert to volts, per record, with offset for each weight
+            ranges = [r for (r, b) in zip((range1, range2),
+                                          (bGetCh1, bGetCh2)) if b]
+            values = []
+            for (total, weights, rng) in zip(totals, weights, ranges):
+                value = rng * (total / np.maximum(counts, 1)[:, np.newaxis] -
+                               offset * np.sum(weights, 0))
+                # records never received are returned as zero
+                value[counts == 0] = 0.0
+                values.append(value)
+            empty = np.zeros((0, 0), dtype=complex)
+            vData = [values.pop(0) if b else empty for b in (bGetCh1, bGetCh2)]
+            stats['time_convert'] = time.perf_counter() - t1
+            stats['time_total'] = time.perf_counter() - t0
+            log.debug(self.formatStatistics())
+            return vData
+        elif worker is not None:
+            stats['time_average'] = worker.time
+            (total, nAveraged) = worker.get_result()
+            stats['buffers_averaged'] = nAveraged
+            if nAveraged > 0:
+                # convert from summed sample codes to volts
+                mean = total / float(nAveraged * nAvPerBuffer)
+                if channels == 1:
+                    vData[0] = range1 * (mean - offset)
+                elif channels == 2:
+                    vData[1] = range2 * (mean - offset)
+                elif channels == 3:
+                    rs = mean.reshape((nPtsOut, 2))
+                    vData[0] = range1 * (rs[:, 0] - offset)
+                    vData[1] = range2 * (rs[:, 1] - offset)
+        else:
+            stats['buffers_averaged'] = buffersCompleted
+            vData[0] /= buffersPerAcquisition
+            vData[1] /= buffersPerAcquisition
+        stats['time_convert'] = time.perf_counter() - t1
         if not fft_config.get('enabled', False):
             # return data - requested length, not restricted to 128 multiple
             if nPtsOut != (samplesPerRecordValue*nRecord):
@@ -669,9 +945,35 @@ class AlazarTechDigitizer():
                 vData[0] += np.log10(
                     ((self.dRange[1] / 2**(self.bitsPerSample - 1)) /
                     (fftLength / 2))**2)
+        # log timing information
+        stats['time_total'] = time.perf_counter() - t0
+        log.debug(self.formatStatistics())
         return vData
 
 
+    def getEmptyStatistics(self):
+        """Get dict with acquisition statistics, with all values zero"""
+        keys = ['buffers_total', 'buffers_completed', 'buffers_averaged',
+                'buffers_dropped', 'bytes_transferred', 'buffer_count',
+                'buffer_size', 'records_per_buffer', 'time_arm', 'time_wait',
+                'time_transfer', 'time_queue', 'time_average', 'time_convert',
+                'time_total']
+        return {key: 0 for key in keys}
+
+
+    def formatStatistics(self):
+        """Format statistics from the last DMA readout as a string"""
+        stats = self.acquisition_stats
+        s = ('Buffers: %d/%d completed, %d averaged, %d dropped. ' %
+             (stats['buffers_completed'], stats['buffers_total'],
+              stats['buffers_averaged'], stats['buffers_dropped']))
+        s += ', '.join(['%s: %.1f ms' % (key[5:].capitalize(), 1000*stats[key])
+                        for key in ('time_arm', 'time_wait', 'time_transfer',
+                                    'time_queue', 'time_average',
+                                    'time_convert', 'time_total')])
+        return s
+
+
     def removeBuffersDMA(self):
         """Clear and remove DMA buffers, to release memory"""
         # make sure buffers release memory
@@ -2,6 +2,7 @@
 
 from BaseDriver import LabberDriver
 import datetime
+import os
 
 dIndx = {'P1': 0,
          'P2': 1,
@@ -11,72 +12,139 @@ dIndx = {'P1': 0,
          'P6': 5,
          }
 
+# temperature channels, each with a separate log file
+lTempChannels = ['CH1', 'CH2', 'CH5', 'CH6']
+
+
+class LogTail():
+    """Reader of the last line of a log file that is appended to.
+
+    The byte offset of the last read is kept, so that only new data is read
+    from the file. On the first read, or if much data was added since the
+    last read, the file is read backwards from the end until a complete line
+    is found. A line without newline at the end of the file is in the middle
+    of being written, it is kept until its newline arrives and the previous
+    complete line is returned meanwhile.
+    """
+
+    def __init__(self, path, nBlock=4096, nMaxRead=2**20):
+        self.path = path
+        self.nBlock = nBlock
+        self.nMaxRead = nMaxRead
+        self.offset = 0
+        self.partial = b''
+        self.lastLine = None
+
+    def readLastLine(self):
+        """Read new data from file and return last line, or None if empty"""
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size < self.offset:
+                # file was replaced, start over
+                self.offset = 0
+                self.partial = b''
+            if self.offset == 0 or size - self.offset > self.nMaxRead:
+                data = self._readEnd(f, size)
+                self.partial = b''
+            else:
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+        self.offset = size
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines[-1]
+        for line in reversed(lines[:-1]):
+            line = line.strip()
+            if len(line) > 0:
+                self.lastLine = line
+                break
+        return self.lastLine
+
+    def _readEnd(self, f, size):
+        """Read end of file, starting at the beginning of a complete line"""
+        start = size
+        data = b''
+        # need two newlines, the first one ends a possibly incomplete line
+        while start > 0 and data.count(b'\n') < 2:
+            n = min(self.nBlock, start)
+            start -= n
+            f.seek(start)
+            data = f.read(n) + data
+        if start > 0:
+            data = data[data.index(b'\n') + 1:]
+        return data
+
 
 class Driver(LabberDriver):
     def performOpen(self, options={}):
-        # List of current pressure values
-        self.lValues = [0.0] * len(dIndx)
-        # List to check if currently stored values have been read
-        self.lUpdated = [False] * len(dIndx)
+        # Current pressure and temperature values
+        self.dValues = dict()
+        for name in list(dIndx.keys()) + lTempChannels:
+            self.dValues[name] = 0.0
+        # Check if currently stored values have been read
+        self.dUpdated = {name: False for name in self.dValues}
+        # Log file readers, by log name
+        self.dTail = dict()
 
     def performGetValue(self, quant, options={}):
         """Perform the Get Value instrument operation"""
-        if quant.name in dIndx:
-            indx = dIndx[quant.name]
-            # check if value already measured
-            if not self.lUpdated[indx]:
-                try:
-                    # find latest pressure log file
-                    logFolderPath = self.getValue('BlueFors Log Folder')
-                    now = datetime.datetime.now()
-                    datestr = '%s-%s-%s' % (str(now.year)[-2:],
-                                            str('{:02d}'.format(now.month)),
-                                            str('{:02d}'.format(now.day)))
-                    filePath = '%s/%s/maxigauge %s.log' % (logFolderPath,
-                                                           datestr, datestr)
-                    # read all values from text file
-                    with open(filePath, 'rb') as f:
-                        data = f.readlines()
-                        lastline = data[-1].split(b',')
-                        self.lValues = [float(lastline[5]),
-                                        float(lastline[11]),
-                                        float(lastline[17]),
-                                        float(lastline[23]),
-                                        float(lastline[29]),
-                                        float(lastline[35])]
-                        self.lUpdated = [True for i in self.lUpdated]
-                except Exception as e:
-                    # ignore all errors and keep old pressures
-                    self.log(str(e))
-                    pass
-            # convert reading from bar to mbar
-            value = self.lValues[indx]/1000.
+        if quant.name in self.dValues:
+            # check if value already measured, if so read new values
+            if not self.dUpdated[quant.name]:
+                self.updateValues()
+            value = self.dValues[quant.name]
+            if quant.name in dIndx:
+                # convert reading from bar to mbar
+                value = value/1000.
             # to mark as used, set value to False
-            self.lUpdated[indx] = False
-        elif quant.name in ['CH1', 'CH2', 'CH5', 'CH6']:
-            try:
-                # find latest temperature log file
-                logFolderPath = self.getValue('BlueFors Log Folder')
-                now = datetime.datetime.now()
-                datestr = '%s-%s-%s' % (str(now.year)[-2:],
-                                        str('{:02d}'.format(now.month)),
-                                        str('{:02d}'.format(now.day)))
-                filePath = '%s/%s/%s T %s.log' % (logFolderPath, datestr,
-                                                  quant.name, datestr)
-                # read all values from text file
-                with open(filePath, 'rb') as f:
-                    data = f.readlines()
-                    lastline = data[-1].split(b',')
-                    value = lastline[2]
-            except Exception as e:
-                # ignore all errors
-                value = 0
-                self.log(str(e))
-                pass
+            self.dUpdated[quant.name] = False
         else:
             value = LabberDriver.performGetValue(self, quant, options)
         return value
 
+    def getLogTail(self, logName):
+        """Get reader for latest log file, switching to a new date folder
+        once the log file of the new day exists"""
+        logFolderPath = self.getValue('BlueFors Log Folder')
+        now = datetime.datetime.now()
+        datestr = '%s-%s-%s' % (str(now.year)[-2:],
+                                str('{:02d}'.format(now.month)),
+                                str('{:02d}'.format(now.day)))
+        filePath = '%s/%s/%s %s.log' % (logFolderPath, datestr, logName,
+                                        datestr)
+        tail = self.dTail.get(logName)
+        if tail is None or (tail.path != filePath and
+                            (os.path.exists(filePath) or
+                             not tail.path.startswith(logFolderPath))):
+            tail = LogTail(filePath)
+            self.dTail[logName] = tail
+        return tail
+
+    def updateValues(self):
+        """Read new values of all pressures and temperatures"""
+        try:
+            # pressures, all channels are in the same line
+            lastline = self.getLogTail('maxigauge').readLastLine()
+            if lastline is not None:
+                lastline = lastline.split(b',')
+                # parse all values before updating, in case of bad lines
+                dValues = {name: float(lastline[5 + 6*indx])
+                           for name, indx in dIndx.items()}
+                self.dValues.update(dValues)
+                self.dUpdated.update({name: True for name in dValues})
+        except Exception as e:
+            # ignore all errors and keep old pressures
+            self.log(str(e))
+        for name in lTempChannels:
+            try:
+                lastline = self.getLogTail('%s T' % name).readLastLine()
+                if lastline is not None:
+                    self.dValues[name] = float(lastline.split(b',')[2])
+                    self.dUpdated[name] = True
+            except Exception as e:
+                # ignore all errors and keep old temperature
+                self.log(str(e))
+
 
 if __name__ == '__main__':
     pass
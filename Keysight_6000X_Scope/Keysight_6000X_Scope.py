@@ -6,6 +6,24 @@ import numpy as np
 class Driver(VISA_Driver):
     """ This class implements the LeCroy scope driver"""
 
+    def performOpen(self, options={}):
+        """Perform the operation of opening the instrument connection"""
+        VISA_Driver.performOpen(self, options=options)
+        # waveform preambles, by channel, cleared when settings change
+        self.dPreamble = dict()
+        # traces from last fetch, by channel
+        self.dTrace = dict()
+
+
+    def performSetValue(self, quant, value, sweepRate=0.0, options={}):
+        """Perform the Set Value instrument operation. This function should
+        return the actual value set by the instrument"""
+        # any setting may change scaling, get new preambles at next fetch
+        self.dPreamble = dict()
+        return VISA_Driver.performSetValue(self, quant, value, sweepRate,
+                                           options)
+
+
     def performGetValue(self, quant, options={}):
         """Perform the Get Value instrument operation"""
         # check type of quantity
@@ -14,32 +32,11 @@ class Driver(VISA_Driver):
             channel = int(quant.name[2])
             # check if channel is on
             if self.getValue('Ch%d - Enabled' % channel):
-                # query range and offset
-                sRange = self.askAndLog('WAV:PRE?', bCheckError=False)
-                lRange = sRange.split(',')
-                #<format 16-bit NR1>, <type 16-bit NR1>, <points 32-bit NR1>, <count 32-bit NR1>,
-                #<xincrement 64-bit floating point NR3>, <xorigin 64-bit floating point NR3>,
-                #<xreference 32-bit NR1>,
-                #<yincrement 32-bit floating point NR3>, <yorigin 32-bit floating point NR3>,
-                #<yreference 32-bit NR1>
-                iStep = 256 if int(lRange[0])==0 else 65536
-                pts = int(lRange[2])
-                dt = float(lRange[4])
-                gain = float(lRange[7])
-                y_offs = float(lRange[8])
-                y_offs_byte = int(lRange[9])
-                # get data as i16, convert to numpy array
-                self.write('WAV:DATA?', bCheckError=False)
-                sHead0 = self.read(n_bytes=10)
-                # strip header to find # of points
-                i0 = sData.find(b'#')
-                nDig = int(sData[i0+1:i0+2])
-                nByte = int(sData[i0+2:i0+2+nDig])
-                # read data, including final line feed
-                sData = self.read(n_bytes=(1+nByte))
-                # get data to numpy array
-                vData = np.frombuffer(sData[:-1], dtype='>f')
-                value = quant.getTraceDict(gain*(vData - y_offs_byte) + y_offs, dt=dt)
+                # get all enabled channels at first call, then use stored data
+                if self.isFirstCall(options) or channel not in self.dTrace:
+                    self.fetchTraces()
+                (vData, dt) = self.dTrace[channel]
+                value = quant.getTraceDict(vData, dt=dt)
             else:
                 # not enabled, return empty array
                 value = quant.getTraceDict([])
@@ -48,7 +45,68 @@ class Driver(VISA_Driver):
             value = VISA_Driver.performGetValue(self, quant, options)
         return value
 
-if __name__ == '__main__':
-    pass
 
+    def fetchTraces(self):
+        """Get data of all enabled channels with a single query"""
+        lChannel = [n for n in range(1, 5)
+                    if self.getValue('Ch%d - Enabled' % n)]
+        if len(lChannel) == 0:
+            return
+        # get preambles of channels without cached values
+        lMissing = [n for n in lChannel if n not in self.dPreamble]
+        if len(lMissing) > 0:
+            self.updatePreambles(lMissing)
+        # query data of all channels, responses are separated by semicolons
+        self.write(';'.join([':WAV:SOUR CHAN%d;:WAV:DATA?' % n
+                             for n in lChannel]), bCheckError=False)
+        lBlock = [self.readBlock() for n in lChannel]
+        for channel, sData in zip(lChannel, lBlock):
+            pre = self.dPreamble[channel]
+            vRaw = np.frombuffer(sData, dtype=pre['dtype'])
+            if len(vRaw) != pre['points']:
+                # number of points changed, get new preamble
+                self.updatePreambles([channel])
+                pre = self.dPreamble[channel]
+                vRaw = np.frombuffer(sData, dtype=pre['dtype'])
+            # scale in place, without temporary arrays
+            vData = np.empty(len(vRaw))
+            np.subtract(vRaw, pre['yreference'], out=vData, dtype=float)
+            vData *= pre['yincrement']
+            vData += pre['yorigin']
+            self.dTrace[channel] = (vData, pre['xincrement'])
 
+
+    def updatePreambles(self, lChannel):
+        """Get waveform preambles for the given channels with a single query"""
+        sPre = self.askAndLog(';'.join([':WAV:SOUR CHAN%d;:WAV:PRE?' % n
+                                        for n in lChannel]),
+                              bCheckError=False)
+        for channel, sRange in zip(lChannel, sPre.strip().split(';')):
+            lRange = sRange.split(',')
+            #<format 16-bit NR1>, <type 16-bit NR1>, <points 32-bit NR1>, <count 32-bit NR1>,
+            #<xincrement 64-bit floating point NR3>, <xorigin 64-bit floating point NR3>,
+            #<xreference 32-bit NR1>,
+            #<yincrement 32-bit floating point NR3>, <yorigin 32-bit floating point NR3>,
+            #<yreference 32-bit NR1>
+            # data is unsigned, words are sent with LSB first
+            self.dPreamble[channel] = dict(
+                dtype='u1' if int(lRange[0]) == 0 else '<u2',
+                points=int(lRange[2]),
+                xincrement=float(lRange[4]),
+                yincrement=float(lRange[7]),
+                yorigin=float(lRange[8]),
+                yreference=int(lRange[9]))
+
+
+    def readBlock(self):
+        """Read definite-length binary block, including the separator or
+        line feed after the block"""
+        sHead = self.read(n_bytes=2, ignore_termination=True)
+        i0 = sHead.find(b'#')
+        nDig = int(sHead[i0+1:i0+2])
+        nByte = int(self.read(n_bytes=nDig, ignore_termination=True))
+        sData = self.read(n_bytes=(1+nByte), ignore_termination=True)
+        return sData[:nByte]
+
+if __name__ == '__main__':
+    pass
@@ -68,5 +68,10 @@ def upgradeDriverCfg(version, dValue={}, dOption=[]):
             label = 'Ch%d - Trig mode' % (n + 1)
             if label in dValue:
                 dValue[label] = rule[dValue[label]]
+
+    elif version == '1.2':
+        # convert version 1.2 -> 1.3
+        # changes: added waveform memory settings, new quantities use defaults
+        version = '1.3'
     # return new version and data
     return (version, dValue, dOption, dQuantReplace)
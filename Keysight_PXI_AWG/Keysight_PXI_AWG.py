@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 import sys
+import hashlib
+from collections import OrderedDict
 from BaseDriver import LabberDriver, Error, IdError
 import numpy as np
 sys.path.append('C:\\Program Files (x86)\\Keysight\\SD1\\Libraries\\Python')
@@ -10,6 +12,156 @@ class UploadFailed(Error):
     """Handling AWG out-of-memory exception"""
     pass
 
+
+class WaveformStore:
+    """Content-addressed store of waveforms in AWG onboard memory.
+
+    Waveforms are identified by a hash of their normalized data, so that
+    identical segments on different channels or sequence elements share one
+    waveform ID and are uploaded only once. The AWG can not release single
+    waveforms, but slots of evicted waveforms are re-used for new waveforms
+    of the same length, in least-recently-used order.
+
+    Parameters
+    ----------
+    awg : keysightSD1.SD_AOU
+        AWG instance.
+    memory_size : int
+        Number of samples available in onboard memory.
+
+    """
+
+    # bytes per sample in onboard memory
+    BYTES_PER_SAMPLE = 2
+
+    def __init__(self, awg, memory_size):
+        self.awg = awg
+        self.memory_size = memory_size
+        self.clear()
+
+    def clear(self):
+        """Forget all waveforms, must be called after flushing the AWG"""
+        # waveform ID of each hash, in least-recently-used order
+        self.waveforms = OrderedDict()
+        # length of each waveform ID
+        self.sizes = dict()
+        # evicted waveform IDs, available for re-use, grouped by length
+        self.free_slots = dict()
+        # samples held by stored waveforms, and by evicted slots
+        self.memory_used = 0
+        self.memory_evicted = 0
+        # waveform ID zero is reserved for the empty delay waveform
+        self.next_id = 1
+        self.pinned = set()
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        """Reset upload statistics and unpin all waveforms"""
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_uploaded = 0
+
+    def get_hit_rate(self):
+        """Get fraction of waveforms that were already in memory"""
+        n_total = self.hits + self.misses
+        return self.hits / n_total if n_total > 0 else 0.0
+
+    def add_reserved(self, waveform_id, data):
+        """Upload waveform with a fixed ID, outside of the content store"""
+        self._load(waveform_id, data, False)
+        self.sizes[waveform_id] = len(data)
+        self.memory_used += len(data)
+
+    def get_capacity(self, size):
+        """Get number of waveforms of given length that can be stored without
+        flushing, assuming no waveforms are pinned"""
+        n_slots = len(self.free_slots.get(size, []))
+        n_slots += sum([self.sizes[waveform_id] == size
+                        for waveform_id in self.waveforms.values()])
+        memory_left = self.memory_size - self.memory_used - self.memory_evicted
+        return n_slots + memory_left // size
+
+    def get_waveform_id(self, data):
+        """Get ID of waveform with given data, upload it if not in memory
+
+        The waveform stays pinned in memory until `reset_statistics` is called,
+        so that it can not be evicted by other waveforms of the same upload.
+
+        Parameters
+        ----------
+        data : numpy array
+            Normalized waveform data, in range [-1, 1].
+
+        Returns
+        -------
+        int
+            Waveform ID in AWG memory.
+
+        """
+        key = (len(data), hashlib.sha1(data.tobytes()).digest())
+        waveform_id = self.waveforms.get(key)
+        if waveform_id is not None:
+            self.waveforms.move_to_end(key)
+            self.hits += 1
+        else:
+            (waveform_id, reload) = self._get_free_slot(len(data))
+            self._load(waveform_id, data, reload)
+            self.sizes[waveform_id] = len(data)
+            self.memory_used += len(data)
+            self.waveforms[key] = waveform_id
+            self.misses += 1
+            self.bytes_uploaded += len(data) * self.BYTES_PER_SAMPLE
+        self.pinned.add(waveform_id)
+        return waveform_id
+
+    def _get_free_slot(self, size):
+        """Get waveform ID for new waveform, evicting old ones if needed
+
+        Returns
+        -------
+        waveform_id : int
+            Waveform ID to use.
+        reload : bool
+            True if the ID is an existing slot that should be overwritten.
+
+        """
+        if self.free_slots.get(size):
+            self.memory_evicted -= size
+            return (self.free_slots[size].pop(), True)
+        # allocate new slot if there is space left, evicted slots can not be
+        # released and still take up onboard memory
+        if (self.memory_used + self.memory_evicted + size <=
+                self.memory_size):
+            waveform_id = self.next_id
+            self.next_id += 1
+            return (waveform_id, False)
+        # out of memory, evict least recently used waveforms until a slot
+        # with matching size becomes available
+        for key, waveform_id in list(self.waveforms.items()):
+            if waveform_id in self.pinned:
+                continue
+            del self.waveforms[key]
+            self.memory_used -= self.sizes[waveform_id]
+            if self.sizes[waveform_id] == size:
+                return (waveform_id, True)
+            self.memory_evicted += self.sizes[waveform_id]
+            self.free_slots.setdefault(self.sizes[waveform_id],
+                                       []).append(waveform_id)
+        raise UploadFailed('Out of waveform memory')
+
+    def _load(self, waveform_id, data, reload):
+        """Upload waveform data to AWG, replacing old data if reload is True"""
+        wave = keysightSD1.SD_Wave()
+        waveformType = 0
+        wave.newFromArrayDouble(waveformType, data)
+        if reload:
+            ret = self.awg.waveformReLoad(wave, waveform_id)
+        else:
+            ret = self.awg.waveformLoad(wave, waveform_id)
+        if ret < 0:
+            raise UploadFailed(keysightSD1.SD_Error.getErrorMessage(ret))
+
 class Driver(LabberDriver):
     """Keysigh PXI AWG"""
 
@@ -58,8 +210,9 @@ class Driver(LabberDriver):
             self.nCh = 4
         # keep track of if waveform was updated
         self.waveform_updated = [False] * self.nCh
-        self.previous_upload = dict()
-        self.waveform_sizes = dict()
+        # waveforms in onboard memory, identified by content
+        self.waveform_store = WaveformStore(
+            self.AWG, int(1E6 * self.getValue('Waveform memory')))
 
         # get hardware version - changes numbering of channels
         hw_version = self.AWG.getHardwareVersion()
@@ -152,6 +305,9 @@ class Driver(LabberDriver):
                 nMask = int(2**self.nCh - 1)
                 self.AWG.AWGtriggerMultiple(nMask)
 
+        elif quant.name == 'Waveform memory':
+            self.waveform_store.memory_size = int(1E6 * value)
+
         elif quant.name in ('Trig delay', 'Delay after end',
                             'Waveform alignment'):
             # TODO doesn't strictly require re-uploading, just re-queue
@@ -212,20 +368,27 @@ class Driver(LabberDriver):
             # do different uploading depending on normal or hardware loop
             if self.isHardwareLoop(options):
                 seq_no, n_seq = self.getHardwareLoopIndex(options)
-                # Reset waveform ID counter if this is the first sequence
+                # start new queues if this is the first sequence, waveforms
+                # already in memory are re-used
                 if seq_no == 0:
-                    self.waveform_counter = 0  # WaveformID counter
-                    self.clearOldWaveforms()
+                    self.waveform_store.reset_statistics()
+                    for ch in awg_channels:
+                        self.AWG.AWGflush(self.getHwCh(ch))
+                    # flush memory if all waveforms may not fit, assuming
+                    # the same length for all sequence elements
+                    size = max([self.getWaveformSize(ch) for ch in awg_channels]
+                               + [10])
+                    n_wave = n_seq * len(awg_channels)
+                    if self.waveform_store.get_capacity(size) < n_wave:
+                        self.clearOldWaveforms()
                 # report status
                 self.reportStatus(
                     'Sending waveform (%d/%d)' % (seq_no + 1, n_seq))
 
-                # always upload all channels in use, regardless of updated
+                # always queue all channels in use, regardless of updated
                 for ch in awg_channels:
-                    # waveform counter is unique id
-                    self.waveform_counter += 1
-                    self.sendWaveform(ch, self.waveform_counter)
-                    self.queueWaveform(ch, self.waveform_counter)
+                    waveform_id = self.sendWaveform(ch)
+                    self.queueWaveform(ch, waveform_id)
                     # configure channel-specific markers
                     self.configureMarker(ch)
                     # configure queue to run in cyclic mode
@@ -250,6 +413,24 @@ class Driver(LabberDriver):
         return value
 
 
+    def performGetValue(self, quant, options={}):
+        """Perform the Get Value instrument operation"""
+        store = self.waveform_store
+        if quant.name == 'Uploaded waveforms':
+            value = store.misses
+        elif quant.name == 'Re-used waveforms':
+            value = store.hits
+        elif quant.name == 'Waveform hit rate':
+            value = store.get_hit_rate()
+        elif quant.name == 'Uploaded data':
+            value = store.bytes_uploaded
+        elif quant.name == 'Waveform memory in use':
+            value = store.memory_used * store.BYTES_PER_SAMPLE
+        else:
+            value = quant.getValue()
+        return value
+
+
     def configureExternalTrigger(self, ch):
         """Configure external trig for given channel"""
         # get parameters
@@ -263,24 +444,18 @@ class Driver(LabberDriver):
     def clearOldWaveforms(self):
         """Flush AWG queue and remove all cached waveforms"""
         self.AWG.waveformFlush()
-        self.previous_upload = {(n + 1): np.array([]) for n in range(self.nCh)}
-        self.waveform_sizes = dict()
+        self.waveform_store.clear()
         # waveform zero is a 50 us empty waveform used for delays
         waveform_id = 0
         data_zero = np.zeros(int(round(50E-6 / self.dt)))
-        wave = keysightSD1.SD_Wave()
-        wave.newFromArrayDouble(0, data_zero)
-        self.AWG.waveformLoad(wave, waveform_id)
-        # update cached parameters
-        self.previous_upload[waveform_id] = data_zero
-        self.waveform_sizes[waveform_id] = len(data_zero)
+        self.waveform_store.add_reserved(waveform_id, data_zero)
 
 
     def uploadAndQueueWaveforms(self):
         """Upload and queue waveforms for all channels in use"""
         awg_channels = self.getAWGChannelsInUse()
-        # waveform memory is shared by all channels, use counter to increment
-        waveform_counter = 0
+        # waveform memory is shared by all channels, only new data is uploaded
+        self.waveform_store.reset_statistics()
 
         for ch in awg_channels:
             # flush queue
@@ -291,15 +466,13 @@ class Driver(LabberDriver):
             self.log('Data shape', data.shape)
             if len(data.shape) == 1:
                 # single traces, upload and queue
-                waveform_counter += 1
-                self.sendWaveform(ch, waveform_counter)
-                self.queueWaveform(ch, waveform_counter)
+                waveform_id = self.sendWaveform(ch)
+                self.queueWaveform(ch, waveform_id)
             else:
                 # 2D data, upload and queue traces by trace
                 for n in range(data.shape[0]):
-                    waveform_counter += 1
-                    self.sendWaveform(ch, waveform_counter, data[n])
-                    self.queueWaveform(ch, waveform_counter)
+                    waveform_id = self.sendWaveform(ch, data[n])
+                    self.queueWaveform(ch, waveform_id)
 
             # configure channel-specific markers
             self.configureMarker(ch)
@@ -325,8 +498,22 @@ class Driver(LabberDriver):
         return int(mask)
 
 
-    def sendWaveform(self, ch, waveform_id, data=None):
-        """Send waveform to AWG channel"""
+    def getWaveformSize(self, ch, data=None):
+        """Get number of samples of waveform after padding to AWG granularity"""
+        if data is None:
+            data = self.getValueArray('Ch%d - Waveform' % (ch + 1))
+        return 10 * int(np.ceil(max(len(data), 30) / 10))
+
+
+    def sendWaveform(self, ch, data=None):
+        """Send waveform to AWG channel, if not already in memory
+
+        Returns
+        -------
+        int
+            Waveform ID of the data in AWG memory.
+
+        """
         # get data from channel, if not available
         if data is None:
             data = self.getValueArray('Ch%d - Waveform' % (ch + 1))
@@ -349,25 +536,12 @@ class Driver(LabberDriver):
         data_norm = data / amp
         data_norm = np.clip(data_norm, -1.0, 1.0, out=data_norm)
 
-        # check if data changed compared to last upload
-        if waveform_id in self.previous_upload:
-            if np.array_equal(data_norm, self.previous_upload[waveform_id]):
-                # data has not changed, no need to upload
-                return
-            # data has changed, update previous value. note: this only happens
-            # for pre-defined waveform_id 1-4, to avoid caching hw looping data
-            self.previous_upload[waveform_id] = data_norm
-        # keep track of waveform lengths
-        self.waveform_sizes[waveform_id] = len(data_norm)
-
-        # upload waveform
-        wave = keysightSD1.SD_Wave()
-        waveformType = 0
-        wave.newFromArrayDouble(waveformType, data_norm)
-        ret = self.AWG.waveformLoad(wave, waveform_id)
-        if ret < 0:
-            self.log('Upload error:', keysightSD1.SD_Error.getErrorMessage(ret))
-            raise UploadFailed()
+        # only uploads data that is not already in memory
+        try:
+            return self.waveform_store.get_waveform_id(data_norm)
+        except UploadFailed as e:
+            self.log('Upload error:', str(e))
+            raise
 
 
     def queueWaveform(self, ch, waveform_id):
@@ -383,7 +557,8 @@ class Driver(LabberDriver):
         delay = int(round(self.getValue('Trig delay') / 10E-9))
         # if aligning waveform to end of trig, adjust delay
         if self.getValue('Waveform alignment') == 'End at trig':
-            delay -= round(self.waveform_sizes[waveform_id] * self.dt / 10E-9)
+            delay -= round(
+                self.waveform_store.sizes[waveform_id] * self.dt / 10E-9)
             # add extra after waveform ends
             delay -= int(round(self.getValue('Delay after end') / 10E-9))
             # raise error if delay is negative
@@ -5,6 +5,10 @@ sys.path.append('C:\Program Files (x86)\Keysight\SD1\Libraries\Python')
 from BaseDriver import LabberDriver, Error, IdError
 import keysightSD1
 
+import ctypes
+import queue
+import threading
+import time
 import numpy as np
 
 
@@ -50,6 +54,8 @@ class Driver(LabberDriver):
             self.nCh = 4
         # create list of sampled data
         self.lTrace = [np.array([])] * self.nCh
+        # timing of DAQ reads in last acquisition
+        self.dReadStats = dict(latency=0.0, max_latency=0.0, throughput=0.0)
         self.dig.openWithSlot(AWGPart, self.chassis, int(self.comCfg.address))
         # get hardware version - changes numbering of channels
         hw_version = self.dig.getHardwareVersion()
@@ -128,7 +134,13 @@ class Driver(LabberDriver):
         else:
             ch, name = None, ''
 
-        if name == 'Signal':
+        if quant.name == 'Read latency':
+            value = self.dReadStats['latency']
+        elif quant.name == 'Max read latency':
+            value = self.dReadStats['max_latency']
+        elif quant.name == 'Read throughput':
+            value = self.dReadStats['throughput']
+        elif name == 'Signal':
             if self.isHardwareLoop(options):
                 return self.getSignalHardwareLoop(ch, quant, options)
             # get traces if first call
@@ -235,12 +247,17 @@ class Driver(LabberDriver):
         # return if not measure
         if not bMeasure:
             return
+        if self.getValue('Acquisition mode') == 'Streaming':
+            self.getTracesStreaming(lCh, nPts, nSeg, nAv, nCyclePerCall)
+            return
         # define number of cycles to read at a time
         nCycleTotal = nSeg * nAv
         nCall = int(np.ceil(nCycleTotal / nCyclePerCall))
         lScale = [(self.getRange(ch) / self.bitRange) for ch in range(self.nCh)]
         # keep track of progress in percent
         old_percent = 0
+        # keep track of time spent in DAQ reads
+        self.readTimer = ReadTimer()
 
         # proceed depending on segment or not segment
         if nSeg <= 1:
@@ -261,8 +278,10 @@ class Driver(LabberDriver):
                 for nCh in lCh:
                     # channel number depens on hardware version
                     ch = self.getHwCh(nCh)
+                    t0 = time.perf_counter()
                     data = self.DAQread(self.dig, ch, nPts * nCycle,
                                         int(1000 + self.timeout_ms / nCall))
+                    self.readTimer.add(time.perf_counter() - t0, data.size)
                     # stop if no data
                     if data.size == 0:
                         return
@@ -310,8 +329,10 @@ class Driver(LabberDriver):
                     for nCh in lCh:
                         # channel number depens on hardware version
                         ch = self.getHwCh(nCh)
+                        t0 = time.perf_counter()
                         data = self.DAQread(self.dig, ch, nPts * nCycle,
                                             int(1000 + self.timeout_ms / nCall))
+                        self.readTimer.add(time.perf_counter() - t0, data.size)
                         # stop if no data
                         if data.size == 0:
                             return
@@ -327,10 +348,111 @@ class Driver(LabberDriver):
 
                 # lT.append('N: %d, Tot %.1f ms' % (n, 1000 * (time.perf_counter() - t0)))
 
+        self.dReadStats = self.readTimer.getStats()
         # # log timing info
         # self.log(': '.join(lT))
 
 
+    def getTracesStreaming(self, lCh, nPts, nSeg, nAv, nCyclePerCall):
+        """Get traces with one reader thread per channel.
+
+        The reader threads keep the DAQ buffers drained by reading into a
+        ring of preallocated buffers, while the calling thread sums the
+        records as integers. Scaling to voltage is applied once at the end.
+        """
+        # split all records in calls of at most nCyclePerCall records
+        nCycleTotal = nSeg * nAv
+        nCall = int(np.ceil(nCycleTotal / nCyclePerCall))
+        lCycles = [min(nCyclePerCall, nCycleTotal - n * nCyclePerCall)
+                   for n in range(nCall)]
+        timeOut = int(1000 + self.timeout_ms / nCall)
+        nRing = 4
+        # ring buffers and free slots for each channel
+        dRing = {nCh: np.zeros((nRing, nPts * max(lCycles)), dtype=np.int16)
+                 for nCh in lCh}
+        dFree = {nCh: queue.Queue() for nCh in lCh}
+        for nCh in lCh:
+            for slot in range(nRing):
+                dFree[nCh].put(slot)
+        qData = queue.Queue()
+        evStop = threading.Event()
+        self.readTimer = ReadTimer()
+        lThread = [threading.Thread(
+            target=self.readChannel,
+            args=(nCh, nPts, lCycles, dRing[nCh], dFree[nCh], qData, evStop,
+                  timeOut))
+            for nCh in lCh]
+        for thread in lThread:
+            thread.start()
+        # integer sums of each segment, and number of records added so far
+        dSum = {nCh: np.zeros((nSeg, nPts), dtype=np.int64) for nCh in lCh}
+        dPos = {nCh: 0 for nCh in lCh}
+        nDone = 0
+        old_percent = 0
+        try:
+            while nDone < len(lCh) * nCall:
+                # break if stopped from outside
+                if self.isStopped():
+                    break
+                try:
+                    (nCh, slot, nCycle) = qData.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                # pass on errors from reader threads
+                if isinstance(slot, Exception):
+                    raise slot
+                # stop if no data
+                if slot is None:
+                    break
+                records = dRing[nCh][slot, :nPts * nCycle].reshape(
+                    (nCycle, nPts))
+                addRecords(dSum[nCh], records, dPos[nCh])
+                dPos[nCh] += nCycle
+                dFree[nCh].put(slot)
+                nDone += 1
+                # report progress, only report integer percent
+                if nCall > 100:
+                    new_percent = int(100 * nDone / (len(lCh) * nCall))
+                    if new_percent > old_percent:
+                        old_percent = new_percent
+                        self.reportStatus(
+                            'Acquiring traces ({}%)'.format(new_percent))
+        finally:
+            # make sure reader threads are not waiting for free buffers
+            evStop.set()
+            for nCh in lCh:
+                dFree[nCh].put(0)
+            for thread in lThread:
+                thread.join()
+        # convert to voltage, including scaling for averaging
+        for nCh in lCh:
+            scale = self.getRange(nCh) / self.bitRange / nAv
+            self.lTrace[nCh] = dSum[nCh].ravel() * scale
+        self.dReadStats = self.readTimer.getStats()
+
+
+    def readChannel(self, nCh, nPts, lCycles, ring, qFree, qData, evStop,
+                    timeOut):
+        """Read data for one channel into ring buffer, run in thread. Errors
+        are put in the data queue, to be raised in the calling thread"""
+        try:
+            ch = self.getHwCh(nCh)
+            for nCycle in lCycles:
+                slot = qFree.get()
+                if evStop.is_set():
+                    return
+                t0 = time.perf_counter()
+                nOut = self.DAQreadInto(
+                    self.dig, ch, ring[slot, :nPts * nCycle], timeOut)
+                self.readTimer.add(time.perf_counter() - t0, max(nOut, 0))
+                if nOut <= 0:
+                    qData.put((nCh, None, 0))
+                    return
+                qData.put((nCh, slot, nCycle))
+        except Exception as e:
+            qData.put((nCh, e, 0))
+
+
     def getRange(self, ch):
         """Get channel range, as voltage.  Index start at 0"""
         rang = float(self.getCmdStringFromValue('Ch%d - Range' % (ch + 1)))
@@ -359,6 +481,18 @@ class Driver(LabberDriver):
             return keysightSD1.SD_Error.MODULE_NOT_OPENED
 
 
+    def DAQreadInto(self, dig, nDAQ, buffer, timeOut):
+        """Read data directly into preallocated int16 numpy array, returns
+        number of points read or negative error code"""
+        if dig._SD_Object__handle > 0:
+            pointer = buffer.ctypes.data_as(
+                ctypes.POINTER(keysightSD1.c_short))
+            return dig._SD_Object__core_dll.SD_AIN_DAQread(
+                dig._SD_Object__handle, nDAQ, pointer, len(buffer), timeOut)
+        else:
+            return keysightSD1.SD_Error.MODULE_NOT_OPENED
+
+
     def getSignalHardwareLoop(self, ch, quant, options):
         """Get data from round-robin type averaging"""
         (seq_no, n_seq) = self.getHardwareLoopIndex(options)
@@ -366,5 +500,63 @@ class Driver(LabberDriver):
         return quant.getTraceDict(self.reshaped_traces[ch][seq_no], dt=self.dt)
 
 
+class ReadTimer():
+    """Time spent in DAQ reads, shared between reader threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        self.nCall = 0
+        self.nPoints = 0
+        self.dTotal = 0.0
+        self.dMax = 0.0
+
+    def add(self, dTime, nPoints):
+        """Add timing of one read call"""
+        with self.lock:
+            self.nCall += 1
+            self.nPoints += nPoints
+            self.dTotal += dTime
+            self.dMax = max(self.dMax, dTime)
+
+    def getStats(self):
+        """Mean and max latency per call, and throughput in bytes/s"""
+        dElapsed = max(time.perf_counter() - self.t0, 1E-9)
+        return dict(latency=self.dTotal / max(self.nCall, 1),
+                    max_latency=self.dMax,
+                    throughput=2 * self.nPoints / dElapsed)
+
+
+def addRecords(mSum, mRecord, nPos):
+    """Add records to integer sums of segments.
+
+    Parameters
+    ----------
+    mSum : numpy array
+        Sum of each segment, shape (nSeg, nPts).
+    mRecord : numpy array
+        Records, shape (nRecord, nPts). Records cycle through the segments.
+    nPos : int
+        Total number of records added before these.
+
+    """
+    nSeg = mSum.shape[0]
+    nRecord = mRecord.shape[0]
+    seg = nPos % nSeg
+    # first records, up to end of segment list
+    n = min(nRecord, nSeg - seg) if seg > 0 else 0
+    if n > 0:
+        mSum[seg:seg + n] += mRecord[:n]
+    # full repetitions of segment list
+    nFull = (nRecord - n) // nSeg
+    if nFull > 0:
+        mSum += mRecord[n:n + nFull * nSeg].reshape(
+            (nFull, nSeg, -1)).sum(0, dtype=np.int64)
+        n += nFull * nSeg
+    # remaining records, starting at first segment
+    if n < nRecord:
+        mSum[:nRecord - n] += mRecord[n:]
+
+
 if __name__ == '__main__':
     pass
@@ -14,9 +14,20 @@ class Error(Exception):
 class Driver(VISA_Driver):
     """ This class implements the LeCroy scope driver"""
 
+    def performOpen(self, options={}):
+        """Perform the operation of opening the instrument connection"""
+        VISA_Driver.performOpen(self, options=options)
+        # waveform descriptors, by channel, cleared when settings change
+        self.dDesc = dict()
+        # traces from last fetch, by channel
+        self.dTrace = dict()
+
+
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
         """Perform the Set Value instrument operation. This function should
         return the actual value set by the instrument"""
+        # any setting may change scaling, get new descriptors at next fetch
+        self.dDesc = dict()
         # update visa commands for triggers
         if quant.name == 'Trig slope':
             sTrig = self.getCmdStringFromValue('Trig source')
@@ -37,34 +48,11 @@ class Driver(VISA_Driver):
             channel = int(quant.name[2])
             # check if channel is on
             if self.getValue('Ch%d - Enabled' % channel):
-                # get waveform descriptor data
-#                sDesc = self.askAndLog('C%d:WF? DESC;' % channel)
-                self.write('C%d:WF? DESC;' % channel, bCheckError=False)
-                sDesc = self.read(ignore_termination=True)
-                # start by finding byte count, skip 9 bytes after
-                indx = sDesc.find(b'#9')
-                sDesc = sDesc[indx+2+9:]
-                # strip out relevant info
-                iFirst = struct.unpack('>i', sDesc[124:128])[0]
-                iLast = struct.unpack('>i', sDesc[128:132])[0]
-                Voffs = struct.unpack('>f', sDesc[160:164])[0]
-                Vgain = struct.unpack('>f', sDesc[156:160])[0]
-                dt = struct.unpack('>f', sDesc[176:180])[0]
-                nPts = struct.unpack('>i', sDesc[116:120])[0]
-    #            self.log(iFirst, iLast, Voffs, Vgain, dt, nPts)
-                #
-                # do a second call to get data, convert to numpy array
-                self.write('C%d:WF? DAT1;' % channel, bCheckError=False)
-                sData = self.read(ignore_termination=True)
-                head = 16
-                # always convert one less point, to avoid length changes
-                iLast -= 1
-                # only extract as much data as we have, to fix bug
-                if len(sData) < (head + (iLast+1)*2):
-                    iLast = (len(sData) - head)//2 - 1
-                vData = np.fromstring(sData[(head + iFirst*2):(head + (iLast+1)*2)], 
-                                      dtype='>h')
-                value = InstrumentQuantity.getTraceDict(vData*Vgain + Voffs, dt=dt)
+                # get all enabled channels at first call, then use stored data
+                if self.isFirstCall(options) or channel not in self.dTrace:
+                    self.fetchTraces()
+                (vData, dt) = self.dTrace[channel]
+                value = InstrumentQuantity.getTraceDict(vData, dt=dt)
             else:
                 # not enabled, return empty array
                 value = InstrumentQuantity.getTraceDict([])
@@ -93,6 +81,50 @@ class Driver(VISA_Driver):
             value = VISA_Driver.performGetValue(self, quant, options)
         return value
 
+
+    def fetchTraces(self):
+        """Get data of all enabled channels"""
+        for channel in range(1, 5):
+            if not self.getValue('Ch%d - Enabled' % channel):
+                continue
+            if channel not in self.dDesc:
+                self.updateDescriptor(channel)
+            # get data, convert to numpy array
+            self.write('C%d:WF? DAT1;' % channel, bCheckError=False)
+            sData = self.read(ignore_termination=True)
+            desc = self.dDesc[channel]
+            head = sData.find(b'#9') + 2 + 9
+            # always convert one less point, to avoid length changes
+            iFirst = desc['first']
+            iLast = desc['last'] - 1
+            # only extract as much data as we have, to fix bug
+            if len(sData) < (head + (iLast+1)*2):
+                iLast = (len(sData) - head)//2 - 1
+            vRaw = np.frombuffer(sData, dtype='>h', offset=head + iFirst*2,
+                                 count=max(iLast + 1 - iFirst, 0))
+            # scale in place, without temporary arrays
+            vData = np.empty(len(vRaw))
+            np.multiply(vRaw, desc['gain'], out=vData, dtype=float)
+            vData += desc['offset']
+            self.dTrace[channel] = (vData, desc['dt'])
+
+
+    def updateDescriptor(self, channel):
+        """Get waveform descriptor data of channel"""
+        self.write('C%d:WF? DESC;' % channel, bCheckError=False)
+        sDesc = self.read(ignore_termination=True)
+        # start by finding byte count, skip 9 bytes after
+        indx = sDesc.find(b'#9')
+        sDesc = sDesc[indx+2+9:]
+        # strip out relevant info
+        self.dDesc[channel] = dict(
+            first=struct.unpack('>i', sDesc[124:128])[0],
+            last=struct.unpack('>i', sDesc[128:132])[0],
+            offset=struct.unpack('>f', sDesc[160:164])[0],
+            gain=struct.unpack('>f', sDesc[156:160])[0],
+            dt=struct.unpack('>f', sDesc[176:180])[0])
+
+
 if __name__ == '__main__':
     pass
 
@@ -2,7 +2,6 @@
 import importlib
 import os
 import sys
-import copy
 
 import numpy as np
 
@@ -11,6 +10,8 @@ from sequence_builtin import (
     CPMG, PulseTrain, Rabi, SpinLocking, ReadoutTraining)
 from sequence_rb import SingleQubit_RB, TwoQubit_RB
 from sequence import SequenceToWaveforms
+from parallel import MultiSequenceCompiler
+import pulses
 import logging
 log = logging.getLogger('LabberDriver')
 
@@ -24,6 +25,34 @@ SEQUENCES = {'Rabi': Rabi,
              'Readout training': ReadoutTraining,
              'Custom': type(None)}
 
+# pulse cache hit/miss counters, as (cache, attribute)
+CACHE_COUNTERS = {'Envelope cache hits': (pulses.envelope_cache, 'hits'),
+                  'Envelope cache misses': (pulses.envelope_cache, 'misses'),
+                  'CZ cache hits': (pulses.cz_cache, 'hits'),
+                  'CZ cache misses': (pulses.cz_cache, 'misses')}
+
+# names of traces of each waveform, with {} replaced by the qubit number
+TRACE_NAMES = {'xy': ('Trace - I{}', 'Trace - Q{}'),
+               'z': ('Trace - Z{}',),
+               'gate': ('Trace - G{}',),
+               'readout_trig': ('Trace - Readout trig',),
+               'readout_iq': ('Trace - Readout I', 'Trace - Readout Q')}
+
+# config values that are results, not settings
+RESULT_PREFIXES = ('Trace - ', 'Voltage, QB', 'Single-shot, QB',
+                   'Updated traces')
+
+
+def _is_equal(a, b):
+    """Check if two config values are equal."""
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        if isinstance(a, dict) and isinstance(b, dict):
+            return (a.keys() == b.keys() and
+                    all(_is_equal(a[key], b[key]) for key in a))
+        return np.array_equal(a, b)
+
 
 class Driver(LabberDriver):
     """This class implements a multi-qubit pulse generator."""
@@ -33,11 +62,20 @@ class Driver(LabberDriver):
         # init variables
         self.sequence = None
         self.sequence_to_waveforms = SequenceToWaveforms(1)
+        self.multi_compiler = MultiSequenceCompiler()
         self.waveforms = {}
+        # config used for the last waveforms, and traces changed by them
+        self.waveform_config = None
+        self.updated_traces = []
         # always create a sequence at startup
         name = self.getValue('Sequence')
         self.sendValueToOther('Sequence', name)
 
+    def performClose(self, bError=False, options={}):
+        """Perform the close instrument connection operation."""
+        self.waveforms = {}
+        self.multi_compiler.close()
+
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
         """Perform the Set Value instrument operation."""
         # only do something here if changing the sequence type
@@ -110,6 +148,14 @@ class Driver(LabberDriver):
             if not quant.name.startswith('Single-shot, QB'):
                 value = np.mean(value)
 
+        elif quant.name == 'Updated traces':
+            value = ', '.join(self.updated_traces)
+
+        elif quant.name in CACHE_COUNTERS:
+            # pulse cache statistics
+            cache, counter = CACHE_COUNTERS[quant.name]
+            value = getattr(cache, counter)
+
         elif quant.isVector():
             # traces, check if waveform needs to be re-calculated
             if self.isConfigUpdated():
@@ -144,52 +190,38 @@ class Driver(LabberDriver):
                         elif training_type == 'All combinations':
                             n_call = 2**self.sequence.n_qubit
 
-                    calls = []
-                    for n in range(n_call):
-                        config[multi_param] += 1
-                        calls.append(
-                            copy.deepcopy(
-                                self.sequence_to_waveforms.get_waveforms(
-                                    self.sequence.get_sequence(config))))
-
-                    # after all calls are done, convert output to matrix form
+                    # compile directly into matrices, optionally in parallel
+                    if config.get('Parallel compilation', False):
+                        self.multi_compiler.n_worker = int(
+                            config.get('Number of worker processes', 0))
+                    else:
+                        self.multi_compiler.n_worker = 1
+                    # drop references to previous matrices before releasing
                     self.waveforms = dict()
-                    n_qubit = self.sequence.n_qubit
-                    # start with xy, z and gate waveforms, list of data
-                    for key in ['xy', 'z', 'gate']:
-                        # get size of longest waveform
-                        self.waveforms[key] = []
-                        for n in range(n_qubit):
-                            log.info('Generating {} waveform for qubit {}'.format(key, n))
-
-                            length = max([len(call[key][n]) for call in calls])
-                            # build matrix
-                            datatype = calls[0][key][n].dtype
-                            data = np.zeros((n_call, length), dtype=datatype)
-                            for m, call in enumerate(calls):
-                                if align_multi_to_end:
-                                    data[m][-len(call[key][n]):] = call[key][n]
-                                else:
-                                    data[m][:len(call[key][n])] = call[key][n]
-                            self.waveforms[key].append(data)
-
-                    # same for readout waveforms
-                    for key in ['readout_trig', 'readout_iq']:
-                        length = max([len(call[key]) for call in calls])
-                        datatype = calls[0][key].dtype
-                        data = np.zeros((n_call, length), dtype=datatype)
-                        for m, call in enumerate(calls):
-                            if align_multi_to_end:
-                                data[m][-len(call[key]):] = call[key]
-                            else:
-                                data[m][:len(call[key])] = call[key]
-                        self.waveforms[key] = data
+                    self.waveforms = self.multi_compiler.compile(
+                        config, self.sequence, self.sequence_to_waveforms,
+                        multi_param, n_call, align_multi_to_end)
+                    self.waveform_config = None
+                    self.updated_traces = self.getTraceNames(
+                        [(key, n) for key in ('xy', 'z', 'gate')
+                         for n in range(self.sequence.n_qubit)] +
+                        [('readout_trig', None), ('readout_iq', None)])
 
                 else:
                     # normal operation, calcluate waveforms
                     # log.info('generating case 2')
+                    # only update waveforms affected by changed settings
+                    update = None
+                    changed = self.getChangedConfig(config)
+                    if changed is not None:
+                        update = self.sequence_to_waveforms.\
+                            get_affected_waveforms(changed)
                     self.waveforms = self.sequence_to_waveforms.get_waveforms(
-                        self.sequence.get_sequence(config))
+                        self.sequence.get_sequence(config), update)
+                    self.multi_compiler.release()
+                    self.waveform_config = dict(config)
+                    self.updated_traces = self.getTraceNames(
+                        self.sequence_to_waveforms.updated_waveforms)
                     # log.info('Z waveform max: {}'.format(np.max(self.waveforms['z'])))
             # get correct data from waveforms stored in memory
             value = self.getWaveformFromMemory(quant)
@@ -198,6 +230,30 @@ class Driver(LabberDriver):
             value = quant.getValue()
         return value
 
+    def getChangedConfig(self, config):
+        """Get names of config values changed since the last waveforms.
+
+        Returns None if the last waveforms were not from a single sequence.
+        """
+        if self.waveform_config is None:
+            return None
+        changed = []
+        for key, value in config.items():
+            if key.startswith(RESULT_PREFIXES) or key in CACHE_COUNTERS:
+                continue
+            if (key not in self.waveform_config or
+                    not _is_equal(value, self.waveform_config[key])):
+                changed.append(key)
+        return changed
+
+    def getTraceNames(self, waveforms):
+        """Get names of traces holding the given waveforms."""
+        names = []
+        for key, n in waveforms:
+            qubit = '' if n is None else n + 1
+            names.extend(name.format(qubit) for name in TRACE_NAMES[key])
+        return names
+
     def getWaveformFromMemory(self, quant):
         """Return data from already calculated waveforms."""
         # check which data to return
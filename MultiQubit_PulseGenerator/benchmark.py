@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Benchmark waveform compilation of the multi-qubit pulse generator.
+
+Randomized benchmarking sequences are compiled with the default driver
+configuration from MultiQubit_PulseGenerator.ini, using both the gate-by-gate
+and the batched compile modes of `SequenceToWaveforms`. The output of the
+two modes is checked to agree to rounding errors, and the hit rate of the
+pulse envelope cache is reported.
+
+Run from the driver folder, for example::
+
+    python benchmark.py --qubits Eight --cliffords 1000
+
+"""
+import argparse
+import configparser
+import os
+import time
+
+import numpy as np
+
+from sequence_rb import SingleQubit_RB, TwoQubit_RB
+from sequence import SequenceToWaveforms
+import pulses
+
+path_currentdir = os.path.dirname(os.path.realpath(__file__))
+
+
+def get_default_config(path=None):
+    """Get driver configuration with default values from the ini file.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to driver ini file, defaults to MultiQubit_PulseGenerator.ini.
+
+    Returns
+    -------
+    dict
+        Configuration in the same format as Labber's driver configuration.
+
+    """
+    if path is None:
+        path = os.path.join(path_currentdir, 'MultiQubit_PulseGenerator.ini')
+    parser = configparser.ConfigParser(strict=False, interpolation=None)
+    parser.optionxform = str
+    parser.read(path)
+    config = dict()
+    for name in parser.sections():
+        section = parser[name]
+        datatype = section.get('datatype', '').upper()
+        value = section.get('def_value', None)
+        if datatype == 'DOUBLE':
+            config[name] = 0.0 if value is None else float(value)
+        elif datatype == 'BOOLEAN':
+            config[name] = value is not None and value in ('1', 'True')
+        elif datatype == 'COMBO':
+            config[name] = (section.get('combo_def_1') if value is None
+                            else value)
+        elif datatype in ('STRING', 'PATH'):
+            config[name] = '' if value is None else value
+    return config
+
+
+def time_compile(config, batch_pulses, n_repeat=3):
+    """Compile waveforms and return the fastest compile time.
+
+    Parameters
+    ----------
+    config : dict
+        Driver configuration.
+    batch_pulses : bool
+        Compile mode of `SequenceToWaveforms`.
+    n_repeat : int
+        Number of compilations to perform.
+
+    Returns
+    -------
+    waveforms : dict
+        The compiled waveforms.
+    float
+        Shortest compile time, in seconds.
+
+    """
+    if config['Sequence'] == '2-QB Randomized Benchmarking':
+        sequence = TwoQubit_RB(1)
+    else:
+        sequence = SingleQubit_RB(1)
+    sequence_to_waveforms = SequenceToWaveforms(1)
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    sequence_to_waveforms.batch_pulses = batch_pulses
+
+    times = []
+    for n in range(n_repeat):
+        seq = sequence.get_sequence(config)
+        t0 = time.perf_counter()
+        waveforms = sequence_to_waveforms.get_waveforms(seq)
+        times.append(time.perf_counter() - t0)
+    return waveforms, min(times)
+
+
+def is_close(waveforms_1, waveforms_2, tol=1e-12):
+    """Check if two sets of waveforms agree to within a tolerance."""
+    for key in ('xy', 'z', 'gate'):
+        for x, y in zip(waveforms_1[key], waveforms_2[key]):
+            if (np.shape(x) != np.shape(y) or
+                    not np.allclose(x, y, rtol=0, atol=tol)):
+                return False
+    for key in ('readout_trig', 'readout_iq'):
+        if (np.shape(waveforms_1[key]) != np.shape(waveforms_2[key]) or
+                not np.allclose(waveforms_1[key], waveforms_2[key],
+                                rtol=0, atol=tol)):
+            return False
+    return True
+
+
+def get_hit_rate(cache):
+    """Get fraction of cache lookups that found a cached item."""
+    n_total = cache.hits + cache.misses
+    return cache.hits / n_total if n_total > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sequence', default='1-QB Randomized Benchmarking',
+                        choices=['1-QB Randomized Benchmarking',
+                                 '2-QB Randomized Benchmarking'])
+    parser.add_argument('--qubits', default='Eight')
+    parser.add_argument('--cliffords', type=int, default=1000)
+    parser.add_argument('--drag', action='store_true')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    config = get_default_config()
+    config['Sequence'] = args.sequence
+    config['Number of qubits'] = args.qubits
+    config['Number of Cliffords'] = args.cliffords
+    config['Use DRAG'] = args.drag
+
+    pulses.envelope_cache.clear()
+    reference, t_reference = time_compile(config, False, args.repeat)
+    cache = pulses.envelope_cache
+    (hits, misses, hit_rate) = (cache.hits, cache.misses, get_hit_rate(cache))
+    batched, t_batched = time_compile(config, True, args.repeat)
+    print('%s, %s qubits, %d Cliffords' %
+          (args.sequence, args.qubits, args.cliffords))
+    print('Gate-by-gate: %.3f s' % t_reference)
+    print('Batched:      %.3f s' % t_batched)
+    print('Speedup:      %.1fx' % (t_reference / t_batched))
+    print('Envelope cache, gate-by-gate: %d hits, %d misses, %.1f%% hit rate'
+          % (hits, misses, 100 * hit_rate))
+    print('Agree:        %s' % is_close(reference, batched))
+
+
+if __name__ == '__main__':
+    main()
@@ -298,139 +298,247 @@ def loadData(file_path):
     print(file_path)
     return data
 
+
+class TwoQubitCliffordGroup(object):
+    """Two-qubit Clifford group with precomputed group tables.
+
+    The 11520 group elements are labeled by their index in
+    `sequence_rb.add_twoQ_clifford`. Gate sequences are composed by integer
+    look-ups in a table holding the product of each native gate with every
+    group element, and the inverse and the cheapest recovery Clifford of each
+    element are tabulated, so that no matrices are multiplied when generating
+    randomized benchmarking sequences.
+
+    Use `get_clifford_group` to get a shared instance for a native gate,
+    since building the tables takes about a second.
+
+    Parameters
+    ----------
+    generator : str {'CZ', 'iSWAP'}
+        Native two-qubit gate.
+
+    Attributes
+    ----------
+    element : np.ndarray of int
+        Element of each Clifford index. Each element is labeled by the
+        smallest index implementing it, up to a global phase.
+    inverse : np.ndarray of int
+        Inverse of each element.
+    recovery : np.ndarray of int
+        Index of the cheapest Clifford inverting each element.
+    state_recovery : np.ndarray of int
+        Index of the cheapest Clifford returning the state prepared by each
+        element from |00> back to |00>.
+    cost : np.ndarray of int, shape (11520, 3)
+        Number of two-qubit gates, single-qubit gates and I gates of each
+        Clifford index. The cheapest Clifford has the fewest two-qubit gates,
+        then the fewest single-qubit gates, then the most I gates.
+
+    """
+
+    n_element = 11520
+    single_qubit_gates = (gates.I, gates.X2p, gates.X2m, gates.Y2p,
+                          gates.Y2m, gates.Xp, gates.Xm, gates.Yp, gates.Ym)
+
+    def __init__(self, generator='CZ'):
+        self.generator = generator
+        self.two_qubit_gate = gates.CZ if generator == 'CZ' else gates.iSWAP
+        n_1qb = len(self.single_qubit_gates)
+        self._gate_index = {id(g): n for n, g in
+                            enumerate(self.single_qubit_gates)}
+        self._gate_index.update({id(gates.CZ): 0, id(gates.iSWAP): 0})
+        # native operations: single-qubit gates on QB1, on QB2, and the
+        # two-qubit gate
+        self.op_2qb = 2 * n_1qb
+        identity = np.identity(2)
+        ops = []
+        for name in ('QB1', 'QB2'):
+            for g in self.single_qubit_gates:
+                m = np.asarray(dict_m1QBGate[Gate_to_strGate(g)])
+                ops.append(np.kron(m, identity) if name == 'QB1' else
+                           np.kron(identity, m))
+        ops.append(np.asarray(dict_m2QBGate[generator]))
+        self.ops = np.array(ops, dtype=complex)
+
+        # operations and cost of all Cliffords
+        self.clifford_ops = []
+        self.cost = np.zeros((self.n_element, 3), dtype=int)
+        for index in range(self.n_element):
+            seq_1, seq_2 = self.get_gates(index)
+            self.clifford_ops.append(self.get_ops(seq_1, seq_2))
+            for g1, g2 in zip(seq_1, seq_2):
+                if self.two_qubit_gate in (g1, g2):
+                    self.cost[index, 0] += 1
+                else:
+                    self.cost[index, 1] += 2
+                self.cost[index, 2] += (g1 == gates.I) + (g2 == gates.I)
+
+        # matrices of all Cliffords, built one operation at a time
+        n_op = max(len(ops) for ops in self.clifford_ops)
+        op_table = np.zeros((self.n_element, n_op), dtype=int)
+        for index, ops in enumerate(self.clifford_ops):
+            op_table[index, :len(ops)] = ops
+        matrices = np.tile(np.identity(4, dtype=complex),
+                           (self.n_element, 1, 1))
+        for n in range(n_op):
+            matrices = np.matmul(self.ops[op_table[:, n]], matrices)
+        self.matrices = matrices
+
+        # label elements by the first index implementing them
+        keys = self._get_keys(matrices)
+        lookup = dict()
+        for index, key in enumerate(keys):
+            lookup.setdefault(key, index)
+        self._lookup = lookup
+        self.element = np.array([lookup[key] for key in keys])
+
+        # product of each native operation with every element
+        self.product = np.array(
+            [self._find(np.matmul(op, matrices)) for op in self.ops])
+        self.inverse = self._find(np.conj(np.swapaxes(matrices, 1, 2)))
+
+        # cheapest Clifford of each element, ties go to the smallest index
+        order = np.lexsort((np.arange(self.n_element), -self.cost[:, 2],
+                            self.cost[:, 1], self.cost[:, 0]))
+        cheapest = np.full(self.n_element, -1)
+        for index in order:
+            if cheapest[self.element[index]] < 0:
+                cheapest[self.element[index]] = index
+        self.cheapest = cheapest[self.element]
+        self.recovery = self.cheapest[self.inverse]
+
+        # cheapest Clifford mapping the state of each element to |00>
+        state_keys = self._get_keys(matrices[:, :, :1])
+        states = dict()
+        for index in order:
+            # inverse of the recovery prepares the same state
+            key = state_keys[self.inverse[self.cheapest[index]]]
+            states.setdefault(key, self.cheapest[index])
+        self.state_recovery = np.array([states[key] for key in state_keys])
+
+    @staticmethod
+    def _get_keys(matrices, decimals=6):
+        """Get hashable keys of matrices, up to a global phase."""
+        flat = matrices.reshape((matrices.shape[0], -1))
+        # all non-zero entries of Clifford matrices have magnitude >= 1/2
+        first = np.argmax(np.abs(flat) > 0.1, axis=1)
+        phase = flat[np.arange(len(flat)), first]
+        flat = np.round(flat * (np.abs(phase) / phase)[:, None], decimals)
+        # adding zero turns -0.0 into 0.0
+        return [row.tobytes() for row in flat + 0.0]
+
+    def _find(self, matrices):
+        """Get elements of Clifford matrices."""
+        return np.array([self._lookup[key] for key in
+                         self._get_keys(matrices)])
+
+    def get_gates(self, index):
+        """Get gate sequences of a Clifford.
+
+        Parameters
+        ----------
+        index : int
+            Clifford index.
+
+        Returns
+        -------
+        (seq_1, seq_2) : tuple of lists
+            Gates applied to QB1 and QB2.
+
+        """
+        seq_1 = []
+        seq_2 = []
+        sequence_rb.add_twoQ_clifford(index, seq_1, seq_2,
+                                      generator=self.generator)
+        return seq_1, seq_2
+
+    def get_ops(self, gate_seq_1, gate_seq_2):
+        """Convert gate sequences to native operations.
+
+        Gates that are not Cliffords in the group are treated as identities,
+        in the same way as `TwoQubit_RB.evaluate_sequence`.
+
+        Parameters
+        ----------
+        gate_seq_1 : list of class Gate
+            The gate sequence applied to QB1.
+        gate_seq_2 : list of class Gate
+            The gate sequence applied to QB2.
+
+        Returns
+        -------
+        list of int
+            Native operations, in the order they are applied.
+
+        """
+        n_1qb = len(self.single_qubit_gates)
+        ops = []
+        for g1, g2 in zip(gate_seq_1, gate_seq_2):
+            for n, g in ((0, g1), (n_1qb, g2)):
+                op = self._gate_index.get(id(g))
+                if op is None:
+                    op = next((m for m, h in
+                               enumerate(self.single_qubit_gates)
+                               if g == h), 0)
+                if op > 0:
+                    ops.append(n + op)
+            if g1 is self.two_qubit_gate or g2 is self.two_qubit_gate:
+                ops.append(self.op_2qb)
+        return ops
+
+    def multiply(self, index_1, index_2):
+        """Get the element of Clifford `index_1` applied after `index_2`."""
+        element = self.element[index_2]
+        for op in self.clifford_ops[index_1]:
+            element = self.product[op, element]
+        return element
+
+    def evaluate_sequence(self, gate_seq_1, gate_seq_2):
+        """Get the group element of a two-qubit gate sequence.
+
+        Parameters
+        ----------
+        gate_seq_1 : list of class Gate
+            The gate sequence applied to QB1.
+        gate_seq_2 : list of class Gate
+            The gate sequence applied to QB2.
+
+        Returns
+        -------
+        int
+            Group element of the sequence.
+
+        """
+        element = 0
+        product = self.product
+        for op in self.get_ops(gate_seq_1, gate_seq_2):
+            element = product[op, element]
+        return int(element)
+
+
+_clifford_groups = dict()
+
+
+def get_clifford_group(generator='CZ'):
+    """Get the two-qubit Clifford group of a native gate.
+
+    The group tables are built on first use and shared afterwards.
+
+    Parameters
+    ----------
+    generator : str {'CZ', 'iSWAP'}
+        Native two-qubit gate.
+
+    Returns
+    -------
+    TwoQubitCliffordGroup
+        The Clifford group.
+
+    """
+    if generator not in _clifford_groups:
+        _clifford_groups[generator] = TwoQubitCliffordGroup(generator)
+    return _clifford_groups[generator]
+
+
 if __name__ == "__main__":
-    # -------------------------------------------------------------------
-    # ----- THIS IS FOR GENERATING RECOVERY CLIFFORD LOOK-UP TABLE ------
-    # -------------------------------------------------------------------
-
-    # Native 2QB Gate ('CZ' or 'iSWAP')
-    generator = 'iSWAP'
-
-    # Start with ground state
-    psi_00 = np.matrix('1;0;0;0')
-    psi_01 = np.matrix('0;1;0;0')
-    psi_10 = np.matrix('0;0;1;0')
-    psi_11 = np.matrix('0;0;0;1')
-
-    N_2QBcliffords = 11520
-    list_stabilizer = []
-    list_psi = []
-    list_recovery_gates_QB1 = []
-    list_recovery_gates_QB2 = []
-    cnt = 0
-
-    # Apply 11520 different 2QB cliffords and get the corresponding stabilizer states
-    for i in range(N_2QBcliffords):
-        if (i/N_2QBcliffords > cnt):
-            print('Running... %d %%'%(cnt*100))
-            cnt = cnt+0.01
-        g = generate_2QB_Cliffords(i, generator = generator)
-
-        final_psi_00 = dot(g, psi_00)
-        final_psi_01 = dot(g, psi_01)
-        final_psi_10 = dot(g, psi_10)
-        final_psi_11 = dot(g, psi_11)
-
-        stabilizer = get_stabilizer(final_psi_00)
-
-        # append only if the state is not in list_stablizier list.
-        if (not (stabilizer in list_stabilizer)):
-            list_stabilizer.append(stabilizer)
-            list_psi.append(final_psi_00)
-            # find the cheapest recovery clifford gates.
-            print('stabilizer state: '+ str(stabilizer))
-            print('Before recovery, final_psi_00: ' + str(final_psi_00.flatten()))
-            print('find the cheapest recovery clifford gate')
-            min_N_2QB_gate = np.inf
-            min_N_1QB_gate = np.inf
-            max_N_I_gate = -np.inf
-            cheapest_index = None
-
-            for j in range(N_2QBcliffords):
-                recovery_gate = generate_2QB_Cliffords(j, generator = generator)
-                seq_QB1 = []
-                seq_QB2 = []
-                # sequence_rb.add_twoQ_clifford(j, seq_QB1, seq_QB2)
-                # print(dot(recovery_gate, final_psi_00))
-                # exit()
-                if ((np.abs(1-np.abs(dot(recovery_gate, final_psi_00)[0,0])) < 1e-6) and
-                    (np.abs(1-np.abs(dot(recovery_gate, final_psi_01)[1,0])) < 1e-6) and
-                    (np.abs(1-np.abs(dot(recovery_gate, final_psi_10)[2,0])) < 1e-6) and
-                    (np.abs(1-np.abs(dot(recovery_gate, final_psi_11)[3,0])) < 1e-6) and
-                    (np.abs(1-dot(recovery_gate, final_psi_01)[1,0]/dot(recovery_gate, final_psi_00)[0,0]) < 1e-6) and
-                    (np.abs(1-dot(recovery_gate, final_psi_10)[2,0]/dot(recovery_gate, final_psi_00)[0,0]) < 1e-6) and
-                    (np.abs(1-dot(recovery_gate, final_psi_11)[3,0]/dot(recovery_gate, final_psi_00)[0,0]) < 1e-6)
-                    ):
-
-                    print(dot(recovery_gate, final_psi_00)[0,0],dot(recovery_gate, final_psi_01)[1,0],dot(recovery_gate, final_psi_10)[2,0],dot(recovery_gate, final_psi_11)[3,0])
-                    # if the gate is recovery, check if it is the cheapest.
-
-                    # Less 2QB Gates, Less 1QB Gates, and More I Gates = the cheapest gates.
-                    # The priority: less 2QB gates > less 1QB gates > more I gates
-                    N_2QB_gate, N_1QB_gate, N_I_gate = 0, 0, 0
-
-                    # count the numbers of the gates
-                    for k in range(len(seq_QB1)):
-                        if (seq_QB1[k] == gates.CZ or seq_QB2[k] == gates.CZ):
-                            N_2QB_gate += 1
-                        else:
-                            N_1QB_gate += 2
-                        if (seq_QB1[k] == gates.I):
-                            N_I_gate += 1
-                        if (seq_QB2[k] == gates.I):
-                            N_I_gate += 1
-
-                    # check whether it is the cheapest
-                    # if it has less 2QB gates, always update it.
-                    if (N_2QB_gate < min_N_2QB_gate):
-                        min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                        print('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                    else:
-                        # if it has equal # of 2QB gates and less 1QB gates, update it.
-                        if (N_2QB_gate == min_N_2QB_gate and
-                            N_1QB_gate < min_N_1QB_gate):
-                            min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                            print('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                        else:
-                            # if it has equal # of 2QB & 1QB gates, and more 1QB gates, update it.
-                            if (N_2QB_gate == min_N_2QB_gate and
-                                N_1QB_gate == min_N_1QB_gate and
-                                N_I_gate >= max_N_I_gate):
-                                min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                                print('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-
-
-
-            seq_recovery_QB1 = []
-            seq_recovery_QB2 = []
-            sequence_rb.add_twoQ_clifford(cheapest_index, seq_recovery_QB1, seq_recovery_QB2)
-
-            # remove redundant Identity gates
-            index_identity = [] # find where Identity gates are
-            for p in range(len(seq_recovery_QB1)):
-                if (seq_recovery_QB1[p] == gates.I and seq_recovery_QB2[p] == gates.I):
-                    index_identity.append(p)
-            seq_recovery_QB1 = [m for n, m in enumerate(seq_recovery_QB1) if n not in index_identity]
-            seq_recovery_QB2 = [m for n, m in enumerate(seq_recovery_QB2) if n not in index_identity]
-
-            # convert the sequences into the text-format (Avoid using customized python class objects)
-            for _seq in [seq_recovery_QB1, seq_recovery_QB2]:
-                for q in range(len(_seq)):
-                    _seq[q] = Gate_to_strGate(_seq[q])
-            list_recovery_gates_QB1.append(seq_recovery_QB1)
-            list_recovery_gates_QB2.append(seq_recovery_QB2)
-            print('The cheapest recovery clifford gate (QB1): ' + str(seq_recovery_QB1))
-            print('The cheapest recovery clifford gate (QB2): ' + str(seq_recovery_QB2))
-            print('\n')
-
-    # save the results.
-    dict_result ={}
-    dict_result['psi_stabilizer'] = list_stabilizer
-    dict_result['psi'] = list_psi
-    dict_result['recovery_gates_QB1'] = list_recovery_gates_QB1
-    dict_result['recovery_gates_QB2'] = list_recovery_gates_QB2
-    saveData('recovery_rb_table_iSWAP.pickle', dict_result)
-
-    # load the results.
-    # dict_result =loadData('recovery_rb_table.dill')
-    # print(dict_result['psi_stabilizer'])
+    pass
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+"""Compile multiple randomizations of a sequence in parallel.
+
+Each randomization is compiled with a different value of a configuration
+parameter, for example 'Randomize' for randomized benchmarking. A pool of
+worker processes compiles the randomizations and writes the waveforms
+directly into matrices in shared memory, with one row per randomization.
+
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# gates must be imported before sequence, since gates imports from sequence
+import gates  # noqa: F401
+from sequence import SequenceToWaveforms
+
+log = logging.getLogger('LabberDriver')
+
+# waveforms with one array per qubit, and waveforms with a single array
+QUBIT_KEYS = ('xy', 'z', 'gate')
+READOUT_KEYS = ('readout_trig', 'readout_iq')
+
+
+def _attach_shared_memory(name):
+    """Attach to existing shared memory, without tracking its lifetime.
+
+    The process that created the memory is responsible for releasing it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13, workers share the resource tracker of the parent
+        return shared_memory.SharedMemory(name=name)
+
+
+def _detach_shared_memory(shm):
+    """Close shared memory, but leave the mapping to existing views.
+
+    Numpy arrays created from `shm.buf` keep a reference to it, but do not
+    prevent `shm.close()` from unmapping the memory. Instead the references
+    of `shm` are dropped, so that the memory is unmapped once the last array
+    using it is deleted.
+    """
+    shm._buf = None
+    shm._mmap = None
+    if getattr(shm, '_fd', -1) >= 0:
+        os.close(shm._fd)
+        shm._fd = -1
+
+
+class WaveformBuffer(object):
+    """Matrices holding the waveforms of multiple randomizations.
+
+    Each row holds the waveforms of one randomization. Rows are padded with
+    zeros, at the end or at the start if `align_to_end` is True.
+
+    Parameters
+    ----------
+    n_call : int
+        Number of randomizations.
+    fields : list of tuple
+        The waveforms to store, as (key, qubit, dtype, capacity). The qubit
+        is None for readout waveforms.
+    align_to_end : bool
+        If True, waveforms are aligned to the end of the rows.
+    shared : bool
+        If True, the matrices are allocated in shared memory.
+    name : str, optional
+        Name of existing shared memory to attach to.
+
+    """
+
+    def __init__(self, n_call, fields, align_to_end=False, shared=False,
+                 name=None):
+        self.n_call = n_call
+        self.fields = [(key, n, np.dtype(dtype), capacity)
+                       for (key, n, dtype, capacity) in fields]
+        self.align_to_end = align_to_end
+        # waveform lengths of each row, main and readout
+        self.lengths = np.zeros((n_call, 2), dtype=int)
+        size = sum(n_call * capacity * dtype.itemsize
+                   for (key, n, dtype, capacity) in self.fields)
+        self._owner = name is None
+        if name is not None:
+            self._shm = _attach_shared_memory(name)
+            buf = self._shm.buf
+        elif shared:
+            self._shm = shared_memory.SharedMemory(create=True,
+                                                   size=max(size, 1))
+            buf = self._shm.buf
+        else:
+            self._shm = None
+            buf = bytearray(size)
+        # create matrices in the buffer
+        self.data = dict()
+        offset = 0
+        for (key, n, dtype, capacity) in self.fields:
+            self.data[(key, n)] = np.ndarray(
+                (n_call, capacity), dtype=dtype, buffer=buf, offset=offset)
+            offset += n_call * capacity * dtype.itemsize
+
+    @classmethod
+    def from_waveforms(cls, n_call, n_qubit, waveforms, margin=0.0,
+                       align_to_end=False, shared=False):
+        """Create buffer with room for waveforms like the given ones.
+
+        Parameters
+        ----------
+        n_call : int
+            Number of randomizations.
+        n_qubit : int
+            Number of qubits.
+        waveforms : dict
+            Waveforms of one randomization, as returned by
+            `SequenceToWaveforms.get_waveforms`.
+        margin : float
+            Extra room for longer waveforms, relative to the given ones.
+        align_to_end : bool
+            If True, waveforms are aligned to the end of the rows.
+        shared : bool
+            If True, the matrices are allocated in shared memory.
+
+        Returns
+        -------
+        WaveformBuffer
+            The buffer.
+
+        """
+        length, length_readout = cls.get_lengths(waveforms, n_qubit)
+        capacity = int(np.ceil(length * (1 + margin)))
+        capacity_readout = int(np.ceil(length_readout * (1 + margin)))
+        fields = []
+        for key in QUBIT_KEYS:
+            for n in range(n_qubit):
+                fields.append(
+                    (key, n, waveforms[key][n].dtype, capacity))
+        for key in READOUT_KEYS:
+            fields.append(
+                (key, None, waveforms[key].dtype, capacity_readout))
+        return cls(n_call, fields, align_to_end, shared)
+
+    @staticmethod
+    def get_lengths(waveforms, n_qubit):
+        """Get length of main and readout waveforms."""
+        length = max([len(waveforms[key][n])
+                      for key in QUBIT_KEYS for n in range(n_qubit)])
+        length_readout = max([len(waveforms[key]) for key in READOUT_KEYS])
+        return length, length_readout
+
+    @property
+    def capacity(self):
+        """Room for main and readout waveforms in each row."""
+        capacity = [0, 0]
+        for (key, n, dtype, c) in self.fields:
+            i = 0 if n is not None else 1
+            capacity[i] = max(capacity[i], c)
+        return tuple(capacity)
+
+    def get_layout(self):
+        """Get description of buffer in shared memory, for `attach`."""
+        return dict(n_call=self.n_call, name=self._shm.name,
+                    align_to_end=self.align_to_end,
+                    fields=[(key, n, dtype.str, capacity)
+                            for (key, n, dtype, capacity) in self.fields])
+
+    @classmethod
+    def attach(cls, layout):
+        """Attach to a buffer in shared memory created by another process.
+
+        Parameters
+        ----------
+        layout : dict
+            Buffer description, from `get_layout`.
+
+        Returns
+        -------
+        WaveformBuffer
+            The buffer.
+
+        """
+        return cls(layout['n_call'], layout['fields'],
+                   layout['align_to_end'], name=layout['name'])
+
+    def _get_slice(self, length, capacity):
+        """Get slice of row holding waveform of given length."""
+        if self.align_to_end:
+            return slice(capacity - length, capacity)
+        return slice(0, length)
+
+    def write(self, m, waveforms):
+        """Write waveforms of a randomization to a row.
+
+        Nothing is written if the waveforms do not fit in the row.
+
+        Parameters
+        ----------
+        m : int
+            Index of randomization.
+        waveforms : dict
+            Waveforms, as returned by `SequenceToWaveforms.get_waveforms`.
+
+        Returns
+        -------
+        (length, length_readout) : tuple of int
+            Length of main and readout waveforms.
+
+        """
+        n_qubit = max([n + 1 for (key, n, dtype, c) in self.fields
+                       if n is not None] + [0])
+        lengths = self.get_lengths(waveforms, n_qubit)
+        self.lengths[m] = lengths
+        if not self.fits(lengths):
+            return lengths
+        for (key, n, dtype, capacity) in self.fields:
+            value = waveforms[key] if n is None else waveforms[key][n]
+            self.data[(key, n)][m, self._get_slice(len(value), capacity)] = \
+                value
+        return lengths
+
+    def fits(self, lengths):
+        """Check if waveforms of the given lengths fit in a row."""
+        return all(np.less_equal(lengths, self.capacity))
+
+    def resize(self, lengths):
+        """Create a larger buffer, with the data of this buffer.
+
+        Parameters
+        ----------
+        lengths : (length, length_readout) : tuple of int
+            Length of main and readout waveforms that must fit.
+
+        Returns
+        -------
+        WaveformBuffer
+            The new buffer. This buffer is closed.
+
+        """
+        capacity = np.maximum(lengths, self.capacity)
+        return self.copy(capacity, shared=self._shm is not None)
+
+    def copy(self, capacity=None, shared=False):
+        """Copy data to a new buffer.
+
+        Parameters
+        ----------
+        capacity : (capacity, capacity_readout) : tuple of int, optional
+            Room for main and readout waveforms in the new buffer, default
+            is the capacity of this buffer.
+        shared : bool
+            If True, the new matrices are allocated in shared memory.
+
+        Returns
+        -------
+        WaveformBuffer
+            The new buffer. This buffer is closed.
+
+        """
+        if capacity is None:
+            capacity = self.capacity
+        fields = [(key, n, dtype, capacity[0 if n is not None else 1])
+                  for (key, n, dtype, c) in self.fields]
+        buffer = WaveformBuffer(self.n_call, fields, self.align_to_end,
+                                shared=shared)
+        buffer.lengths[:] = self.lengths
+        for (key, n, dtype, c) in self.fields:
+            new_capacity = capacity[0 if n is not None else 1]
+            buffer.data[(key, n)][:, self._get_slice(c, new_capacity)] = \
+                self.data[(key, n)]
+        self.close()
+        return buffer
+
+    def get_waveforms(self):
+        """Get waveforms as matrices, trimmed to the longest row.
+
+        The matrices are views of the buffer. For buffers in shared memory,
+        the buffer must be kept open while they are in use.
+
+        Returns
+        -------
+        dict
+            Waveforms, with one row per randomization.
+
+        """
+        lengths = np.max(self.lengths, axis=0)
+        waveforms = {key: [] for key in QUBIT_KEYS}
+        for (key, n, dtype, capacity) in self.fields:
+            length = lengths[0 if n is not None else 1]
+            data = self.data[(key, n)][:, self._get_slice(length, capacity)]
+            if n is None:
+                waveforms[key] = data
+            else:
+                waveforms[key].append(data)
+        return waveforms
+
+    def close(self):
+        """Release the buffer memory.
+
+        Shared memory is unlinked right away, but stays mapped until all
+        views of the matrices are deleted.
+        """
+        self.data = dict()
+        if self._shm is not None:
+            if self._owner:
+                self._shm.unlink()
+            _detach_shared_memory(self._shm)
+            self._shm = None
+
+
+# sequence objects of worker process
+_worker = dict()
+
+
+def _init_worker(paths):
+    """Make the driver and custom sequence modules importable."""
+    for path in paths:
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def _compile_in_worker(config, sequence_class, multi_param, tasks, layout):
+    """Compile randomizations in a worker process.
+
+    Parameters
+    ----------
+    config : dict
+        Driver configuration.
+    sequence_class : tuple of str
+        Module and name of the class of the sequence to compile.
+    multi_param : str
+        Configuration parameter to change for each randomization.
+    tasks : list of tuple
+        Randomizations to compile, as (index, parameter value).
+    layout : dict
+        Description of shared waveform buffer.
+
+    Returns
+    -------
+    list of tuple
+        Index and (length, length_readout) of each randomization.
+
+    """
+    if _worker.get('class') != sequence_class:
+        # import here, so that import errors are passed to the caller
+        module = importlib.import_module(sequence_class[0])
+        _worker['sequence'] = getattr(module, sequence_class[1])(1)
+        _worker['class'] = sequence_class
+        _worker['sequence_to_waveforms'] = SequenceToWaveforms(1)
+    sequence = _worker['sequence']
+    sequence_to_waveforms = _worker['sequence_to_waveforms']
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+
+    buffer = WaveformBuffer.attach(layout)
+    results = []
+    try:
+        for (m, value) in tasks:
+            config[multi_param] = value
+            waveforms = sequence_to_waveforms.get_waveforms(
+                sequence.get_sequence(config))
+            results.append((m, buffer.write(m, waveforms)))
+    finally:
+        buffer.close()
+    return results
+
+
+class MultiSequenceCompiler(object):
+    """Compile multiple randomizations of a sequence.
+
+    The randomizations are written directly into preallocated matrices,
+    with one row per randomization. If more than one worker process is
+    used, the matrices are in shared memory and the randomizations are
+    compiled in parallel. The parameter value of randomization `m` is
+    always `start + m + 1`, so the output does not depend on the number of
+    workers.
+
+    Parameters
+    ----------
+    n_worker : int
+        Number of worker processes. Use 0 for one per CPU core, and 1 to
+        compile in the calling process.
+    timeout : float
+        Max time in seconds for compiling in worker processes.
+
+    """
+
+    def __init__(self, n_worker=1, timeout=600.0):
+        self.n_worker = n_worker
+        self.timeout = timeout
+        self.buffer = None
+        self._pool = None
+        self._pool_config = None
+
+    def _get_pool(self, n_worker, paths):
+        """Get worker pool, create new pool if settings changed."""
+        if self._pool_config != (n_worker, paths):
+            self.close_pool()
+            # spawn workers, since forking a process with threads is unsafe
+            context = multiprocessing.get_context('spawn')
+            self._pool = context.Pool(n_worker, initializer=_init_worker,
+                                      initargs=(paths,))
+            self._pool_config = (n_worker, paths)
+        return self._pool
+
+    def close_pool(self):
+        """Stop worker processes."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._pool_config = None
+
+    def release(self):
+        """Release the memory of the last compiled waveforms.
+
+        The returned waveforms are views of the buffer. References to them
+        should be dropped first, but they stay valid if still in use.
+        """
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def close(self):
+        """Stop worker processes and release memory."""
+        self.close_pool()
+        self.release()
+
+    def compile(self, config, sequence, sequence_to_waveforms, multi_param,
+                n_call, align_to_end=False):
+        """Compile randomizations of a sequence.
+
+        Parameters
+        ----------
+        config : dict
+            Driver configuration. When done, `multi_param` holds the value
+            of the last randomization.
+        sequence : :obj:`Sequence`
+            The sequence to compile.
+        sequence_to_waveforms : :obj:`SequenceToWaveforms`
+            Waveform compiler, with parameters set from `config`.
+        multi_param : str
+            Configuration parameter to change for each randomization.
+        n_call : int
+            Number of randomizations.
+        align_to_end : bool
+            If True, waveforms are aligned to the end.
+
+        Returns
+        -------
+        dict
+            Waveforms, as matrices with one row per randomization. The
+            matrices are views of a buffer kept until the next compilation
+            or `release`.
+
+        """
+        self.release()
+        values = [config[multi_param] + m + 1 for m in range(n_call)]
+        n_worker = self.n_worker if self.n_worker > 0 else os.cpu_count()
+        n_worker = max(1, min(n_worker, n_call - 1))
+
+        # compile first randomization here, to get size of waveforms
+        config[multi_param] = values[0]
+        waveforms = sequence_to_waveforms.get_waveforms(
+            sequence.get_sequence(config))
+        # leave room for randomizations with longer waveforms
+        margin = 0.25 if config.get('Trim waveform to sequence') else 0.0
+        buffer = WaveformBuffer.from_waveforms(
+            n_call, sequence.n_qubit, waveforms, margin, align_to_end,
+            shared=n_worker > 1)
+        buffer.write(0, waveforms)
+
+        try:
+            pending = list(range(1, n_call))
+            while len(pending) > 0:
+                if n_worker > 1:
+                    results = self._compile_parallel(
+                        config, sequence, multi_param, values, pending,
+                        buffer, n_worker)
+                else:
+                    results = []
+                    for m in pending:
+                        config[multi_param] = values[m]
+                        waveforms = sequence_to_waveforms.get_waveforms(
+                            sequence.get_sequence(config))
+                        lengths = buffer.write(m, waveforms)
+                        if not buffer.fits(lengths):
+                            # make room and write again
+                            buffer = buffer.resize(lengths)
+                            buffer.write(m, waveforms)
+                        results.append((m, lengths))
+                # randomizations that did not fit are compiled again
+                pending = []
+                for (m, lengths) in results:
+                    buffer.lengths[m] = lengths
+                    if not buffer.fits(lengths):
+                        pending.append(m)
+                if len(pending) > 0:
+                    log.info('Resizing waveform buffer for %d '
+                             'randomizations' % len(pending))
+                    buffer = buffer.resize(np.max(buffer.lengths, axis=0))
+        except BaseException:
+            # release shared memory if compilation fails
+            buffer.close()
+            raise
+
+        config[multi_param] = values[-1]
+        # keep buffer until the next compilation, waveforms are views of it
+        self.buffer = buffer
+        return buffer.get_waveforms()
+
+    def _compile_parallel(self, config, sequence, multi_param, values,
+                          indices, buffer, n_worker):
+        """Compile randomizations in worker processes."""
+        module = sys.modules[type(sequence).__module__]
+        sequence_class = (module.__name__, type(sequence).__name__)
+        paths = (os.path.dirname(os.path.realpath(__file__)),
+                 os.path.dirname(os.path.realpath(module.__file__)))
+        pool = self._get_pool(n_worker, paths)
+        # split work in a few chunks per worker, for load balancing
+        n_chunk = min(len(indices), 4 * n_worker)
+        layout = buffer.get_layout()
+        jobs = []
+        for chunk in np.array_split(indices, n_chunk):
+            tasks = [(int(m), values[m]) for m in chunk]
+            jobs.append(pool.apply_async(
+                _compile_in_worker,
+                (config, sequence_class, multi_param, tasks, layout)))
+        # errors in the workers are raised by get()
+        results = []
+        deadline = time.monotonic() + self.timeout
+        try:
+            for job in jobs:
+                results.extend(
+                    job.get(max(deadline - time.monotonic(), 0.0)))
+        except multiprocessing.TimeoutError:
+            # workers may have died, start new ones next time
+            self.close_pool()
+            raise RuntimeError(
+                'Parallel compilation did not finish within %g s' %
+                self.timeout)
+        return results
+
+
+if __name__ == '__main__':
+    pass
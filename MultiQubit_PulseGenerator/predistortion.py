@@ -14,6 +14,43 @@ import numpy as np
 from numpy.fft import fft, fftfreq, fftshift, ifft, ifftshift
 from scipy.interpolate import interp1d
 
+from pulses import PulseCache
+
+# inverse filters in the frequency domain, keyed by filter parameters,
+# number of points and time step
+filter_cache = PulseCache(32)
+
+
+def predistort_waveforms(predistortions, waveforms):
+    """Predistort multiple waveforms, with one FFT for each waveform size.
+
+    Parameters
+    ----------
+    predistortions : list of Predistortion or ExponentialPredistortion
+        Predistortion of each waveform.
+    waveforms : list of numpy array
+        Waveforms to be pre-distorted.
+
+    Returns
+    -------
+    list of numpy array
+        Pre-distorted waveforms.
+
+    """
+    # group waveforms with the same type of predistortion and FFT size
+    groups = dict()
+    for n, (p, waveform) in enumerate(zip(predistortions, waveforms)):
+        key = (type(p), len(waveform), p.get_fft_size(len(waveform)))
+        groups.setdefault(key, []).append(n)
+    result = [None] * len(waveforms)
+    for (cls, length, n_fft), indices in groups.items():
+        values = cls.predistort_batch(
+            [predistortions[n] for n in indices],
+            np.array([waveforms[n] for n in indices]), n_fft)
+        for n, value in zip(indices, values):
+            result[n] = value
+    return result
+
 
 class Predistortion(object):
     """This class is used to predistort I/Q waveforms for qubit XY control."""
@@ -21,6 +58,8 @@ class Predistortion(object):
     def __init__(self, waveform_number=0):
         # define variables
         self.transfer_path = ''
+        # identifies the loaded transfer function data in the filter cache
+        self.transfer_key = None
         # keep track of which Labber waveform this predistortion refers to
         self.waveform_number = waveform_number
         # TODO(dan): define variables for predistortion algorithm
@@ -53,6 +92,7 @@ class Predistortion(object):
         """
         # store new path
         self.transfer_path = path
+        self.transfer_key = None
 
         # return directly if not in use, look for both '' and '.'
         if self.transfer_path.strip() in ('', '.'):
@@ -63,6 +103,10 @@ class Predistortion(object):
             y_channel=0)
         self.vResponse_freqs, self.vFilteredResponse_FFT_Q = f.getTraceXY(
             y_channel=1)
+        # the file may have been re-measured, identify filters by the data
+        self.transfer_key = hash((self.vResponse_freqs.tobytes(),
+                                  self.vFilteredResponse_FFT_I.tobytes(),
+                                  self.vFilteredResponse_FFT_Q.tobytes()))
         # TODO(dan): load transfer function data
 
     def predistort(self, waveform):
@@ -79,9 +123,39 @@ class Predistortion(object):
             Pre-distorted waveform
 
         """
-        # find timespan of waveform
-        self.tvals = np.arange(0, self.dt * len(waveform), self.dt)
+        return self.predistort_batch([self], waveform[np.newaxis], None)[0]
+
+    def get_fft_size(self, n):
+        """Get FFT size for a waveform with `n` points."""
+        return n
+
+    def get_inverse(self, n):
+        """Get inverse response for waveforms with `n` points.
+
+        The real and imaginary parts of a waveform are distorted
+        differently. With the waveform spectrum X(f), the pre-distorted
+        spectrum is X(f) * P(f) + conj(X(-f)) * Q(f).
+
+        Parameters
+        ----------
+        n : int
+            Number of points.
+
+        Returns
+        -------
+        (P, Q) : tuple of complex numpy array
+            Inverse response, in FFT frequency order.
 
+        """
+        key = ('xy', self.transfer_path, self.transfer_key, n, self.dt)
+        inverse = filter_cache.get(key)
+        if inverse is None:
+            inverse = self._calculate_inverse(n)
+            filter_cache.put(key, inverse)
+        return inverse
+
+    def _calculate_inverse(self, n):
+        """Calculate inverse response, see `get_inverse`."""
         response_I = ifft(ifftshift(self.vFilteredResponse_FFT_I))
         response_FFT_I_r = fftshift(fft(complex(1, 0) * response_I.real))
         response_FFT_I_i = fftshift(fft(complex(1, 0) * response_I.imag))
@@ -106,23 +180,42 @@ class Predistortion(object):
         Inverse_C = interp1d(self.vResponse_freqs, Zc)
         Inverse_D = interp1d(self.vResponse_freqs, Zd)
 
-        # applies the interpolated inverse function to the AWG signal
-
-        fft_vals, fft_signal_r = self.apply_FFT(
-            self.tvals, complex(1, 0) * waveform.real)
-        fft_vals, fft_signal_i = self.apply_FFT(
-            self.tvals, complex(1, 0) * waveform.imag)
+        # the corrected spectrum is R * (A + iC) + J * (B + iD), where the
+        # spectra of the real and imaginary parts R and J are given by the
+        # spectrum X of the waveform as (X(f) + conj(X(-f))) / 2 and
+        # (X(f) - conj(X(-f))) / 2i
+        fft_vals = fftfreq(n, self.dt)
+        inverse_r = Inverse_A(fft_vals) + 1j * Inverse_C(fft_vals)
+        inverse_i = Inverse_B(fft_vals) + 1j * Inverse_D(fft_vals)
+        P = (inverse_r - 1j * inverse_i) / 2
+        Q = (inverse_r + 1j * inverse_i) / 2
+        return P, Q
+
+    @staticmethod
+    def predistort_batch(predistortions, waveforms, n_fft):
+        """Predistort waveforms of equal length with one batched FFT.
 
-        fft_signal = (fft_signal_r * Inverse_A(fft_vals) + fft_signal_i *
-                      Inverse_B(fft_vals) + 1j *
-                      (fft_signal_r * Inverse_C(fft_vals) +
-                       fft_signal_i * Inverse_D(fft_vals)))
-        corr_signal = ifft(ifftshift(fft_signal))
+        Parameters
+        ----------
+        predistortions : list of Predistortion
+            Predistortion of each waveform.
+        waveforms : complex numpy array, shape (n_waveform, n)
+            Waveforms to be pre-distorted.
+        n_fft : int
+            Not used, the FFT size is the waveform length.
 
-        vI = np.array(corr_signal.real, dtype='float64')
-        vQ = np.array(corr_signal.imag, dtype='float64')
+        Returns
+        -------
+        complex numpy array
+            Pre-distorted waveforms.
 
-        return vI + 1j * vQ
+        """
+        n = waveforms.shape[1]
+        P, Q = zip(*[p.get_inverse(n) for p in predistortions])
+        X = fft(waveforms, axis=-1)
+        # spectrum at negative frequencies, X(-f)
+        X_neg = np.roll(X[:, ::-1], 1, axis=-1)
+        return ifft(X * np.array(P) + np.conj(X_neg) * np.array(Q), axis=-1)
 
     def apply_FFT(self, tvals, signal):
         fft_signal = fftshift(fft(signal))
@@ -209,14 +302,29 @@ class ExponentialPredistortion:
             Pre-distorted waveform
 
         """
+        return self.predistort_batch(
+            [self], waveform[np.newaxis],
+            self.get_fft_size(len(waveform)))[0]
+
+    def get_fft_size(self, n):
+        """Get FFT size for a waveform with `n` points, including padding."""
         # pad with zeros at end to make sure response has time to go to zero
         pad_time = 6 * max([self.tau1, self.tau2, self.tau3, self.tau4])
-        padded = np.zeros(len(waveform) + round(pad_time / self.dt))
-        padded[:len(waveform)] = waveform
-
-        Y = np.fft.rfft(padded, norm='ortho')
-
-        omega = 2 * np.pi * np.fft.rfftfreq(len(padded), self.dt)
+        return n + round(pad_time / self.dt)
+
+    def get_inverse(self, n_fft):
+        """Get inverse response 1/H for FFTs with `n_fft` points."""
+        key = ('z', self.A1, self.tau1, self.A2, self.tau2, self.A3,
+               self.tau3, self.A4, self.tau4, n_fft, self.dt)
+        inverse = filter_cache.get(key)
+        if inverse is None:
+            inverse = 1 / self._calculate_response(n_fft)
+            filter_cache.put(key, inverse)
+        return inverse
+
+    def _calculate_response(self, n_fft):
+        """Calculate response H in the frequency domain."""
+        omega = 2 * np.pi * np.fft.rfftfreq(n_fft, self.dt)
         H = (1 +
              (1j * self.A1 * omega * self.tau1) /
              (1j * omega * self.tau1 + 1) +
@@ -226,11 +334,34 @@ class ExponentialPredistortion:
              (1j * omega * self.tau3 + 1) +
              (1j * self.A4 * omega * self.tau4) /
              (1j * omega * self.tau4 + 1))
+        return H
+
+    @staticmethod
+    def predistort_batch(predistortions, waveforms, n_fft):
+        """Predistort waveforms of equal length with one batched FFT.
 
-        Yc = Y / H
+        Parameters
+        ----------
+        predistortions : list of ExponentialPredistortion
+            Predistortion of each waveform.
+        waveforms : numpy array, shape (n_waveform, n)
+            Waveforms to be pre-distorted.
+        n_fft : int
+            FFT size, including padding.
 
-        yc = np.fft.irfft(Yc, norm='ortho')
-        return yc[:len(waveform)]
+        Returns
+        -------
+        numpy array
+            Pre-distorted waveforms.
+
+        """
+        n = waveforms.shape[1]
+        padded = np.zeros((len(waveforms), n_fft))
+        padded[:, :n] = waveforms
+        Y = np.fft.rfft(padded, norm='ortho', axis=-1)
+        Y *= np.array([p.get_inverse(n_fft) for p in predistortions])
+        yc = np.fft.irfft(Y, norm='ortho', axis=-1)
+        return yc[:, :n]
 
 
 if __name__ == '__main__':
@@ -2,11 +2,88 @@
 import numpy as np
 import logging
 import copy
+from collections import OrderedDict
 log = logging.getLogger('LabberDriver')
 
 # TODO Private methods and variables
 
 
+class PulseCache:
+    """Bounded least-recently-used cache for calculated pulse data.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of cached items, 0 disables the cache.
+
+    Attributes
+    ----------
+    hits : int
+        Number of lookups that found a cached item.
+    misses : int
+        Number of lookups that did not find a cached item.
+
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        """Get cached item, or None if the key is not in the cache."""
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._items.move_to_end(key)
+        return item
+
+    def put(self, key, item):
+        """Add item to cache, removing the least recently used items."""
+        self._items[key] = item
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def set_max_size(self, max_size):
+        """Set maximum number of cached items."""
+        self.max_size = max_size
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        """Remove all items and reset the hit/miss counters."""
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+# pulse envelopes, including DRAG, keyed by pulse parameters and position
+envelope_cache = PulseCache(1000)
+# CZ waveforms in the tau variable, keyed by CZ parameters
+cz_cache = PulseCache(32)
+
+
+def _get_parameter_key(obj, exclude=()):
+    """Get a hashable key with the type and attribute values of an object."""
+    items = [type(obj)]
+    for name, value in sorted(vars(obj).items()):
+        if name in exclude:
+            continue
+        if isinstance(value, np.ndarray):
+            value = tuple(value.tolist())
+        elif hasattr(value, '__dict__'):
+            value = _get_parameter_key(value)
+        items.append((name, value))
+    return tuple(items)
+
+
 class Pulse:
     """Represents physical pulses played by an AWG.
 
@@ -53,6 +130,9 @@ class Pulse:
         self.start_at_zero = False
         self.complex = complex
 
+    # attributes not affecting the pulse envelope
+    _uncached_attributes = ('phase', 'frequency')
+
     def total_duration(self):
         """Get the total duration for the pulse.
 
@@ -86,9 +166,13 @@ class Pulse:
     def calculate_waveform(self, t0, t):
         """Calculate pulse waveform including phase shifts and SSB-mixing.
 
+        The waveform of several identical pulses can be calculated in one
+        call by passing a 2D array `t`, with one row of time values per pulse,
+        together with a column vector `t0` holding the pulse positions.
+
         Parameters
         ----------
-        t0 : float
+        t0 : float or numpy array
             Pulse position, referenced to center of pulse.
 
         t : numpy array
@@ -97,19 +181,13 @@ class Pulse:
         Returns
         -------
         waveform : numpy array
-            Array containing pulse waveform.
+            Array containing pulse waveform, same shape as `t`.
 
         """
-        y = self.calculate_envelope(t0, t)
-        # Make sure the waveform is zero outside the pulse
-        y[t < (t0 - self.total_duration() / 2)] = 0
-        y[t > (t0 + self.total_duration() / 2)] = 0
-
-        if self.use_drag and self.complex:
-            beta = self.drag_coefficient / (t[1] - t[0])
-            y = y + 1j * beta * np.gradient(y)
-            y = y * np.exp(1j * 2 * np.pi * self.drag_detuning *
-                           (t - t0 + self.total_duration() / 2))
+        if envelope_cache.max_size > 0 and t.ndim == 1 and len(t) > 1:
+            y = self._get_cached_envelope(t0, t)
+        else:
+            y = self._calculate_drag_envelope(t0, t)
 
         if self.complex:
             # Apply phase and SSB
@@ -124,6 +202,64 @@ class Pulse:
             y = data_i + 1j * data_q
         return y
 
+    def _calculate_drag_envelope(self, t0, t, inside=None):
+        """Calculate pulse envelope, truncated and with DRAG correction.
+
+        Parameters
+        ----------
+        t0 : float or numpy array
+            Pulse position, referenced to center of pulse.
+
+        t : numpy array
+            Array with time values for which to calculate the envelope.
+
+        inside : numpy array, optional
+            Boolean mask of the time values inside the pulse. If not given,
+            it is calculated from `t0` and `t`.
+
+        """
+        y = self.calculate_envelope(t0, t)
+        # Make sure the waveform is zero outside the pulse
+        if inside is None:
+            inside = ((t >= (t0 - self.total_duration() / 2)) &
+                      (t <= (t0 + self.total_duration() / 2)))
+        y[~inside] = 0
+
+        if self.use_drag and self.complex:
+            beta = self.drag_coefficient / (t[..., 1:2] - t[..., 0:1])
+            y = y + 1j * beta * np.gradient(y, axis=-1)
+            y = y * np.exp(1j * 2 * np.pi * self.drag_detuning *
+                           (t - t0 + self.total_duration() / 2))
+        return y
+
+    def _get_cached_envelope(self, t0, t):
+        """Get envelope from cache, or calculate and cache it.
+
+        The envelope only depends on the time relative to the pulse position,
+        so it is cached by pulse parameters, sample rate, number of points
+        and offset between the pulse and the first time value, in samples.
+        Cached envelopes are calculated on a time grid starting at zero, and
+        agree with the envelope at the actual time values to rounding errors.
+        The points inside the pulse are found from the actual time values,
+        to truncate the pulse exactly as without the cache.
+
+        """
+        sample_rate = round(1 / (t[1] - t[0]))
+        offset = round((t0 - t[0]) * sample_rate, 6)
+        n_start = np.count_nonzero(t < (t0 - self.total_duration() / 2))
+        n_stop = np.count_nonzero(t <= (t0 + self.total_duration() / 2))
+        key = (_get_parameter_key(self, self._uncached_attributes),
+               sample_rate, len(t), offset, n_start, n_stop)
+        y = envelope_cache.get(key)
+        if y is None:
+            inside = np.zeros(len(t), dtype=bool)
+            inside[n_start:n_stop] = True
+            y = self._calculate_drag_envelope(
+                offset / sample_rate, np.arange(len(t)) / sample_rate, inside)
+            y.flags.writeable = False
+            envelope_cache.put(key, y)
+        return y if self.complex else y.copy()
+
 
 class Gaussian(Pulse):
     def __init__(self, complex):
@@ -159,8 +295,8 @@ class Gaussian(Pulse):
 
         # TODO  Fix this
         if self.start_at_zero:
-            values = values - values.min()
-            values = values / values.max()
+            values = values - values.min(axis=-1, keepdims=True)
+            values = values / values.max(axis=-1, keepdims=True)
         values = values * self.amplitude
 
         return values
@@ -191,8 +327,8 @@ class Square(Pulse):
 
     def calculate_envelope(self, t0, t):
         # reduce risk of rounding errors by putting checks between samples
-        if len(t) > 1:
-            t0 += (t[1] - t[0]) / 2.0
+        if t.shape[-1] > 1:
+            t0 = t0 + (t[..., 1:2] - t[..., 0:1]) / 2.0
 
         values = ((t >= (t0 - (self.width + self.plateau) / 2)) &
                   (t < (t0 + (self.width + self.plateau) / 2)))
@@ -213,13 +349,17 @@ class Cosine(Pulse):
                       (1 - np.cos(2 * np.pi * (t - t0 + tau / 2) / tau)))
         else:
             values = np.ones_like(t) * self.amplitude
-            values[t < t0 - self.plateau / 2] = self.amplitude / 2 * \
+            # expand t0 to allow masking of 2D time arrays
+            t0 = np.broadcast_to(t0, t.shape)
+            before = t < t0 - self.plateau / 2
+            after = t > t0 + self.plateau / 2
+            values[before] = self.amplitude / 2 * \
                 (1 - np.cos(2 * np.pi *
-                            (t[t < t0 - self.plateau / 2] - t0 +
+                            (t[before] - t0[before] +
                              self.plateau / 2 + tau / 2) / tau))
-            values[t > t0 + self.plateau / 2] = self.amplitude / 2 * \
+            values[after] = self.amplitude / 2 * \
                 (1 - np.cos(2 * np.pi *
-                            (t[t > t0 + self.plateau / 2] - t0 -
+                            (t[after] - t0[after] -
                              self.plateau / 2 + tau / 2) / tau))
 
         return values
@@ -239,6 +379,10 @@ class CZ(Pulse):
 
         self.t_tau = None
 
+    # attributes calculated from the other parameters
+    _uncached_attributes = ('t_tau', 't_tau2', 'theta_tau', 'theta_i',
+                            'theta_f')
+
     def total_duration(self):
         return self.width+self.plateau
 
@@ -247,21 +391,20 @@ class CZ(Pulse):
             self.calculate_cz_waveform()
 
         # Plateau is added as an extra extension of theta_f.
-        theta_t = np.ones(len(t)) * self.theta_i
-        for i in range(len(t)):
-            if 0 < (t[i] - t0 + self.plateau / 2) < self.plateau:
-                theta_t[i] = self.theta_f
-            elif (0 < (t[i] - t0 + self.width / 2 + self.plateau / 2) <
-                  (self.width + self.plateau) / 2):
-                theta_t[i] = np.interp(
-                    t[i] - t0 + self.width / 2 + self.plateau / 2, self.t_tau,
-                    self.theta_tau)
-
-            elif (0 < (t[i] - t0 + self.width / 2 + self.plateau / 2) <
-                  (self.width + self.plateau)):
-                theta_t[i] = np.interp(
-                    t[i] - t0 + self.width / 2 - self.plateau / 2, self.t_tau,
-                    self.theta_tau)
+        theta_t = np.ones(t.shape) * self.theta_i
+        dt = t - t0
+        t_plateau = dt + self.plateau / 2
+        t_start = dt + self.width / 2 + self.plateau / 2
+        plateau = (0 < t_plateau) & (t_plateau < self.plateau)
+        rise = (~plateau & (0 < t_start) &
+                (t_start < (self.width + self.plateau) / 2))
+        fall = (~plateau & ~rise & (0 < t_start) &
+                (t_start < (self.width + self.plateau)))
+        theta_t[plateau] = self.theta_f
+        theta_t[rise] = np.interp(t_start[rise], self.t_tau, self.theta_tau)
+        theta_t[fall] = np.interp(
+            (dt + self.width / 2 - self.plateau / 2)[fall], self.t_tau,
+            self.theta_tau)
         # Clip theta_t to remove numerical outliers:
         theta_t = np.clip(theta_t, self.theta_i, None)
 
@@ -283,6 +426,15 @@ class CZ(Pulse):
 
     def calculate_cz_waveform(self):
         """Calculate waveform for c-phase and store in object"""
+        # the first Fourier coefficient is set by the calculation
+        key = (self.F_Terms, self.Coupling, self.Offset, self.amplitude,
+               self.width, tuple(self.Lcoeff[1:].tolist()))
+        cached = cz_cache.get(key)
+        if cached is not None:
+            (self.theta_i, self.theta_f, self.Lcoeff[0], self.theta_tau,
+             self.t_tau, self.t_tau2) = cached
+            return
+
         # notation and calculations are based on
         # "Fast adiabatic qubit gates using only sigma_z control"
         # PRA 90, 022307 (2014)
@@ -326,12 +478,16 @@ class CZ(Pulse):
                 self.t_tau[i] = np.trapz(
                     np.sin(self.theta_tau[0:i+1]), x=tau[0:i+1])
                 # self.t_tau[i] = np.sum(np.sin(self.theta_tau[0:i+1]))*(tau[1]-tau[0])
+        cz_cache.put(key, (self.theta_i, self.theta_f, self.Lcoeff[0],
+                           self.theta_tau, self.t_tau, self.t_tau2))
 
 class NetZero(CZ):
     def __init__(self, *args, **kwargs):
         super().__init__()
         self.slepian = None
 
+    _uncached_attributes = CZ._uncached_attributes + ('slepian', )
+
     def total_duration(self):
         return 2*self.slepian.total_duration()
 
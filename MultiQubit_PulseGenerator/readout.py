@@ -7,6 +7,21 @@ import numpy as np
 log = logging.getLogger('LabberDriver')
 
 
+def _get_fingerprint(data, n_sample=64):
+    """Get cheap fingerprint of array, to detect data refilled in place.
+
+    The fingerprint holds the memory address, shape and type of the array,
+    and a checksum of a few samples spread over the data.
+    """
+    if data is None:
+        return None
+    data = np.asarray(data)
+    flat = data.reshape(-1)
+    step = max(1, flat.size // n_sample)
+    return (data.ctypes.data, data.shape, data.dtype.str,
+            hash(flat[::step].tobytes()), hash(flat[-1:].tobytes()))
+
+
 class Demodulation(object):
     """Demodulate multi-tone qubit readout.
 
@@ -20,6 +35,7 @@ class Demodulation(object):
     def __init__(self, n_qubit):
         # define variables
         self.n_qubit = n_qubit
+        self.n_readout = n_qubit
         self.sample_rate = 1E9
         self.frequencies = np.zeros(self.n_qubit)
 
@@ -28,8 +44,13 @@ class Demodulation(object):
         self.demod_length = 1.0E-6
         self.freq_offset = 0.0
         self.use_phase_ref = False
+        self.n_records = 1
+        # number of records processed at once
+        self.chunk_size = 4096
 
-        # self.n_records = 1
+        # cached reference vectors, and last demodulation result
+        self._references = dict()
+        self._last = None
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -77,53 +98,8 @@ class Demodulation(object):
             Complex array matching number of segments in input
 
         """
-        # get parameters
-        frequency = self.frequencies[n] - self.freq_offset
-        n_segment = int(self.n_records)
-        # get input data from dict, with keys {'y': value, 't0': t0, 'dt': dt}
-        if signal is None:
-            return np.zeros(n_segment, dtype=complex)
-        vY = signal['y']
-        dt = signal['dt']
-        # get shape of input data
-        shape = signal.get('shape', vY.shape)
-        # override segment parameter if input data has more than one dimension
-        if len(shape) > 1:
-            n_segment = shape[0]
-        # avoid exceptions if no time step is given
-        if dt == 0:
-            dt = 1.0
-        # get indices for data trimming
-        n0 = int(round(self.demod_skip / dt))
-        n_total = vY.size
-        length = 1 + int(round(self.demod_length / dt))
-        length = min(length, int(n_total / n_segment) - n0)
-        if length <= 1:
-            return np.zeros(n_segment, dtype=complex)
-
-        # define data to use, put in 2d array of segments
-        vData = np.reshape(vY, (n_segment, int(n_total / n_segment)))
-        # calculate cos/sin vectors, allow segmenting
-        vTime = dt * (n0 + np.arange(length, dtype=float))
-        vCos = np.cos(2 * np.pi * vTime * frequency)
-        vSin = np.sin(2 * np.pi * vTime * frequency)
-        # calc I/Q
-        dI = 2 * np.trapz(vCos * vData[:, n0:n0 + length]) / float(length - 1)
-        dQ = 2 * np.trapz(vSin * vData[:, n0:n0 + length]) / float(length - 1)
-        values = dI + 1j * dQ
-        if self.use_phase_ref and ref is not None:
-            # skip reference if trace length doesn't match
-            if len(ref['y']) != len(vY):
-                return values
-            vRef = np.reshape(ref['y'], (n_segment, int(n_total / n_segment)))
-            Iref = (2 * np.trapz(vCos * vRef[:, n0:n0 + length]) /
-                    float(length - 1))
-            Qref = (2 * np.trapz(vSin * vRef[:, n0:n0 + length]) /
-                    float(length - 1))
-            # subtract the reference angle
-            dAngleRef = np.arctan2(Qref, Iref)
-            values /= (np.cos(dAngleRef) + 1j * np.sin(dAngleRef))
-        return values
+        n_demod = max(self.n_readout, n + 1)
+        return self.demodulate_all(signal, ref=ref, n_demod=n_demod)[:, n]
 
     def demodulate_iq(self, n, signal_i, signal_q, ref=None):
         """Calculate complex signal from complex data and reference.
@@ -148,57 +124,162 @@ class Demodulation(object):
             Complex array matching number of segments in input
 
         """
-        # get parameters
-        frequency = self.frequencies[n] - self.freq_offset
+        if signal_i is None or signal_q is None:
+            return np.zeros(int(self.n_records), dtype=complex)
+        n_demod = max(self.n_readout, n + 1)
+        return self.demodulate_all(signal_i, signal_q, ref, n_demod)[:, n]
+
+    def demodulate_all(self, signal, signal_q=None, ref=None, n_demod=None):
+        """Demodulate data at the readout frequencies of read-out qubits.
+
+        The result of the last call is kept, so demodulating the same data
+        for each qubit in turn only processes the data once.
+
+        Parameters
+        ----------
+        signal : dict
+            Dictionary with signal data, or in-phase data if `signal_q` is
+            given.
+
+        signal_q : dict, optional
+            Dictionary with quadrature signal data.
+
+        ref : dict
+            Dictionary with reference data
+
+        n_demod : int, optional
+            Number of qubits to demodulate, defaults to the number of qubits
+            that are read out.
+
+        Returns
+        -------
+        values : complex numpy array, shape (n_segment, n_demod)
+            Complex values for each segment and qubit.
+
+        """
+        if n_demod is None:
+            n_demod = self.n_readout
         n_segment = int(self.n_records)
         # get input data from dict, with keys {'y': value, 't0': t0, 'dt': dt}
-        if signal_i is None or signal_q is None:
-            return np.zeros(n_segment, dtype=complex)
-        vI = signal_i['y']
-        vQ = signal_q['y']
-        if vI.shape != vQ.shape:
+        if signal is None:
+            return np.zeros((n_segment, n_demod), dtype=complex)
+        iq = signal_q is not None
+        vY = signal['y']
+        if iq and vY.shape != signal_q['y'].shape:
             raise ValueError('I and Q must have the same shape.')
-
         # override segment parameter if input data has more than one dimension
-        shape = signal_i.get('shape', vI.shape)
+        shape = signal.get('shape', vY.shape)
         if len(shape) > 1:
             n_segment = shape[0]
-        dt = signal_i['dt']
+        dt = signal['dt']
         # avoid exceptions if no time step is given
         if dt == 0:
             dt = 1.0
-        # get indices for data trimming
-        n0 = int(round(self.demod_skip / dt))
-        n_total = vI.size
-        length = 1 + int(round(self.demod_length / dt))
-        length = min(length, int(n_total / n_segment) - n0)
-        if length <= 1:
-            return np.zeros(n_segment, dtype=complex)
+        # skip reference if trace length doesn't match
+        use_ref = (self.use_phase_ref and ref is not None and
+                   len(ref['y']) == len(vY))
+
+        # re-use result if demodulating the same data again. Arrays may be
+        # re-used for new data, so they are also compared by fingerprint
+        data = (vY, signal_q['y'] if iq else None,
+                ref['y'] if use_ref else None)
+        fingerprint = tuple(_get_fingerprint(x) for x in data)
+        settings = (n_segment, dt, self.demod_skip, self.demod_length,
+                    self.freq_offset, tuple(self.frequencies[:n_demod]))
+        if (self._last is not None and self._last[2] == settings and
+                self._last[3] == fingerprint and
+                all(x is y for x, y in zip(self._last[0], data))):
+            return self._last[1]
 
         # define data to use, put in 2d array of segments
-        vData = np.reshape(vI + 1j * vQ, (n_segment, int(n_total / n_segment)))
-        # calculate cos/sin vectors, allow segmenting
-        vTime = dt * (n0 + np.arange(length, dtype=float))
-        vS = np.exp(2j * np.pi * vTime * frequency)
-
-        # calc I/Q
-        dI = np.trapz((vS * vData[:, n0:n0 + length]).real) / float(length - 1)
-        dQ = -np.trapz((vS * vData[:, n0:n0 + length]).imag) / float(length - 1)
-        values = dI + 1j * dQ
-        if self.use_phase_ref and ref is not None:
-            # skip reference if trace length doesn't match
-            if len(ref['y']) != len(vI):
-                return values
+        n_total = vY.size
+        if iq:
+            vData = vY + 1j * signal_q['y']
+        else:
+            vData = vY
+        vData = np.reshape(vData, (n_segment, int(n_total / n_segment)))
+        values = self.demodulate_records(vData, dt, iq, n_demod)
+        if use_ref:
             vRef = np.reshape(ref['y'], (n_segment, int(n_total / n_segment)))
-            Iref = (np.trapz((vS * vRef[:, n0:n0 + length]).real)
-                    / float(length - 1))
-            Qref = (-np.trapz((vS * vRef[:, n0:n0 + length]).imag)
-                    / float(length - 1))
             # subtract the reference angle
-            dAngleRef = np.arctan2(Qref, Iref)
-            values /= (np.cos(dAngleRef) + 1j * np.sin(dAngleRef))
+            values_ref = self.demodulate_records(vRef, dt, iq, n_demod)
+            values *= np.exp(-1j * np.angle(values_ref))
+        self._last = (data, values, settings, fingerprint)
+        return values
+
+    def demodulate_records(self, records, dt, iq=False, n_demod=None):
+        """Demodulate records at the readout frequencies of read-out qubits.
+
+        The records are processed in chunks of `chunk_size` records, using
+        one matrix product per chunk for all qubits. Since records are
+        independent, data from long acquisitions can also be passed in
+        chunks as it arrives.
+
+        Parameters
+        ----------
+        records : numpy array, shape (n_records, record_length)
+            Real data, or complex I/Q data if `iq` is True.
+
+        dt : float
+            Time step of the records.
+
+        iq : bool
+            If True, demodulate complex I/Q data.
+
+        n_demod : int, optional
+            Number of qubits to demodulate, defaults to the number of qubits
+            that are read out.
+
+        Returns
+        -------
+        values : complex numpy array, shape (n_records, n_demod)
+            Complex values for each record and qubit.
+
+        """
+        if n_demod is None:
+            n_demod = self.n_readout
+        n_record = records.shape[0]
+        # get indices for data trimming
+        n0 = int(round(self.demod_skip / dt))
+        length = 1 + int(round(self.demod_length / dt))
+        length = min(length, records.shape[1] - n0)
+        if length <= 1:
+            return np.zeros((n_record, n_demod), dtype=complex)
+        references = self._get_references(dt, n0, length, iq, n_demod)
+
+        values = np.empty((n_record, n_demod), dtype=complex)
+        for start in range(0, n_record, self.chunk_size):
+            chunk = records[start:start + self.chunk_size, n0:n0 + length]
+            if np.iscomplexobj(chunk):
+                result = np.dot(chunk, references)
+            else:
+                # keep real data real, for a faster matrix product
+                result = (np.dot(chunk, references.real) +
+                          1j * np.dot(chunk, references.imag))
+            values[start:start + self.chunk_size] = result
+        if iq:
+            # I/Q data is demodulated with the opposite sign convention
+            np.conj(values, out=values)
         return values
 
+    def _get_references(self, dt, n0, length, iq, n_demod):
+        """Get reference vectors, with trapezoid weights and scaling."""
+        frequencies = self.frequencies[:n_demod] - self.freq_offset
+        key = (dt, n0, length, iq, tuple(frequencies))
+        if key not in self._references:
+            vTime = dt * (n0 + np.arange(length, dtype=float))
+            weights = np.ones(length)
+            weights[0] = weights[-1] = 0.5
+            # real data gives half the amplitude in the I/Q components
+            scale = (1.0 if iq else 2.0) / float(length - 1)
+            references = (scale * weights[:, np.newaxis] *
+                          np.exp(2j * np.pi * np.outer(vTime, frequencies)))
+            # only keep references for a few settings
+            if len(self._references) >= 8:
+                self._references.clear()
+            self._references[key] = references
+        return self._references[key]
+
 
 if __name__ == '__main__':
     pass
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import logging
+import re
+
 import numpy as np
 import copy
 
@@ -22,6 +24,34 @@ log = logging.getLogger('LabberDriver')
 # TODO Remove pulse from I gates
 
 
+# config values that only affect the waveforms of one qubit, as
+# (pattern matching name and qubit number, waveforms to update)
+WAVEFORM_DEPENDENCIES = [
+    (re.compile(r'(Amplitude|Width|Plateau|Frequency|DRAG scaling|'
+                r'DRAG frequency detuning) #(?P<qubit>\d)$'), ('xy', 'gate')),
+    (re.compile(r'(Amplitude|Width|Plateau) #(?P<qubit>\d), Z$'), ('z',)),
+    (re.compile(r'Amplitude #(?P<qubit>\d), Z global$'), ('z',)),
+]
+# config values that do not affect the waveforms
+WAVEFORM_INDEPENDENT = re.compile(r'Demodulation - ')
+
+
+def _pulse_key(pulse):
+    """Get a hashable key identifying the type and parameters of a pulse.
+
+    Unhashable attributes, like arrays, are identified by object id, since
+    they are shared between the copies of a pulse made for each gate.
+    """
+    items = []
+    for name, value in sorted(vars(pulse).items()):
+        try:
+            hash(value)
+        except TypeError:
+            value = id(value)
+        items.append((name, value))
+    return (type(pulse), tuple(items))
+
+
 class GateOnQubit:
     def __init__(self, gate, qubit, pulse=None):
         self.gate = gate
@@ -484,6 +514,11 @@ class SequenceToWaveforms:
     align_to_end : bool
         Align the whole sequence to the end of the waveforms.
         Only relevant if `trim_to_sequence` is False.
+    batch_pulses : bool
+        If True, calculate identical pulses together in batches.
+    updated_waveforms : list of tuple
+        Waveforms that changed in the last call to `get_waveforms`, as
+        (key, qubit). The qubit is None for readout waveforms.
     sequences : list of :obj:`Step`
         The qubit sequences.
     qubits : list of :obj:`Qubit`
@@ -508,6 +543,7 @@ class SequenceToWaveforms:
         self.first_delay = 100E-9
         self.trim_to_sequence = True
         self.align_to_end = False
+        self.batch_pulses = False
 
         self.sequence_list = []
         self.qubits = [qubits.Qubit() for n in range(self.n_qubit)]
@@ -570,13 +606,53 @@ class SequenceToWaveforms:
         self.readout_trig = np.array([], dtype=float)
         self.readout_iq = np.array([], dtype=np.complex)
 
-    def get_waveforms(self, sequence):
+        # last compiled waveforms and timing, for incremental updates
+        self._last_waveforms = None
+        self._last_timing = None
+        self._update = None
+        self.updated_waveforms = []
+
+    def get_affected_waveforms(self, keys):
+        """Get the waveforms affected by a change of config values.
+
+        Parameters
+        ----------
+        keys : list of str
+            Names of changed config values.
+
+        Returns
+        -------
+        set of tuple or None
+            Affected waveforms, as (key, qubit), or None if the change may
+            affect all waveforms.
+
+        """
+        affected = set()
+        for key in keys:
+            if WAVEFORM_INDEPENDENT.match(key):
+                continue
+            for pattern, waveforms in WAVEFORM_DEPENDENCIES:
+                match = pattern.match(key)
+                if match:
+                    n = int(match.group('qubit')) - 1
+                    affected.update((name, n) for name in waveforms)
+                    break
+            else:
+                return None
+        return affected
+
+    def get_waveforms(self, sequence, update=None):
         """Compile the given sequence into waveforms.
 
         Parameters
         ----------
         sequences : list of :obj:`Step`
             The qubit sequence to be compiled.
+        update : set of tuple, optional
+            Waveforms to calculate, as (key, qubit), with waveforms of the
+            last call reused for all others. Use `get_affected_waveforms`
+            to find them. All waveforms are calculated if None, or if the
+            timing of the sequence changed since the last call.
 
         Returns
         -------
@@ -612,8 +688,12 @@ class SequenceToWaveforms:
             for step in self.sequence_list:
                 step.time_shift(shift)
 
+        self._reuse_waveforms(update)
         self._perform_virtual_z()
-        self._generate_waveforms()
+        if self.batch_pulses:
+            self._generate_waveforms_batched()
+        else:
+            self._generate_waveforms()
 
         # collapse all xy pulses to one waveform if no local XY control
         if not self.local_xy:
@@ -632,7 +712,7 @@ class SequenceToWaveforms:
             self._predistort_xy_waveforms()
         if self.perform_predistortion_z:
             self._predistort_z_waveforms()
-        if self.readout_trig_generate:
+        if self.readout_trig_generate and self._is_updated('readout_iq'):
             self._add_readout_trig()
         if self.generate_gate_switch:
             self._add_microwave_gate()
@@ -640,7 +720,9 @@ class SequenceToWaveforms:
         self._zero_last_z_point()
 
         # Apply offsets
-        self.readout_iq += self.readout_i_offset + 1j * self.readout_q_offset
+        if self._is_updated('readout_iq'):
+            self.readout_iq += (self.readout_i_offset +
+                                1j * self.readout_q_offset)
 
         # create and return dictionary with waveforms
         waveforms = dict()
@@ -649,10 +731,62 @@ class SequenceToWaveforms:
         waveforms['gate'] = self._wave_gate
         waveforms['readout_trig'] = self.readout_trig
         waveforms['readout_iq'] = self.readout_iq
+        self._find_updated_waveforms(waveforms)
 
         # log.info('returning z waveforms in get_waveforms. Max is {}'.format(np.max(waveforms['z'])))
         return waveforms
 
+    def _get_timing(self):
+        """Get timing of sequence and waveforms, for reusing waveforms."""
+        steps = tuple(
+            (step.t_start, step.t_end,
+             tuple((str(g.qubit), _pulse_key(g.gate)) for g in step.gates))
+            for step in self.sequence_list)
+        return (self.n_pts, self.n_pts_readout, tuple(self.wave_xy_delays),
+                tuple(self.wave_z_delays), steps)
+
+    def _reuse_waveforms(self, update):
+        """Reuse last waveforms not in `update`, if timing is unchanged."""
+        timing = self._get_timing()
+        self._update = None
+        # waveforms are mixed between qubits by cross-talk and global XY
+        if (update is not None and self._last_waveforms is not None and
+                self._last_timing == timing and self.local_xy and
+                not self.compensate_crosstalk):
+            self._update = set(update)
+            waveforms = self._last_waveforms
+            for key in ('xy', 'z', 'gate'):
+                wave_list = getattr(self, '_wave_' + key)
+                for n in range(self.n_qubit):
+                    if (key, n) not in self._update:
+                        wave_list[n] = waveforms[key][n]
+            if not self._is_updated('readout_iq'):
+                self.readout_iq = waveforms['readout_iq']
+                self.readout_trig = waveforms['readout_trig']
+        self._last_timing = timing
+
+    def _is_updated(self, key, qubit=None):
+        """Check if waveform is calculated, or reused from the last call."""
+        return self._update is None or (key, qubit) in self._update
+
+    def _find_updated_waveforms(self, waveforms):
+        """Compare waveforms with the last call, to find updated waveforms."""
+        previous = self._last_waveforms
+        self.updated_waveforms = []
+        for key in ('xy', 'z', 'gate'):
+            for n in range(self.n_qubit):
+                if (previous is None or not np.array_equal(
+                        waveforms[key][n], previous[key][n])):
+                    self.updated_waveforms.append((key, n))
+        for key in ('readout_trig', 'readout_iq'):
+            if (previous is None or
+                    not np.array_equal(waveforms[key], previous[key])):
+                self.updated_waveforms.append((key, None))
+        # keep references, the lists are modified by the next call
+        self._last_waveforms = {
+            key: (list(value) if isinstance(value, list) else value)
+            for key, value in waveforms.items()}
+
     def _seperate_gates(self):
         new_sequences = []
         for step in self.sequence_list:
@@ -739,15 +873,22 @@ class SequenceToWaveforms:
         """Pre-distort the waveforms."""
         # go through and predistort all xy waveforms
         n_wave = self.n_qubit if self.local_xy else 1
-        for n in range(n_wave):
-            self._wave_xy[n] = self._predistortions[n].predistort(
-                self._wave_xy[n])
+        channels = [n for n in range(n_wave) if self._is_updated('xy', n)]
+        waveforms = predistortion.predistort_waveforms(
+            [self._predistortions[n] for n in channels],
+            [self._wave_xy[n] for n in channels])
+        for n, waveform in zip(channels, waveforms):
+            self._wave_xy[n] = waveform
 
     def _predistort_z_waveforms(self):
         # go through and predistort all waveforms
-        for n in range(self.n_qubit):
-            self._wave_z[n] = self._predistortions_z[n].predistort(
-                self._wave_z[n])
+        channels = [n for n in range(self.n_qubit)
+                    if self._is_updated('z', n)]
+        waveforms = predistortion.predistort_waveforms(
+            [self._predistortions_z[n] for n in channels],
+            [self._wave_z[n] for n in channels])
+        for n, waveform in zip(channels, waveforms):
+            self._wave_z[n] = waveform
 
     def _perform_crosstalk_compensation(self):
         """Compensate for Z-control crosstalk."""
@@ -834,6 +975,8 @@ class SequenceToWaveforms:
         n_wave = self.n_qubit if self.local_xy else 1
         # go through all waveforms
         for n, wave in enumerate(self._wave_xy[:n_wave]):
+            if not self._is_updated('gate', n):
+                continue
             if self.uniform_gate:
                 # the uniform gate is all ones
                 gate = np.ones_like(wave)
@@ -899,7 +1042,8 @@ class SequenceToWaveforms:
 
         # append offset to Z waveforms
         for n in range(self.n_qubit):
-            self._wave_z[n]+=(z_offset*self.z_offset_amplitude[n])
+            if self._is_updated('z', n):
+                self._wave_z[n]+=(z_offset*self.z_offset_amplitude[n])
 
     def _filter_output_waveforms(self):
         """Filter output waveforms"""
@@ -912,6 +1056,8 @@ class SequenceToWaveforms:
             # apply filter to all output waveforms
             n_wave = self.n_qubit if self.local_xy else 1
             for n in range(n_wave):
+                if not self._is_updated('gate', n):
+                    continue
                 self._wave_gate[n] = self._apply_window_filter(
                     self._wave_gate[n], window)
                 # make sure gate starts/ends in 0
@@ -925,8 +1071,9 @@ class SequenceToWaveforms:
                 self.z_filter_size, self.z_filter, self.z_filter_kaiser_beta)
             # apply filter to all output waveforms
             for n in range(self.n_qubit):
-                self._wave_z[n] = self._apply_window_filter(
-                    self._wave_z[n], window)
+                if self._is_updated('z', n):
+                    self._wave_z[n] = self._apply_window_filter(
+                        self._wave_z[n], window)
 
     def _get_filter_window(self, size=11, window='Kaiser', kaiser_beta=14.0):
         """Get filter for waveform convolution"""
@@ -978,7 +1125,8 @@ class SequenceToWaveforms:
            the value output by the AWG between sequences.
         """
         for n in range(self.n_qubit):
-            self._wave_z[n][-1]=0
+            if self._is_updated('z', n):
+                self._wave_z[n][-1]=0
 
     def _round(self, t, acc=1E-12):
         """Round the time `t` with a certain accuarcy `acc`.
@@ -996,7 +1144,7 @@ class SequenceToWaveforms:
             The rounded time.
 
         """
-        return int(np.round(t / acc)) * acc
+        return int(round(t / acc)) * acc
 
     def _add_readout_trig(self):
         """Create waveform for readout trigger."""
@@ -1080,42 +1228,121 @@ class SequenceToWaveforms:
 
     def _generate_waveforms(self):
         """Generate the waveforms corresponding to the sequence."""
-        # log.info('generating waveform from sequence. Len is {}'.format(len(self.sequence_list)))
+        for (waveform, indices, t0, pulse,
+             scaling) in self._get_pulse_placements():
+            # calculate time values for the pulse indices
+            t = indices / self.sample_rate
+            if scaling is None:
+                waveform[indices] += pulse.calculate_waveform(t0, t)
+            else:
+                waveform[indices] += scaling * pulse.calculate_waveform(t0, t)
+
+    def _generate_waveforms_batched(self):
+        """Generate the waveforms, calculating identical pulses together.
+
+        Pulses with the same shape, parameters and number of points are
+        grouped and calculated with a single call to `calculate_waveform`.
+        The pulses are then added to each waveform with one indexed add, in
+        the same order as in `_generate_waveforms` to give identical output.
+
+        """
+        # group pulse placements by pulse parameters and number of points
+        groups = dict()
+        for order, (waveform, indices, t0, pulse, scaling) in enumerate(
+                self._get_pulse_placements()):
+            key = (_pulse_key(pulse), len(indices), scaling is None)
+            if key not in groups:
+                groups[key] = (pulse, [])
+            groups[key][1].append((order, waveform, indices, t0, scaling))
+
+        # calculate all pulses in a group at once, sort result by waveform
+        buckets = dict()
+        for pulse, placements in groups.values():
+            order, waves, indices, t0, scaling = zip(*placements)
+            indices = np.array(indices)
+            t0 = np.array(t0)[:, np.newaxis]
+            values = pulse.calculate_waveform(t0, indices / self.sample_rate)
+            if scaling[0] is not None:
+                values = np.array(scaling)[:, np.newaxis] * values
+            order = np.array(order)
+            wave_ids = np.array([id(w) for w in waves])
+            for wave in {id(w): w for w in waves}.values():
+                rows = wave_ids == id(wave)
+                bucket = buckets.setdefault(id(wave), (wave, [], [], []))
+                bucket[1].append(np.repeat(order[rows], indices.shape[1]))
+                bucket[2].append(indices[rows].ravel())
+                bucket[3].append(values[rows].ravel())
+
+        # add pulses to waveforms, keeping the order of the sequence
+        for waveform, order, indices, values in buckets.values():
+            sort = np.argsort(np.concatenate(order), kind='stable')
+            indices = np.concatenate(indices)[sort]
+            values = np.concatenate(values)[sort]
+            if np.iscomplexobj(waveform):
+                waveform.real += np.bincount(
+                    indices, values.real, minlength=len(waveform))
+                waveform.imag += np.bincount(
+                    indices, values.imag, minlength=len(waveform))
+            else:
+                waveform += np.bincount(
+                    indices, values.real, minlength=len(waveform))
+
+    def _get_pulse_placements(self):
+        """Find where the pulses of the sequence go in the waveforms.
+
+        Yields
+        ------
+        waveform : numpy array
+            The waveform to which the pulse is added.
+        indices : numpy array
+            Waveform indices covered by the pulse.
+        t0 : float
+            Pulse position, referenced to center of pulse.
+        pulse : :obj:`Pulse`
+            The pulse.
+        scaling : float or None
+            Cross-talk compensation scaling factor, or None if not used.
+
+        """
         for step in self.sequence_list:
-            # log.info('Generating gates {}'.format(step.gates))
             for gate in step.gates:
                 qubit = gate.qubit
                 if isinstance(qubit, list):
                     qubit = qubit[0]
                 gate_obj = gate.gate
 
-
                 if isinstance(gate_obj,
                               (gates.IdentityGate, gates.VirtualZGate)):
                     continue
                 elif isinstance(gate_obj, gates.SingleQubitZRotation):
+                    key = ('z', qubit)
                     waveform = self._wave_z[qubit]
                     delay = self.wave_z_delays[qubit]
                     if self.compensate_crosstalk:
                         crosstalk = self._crosstalk.compensation_matrix[:,
                                                                         qubit]
                 elif isinstance(gate_obj, gates.TwoQubitGate):
-                    # log.info('adding 2qb gate waveforms')
+                    key = ('z', qubit)
                     waveform = self._wave_z[qubit]
                     delay = self.wave_z_delays[qubit]
                     if self.compensate_crosstalk:
                         crosstalk = self._crosstalk.compensation_matrix[:,
                                                                         qubit]
                 elif isinstance(gate_obj, gates.SingleQubitXYRotation):
+                    key = ('xy', qubit)
                     waveform = self._wave_xy[qubit]
                     delay = self.wave_xy_delays[qubit]
                 elif isinstance(gate_obj, gates.ReadoutGate):
+                    key = ('readout_iq', None)
                     waveform = self.readout_iq
                     delay = 0
                 else:
                     raise ValueError(
                         "Don't know which waveform to add {} to.".format(
                             gate_obj))
+                # skip waveforms reused from the last call
+                if not self._is_updated(*key):
+                    continue
 
                 # get the range of indices in use
                 if (isinstance(gate_obj, gates.ReadoutGate)
@@ -1136,56 +1363,43 @@ class SequenceToWaveforms:
                         delay = self.wave_z_delays[q]
                         start = self._round(step.t_start + delay)
                         end = self._round(step.t_end + delay)
-                        indices = np.arange(
-                            max(np.floor(start * self.sample_rate), 0),
-                            min(
-                                np.ceil(end * self.sample_rate),
-                                len(waveform)),
-                            dtype=int)
-
-                        # return directly if no indices
+                        indices, t0 = self._get_indices_and_t0(
+                            step, gate, waveform, start, end)
+
+                        # skip if no indices
                         if len(indices) == 0:
                             continue
 
-                        # calculate time values for the pulse indices
-                        t = indices / self.sample_rate
-                        max_duration = end - start
-                        middle = end - max_duration / 2
-                        if step.align == 'center':
-                            t0 = middle
-                        elif step.align == 'left':
-                            t0 = middle - (max_duration - gate.duration) / 2
-                        elif step.align == 'right':
-                            t0 = middle + (max_duration - gate.duration) / 2
-
                         scaling_factor = float(crosstalk[q, 0])
                         if q != qubit:
                             scaling_factor = -scaling_factor
-                        waveform[indices] += (
-                            scaling_factor
-                            * gate.pulse.calculate_waveform(t0, t))
+                        yield waveform, indices, t0, gate.pulse, scaling_factor
                 else:
-                    # calculate the pulse waveform for the selected indices
-                    indices = np.arange(
-                        max(np.floor(start * self.sample_rate), 0),
-                        min(np.ceil(end * self.sample_rate), len(waveform)),
-                        dtype=int)
+                    indices, t0 = self._get_indices_and_t0(
+                        step, gate, waveform, start, end)
 
-                    # return directly if no indices
+                    # skip if no indices
                     if len(indices) == 0:
                         continue
-
-                    # calculate time values for the pulse indices
-                    t = indices / self.sample_rate
-                    max_duration = end - start
-                    middle = end - max_duration / 2
-                    if step.align == 'center':
-                        t0 = middle
-                    elif step.align == 'left':
-                        t0 = middle - (max_duration - gate.duration) / 2
-                    elif step.align == 'right':
-                        t0 = middle + (max_duration - gate.duration) / 2
-                    waveform[indices] += gate.pulse.calculate_waveform(t0, t)
+                    yield waveform, indices, t0, gate.pulse, None
+
+    def _get_indices_and_t0(self, step, gate, waveform, start, end):
+        """Get waveform indices and pulse position for a gate in a step."""
+        indices = np.arange(
+            max(np.floor(start * self.sample_rate), 0),
+            min(np.ceil(end * self.sample_rate), len(waveform)),
+            dtype=int)
+
+        # pulse position within the step
+        max_duration = end - start
+        middle = end - max_duration / 2
+        if step.align == 'center':
+            t0 = middle
+        elif step.align == 'left':
+            t0 = middle - (max_duration - gate.duration) / 2
+        elif step.align == 'right':
+            t0 = middle + (max_duration - gate.duration) / 2
+        return indices, t0
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -1225,6 +1439,9 @@ class SequenceToWaveforms:
         self.trim_to_sequence = config.get('Trim waveform to sequence')
         self.trim_start = config.get('Trim both start and end')
         self.align_to_end = config.get('Align pulses to end of waveform')
+        self.batch_pulses = config.get('Batch pulse compilation', False)
+        pulses.envelope_cache.set_max_size(
+            int(config.get('Pulse envelope cache size', 1000)))
 
         # qubit spectra
         for n in range(self.n_qubit):
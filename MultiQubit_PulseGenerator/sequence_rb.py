@@ -586,13 +586,6 @@ class TwoQubit_RB(Sequence):
     prev_sequence = ''
     prev_gate_seq = []
 
-    filepath_lookup_table = ""
-
-    # def __init__(self, *args, **kwargs):
-    #     log.info(str(args)+ str(kwargs))
-    #     super(Sequence, self).__init__(*args, **kwargs)
-    #     self.filepath_lookup_table = ""
-
     def generate_sequence(self, config):
         """
         Generate sequence by adding gates/pulses to waveforms.
@@ -732,11 +725,14 @@ class TwoQubit_RB(Sequence):
                          print("CliffordIndex: %d, Gate: ["%(i) + cliffords.Gate_to_strGate(cliffordSeq1[i]) + ", " + cliffords.Gate_to_strGate(cliffordSeq2[i]) +']', file=text_file)
                     for i in range(len(recoverySeq1)):
                          print("RecoveryIndex: %d, Gate: ["%(i) + cliffords.Gate_to_strGate(recoverySeq1[i]) + ", " + cliffords.Gate_to_strGate(recoverySeq2[i]) +']', file=text_file)
-            psi = np.matmul(self.evaluate_sequence(gateSeq1, gateSeq2), psi_gnd)
+            group = cliffords.get_clifford_group(generator)
+            matrix = group.matrices[
+                group.evaluate_sequence(gateSeq1, gateSeq2)]
+            psi = np.matmul(matrix, psi_gnd)
 
             np.set_printoptions(precision=2)
             log.info('The matrix of the overall gate sequence:')
-            log.info(self.evaluate_sequence(gateSeq1, gateSeq2))
+            log.info(matrix)
 
             log.info('--- TESTING THE RECOVERY GATE ---')
             log.info('The probability amplitude of the final state vector: ' + str(np.matrix(psi).flatten()))
@@ -856,6 +852,9 @@ class TwoQubit_RB(Sequence):
         """
         Get the recovery (the inverse) gate
 
+        The recovery Clifford is looked up in the precomputed tables of
+        `cliffords.TwoQubitCliffordGroup`.
+
         Parameters
         ----------
         gate_seq_1: list of class Gate
@@ -875,140 +874,27 @@ class TwoQubit_RB(Sequence):
         (recovery_seq_1, recovery_seq_2): tuple of the lists
             The recovery gate
         """
-
-
-        qubit_state = np.matrix(
-            '1; 0; 0; 0')  # initial state: ground state |00>
-
-        qubit_state = np.matmul(self.evaluate_sequence(
-            gate_seq_1, gate_seq_2, generator = generator), qubit_state)
-
-        # find recovery gate which makes qubit_state return to initial state
-        total_num_cliffords = 11520
-        recovery_seq_1 = []
-        recovery_seq_2 = []
+        group = cliffords.get_clifford_group(generator)
+        element = group.evaluate_sequence(gate_seq_1, gate_seq_2)
 
         # Search the recovery gate in two Qubit clifford group
         find_cheapest = config['Find the cheapest recovery Clifford']
-
-        cheapest_recovery_seq_1 = []
-        cheapest_recovery_seq_2 = []
+        use_lookup_table = config['Use a look-up table']
         log.info('*** get recovery gate *** ')
-        if (find_cheapest == True):
-            min_N_2QB_gate = np.inf
-            min_N_1QB_gate = np.inf
-            max_N_I_gate = -np.inf
-            cheapest_index = None
-
-            use_lookup_table = config['Use a look-up table']
-            if (use_lookup_table == True):
-                filepath_lookup_table = config['File path of the look-up table']
-                if len(filepath_lookup_table) == 0:
-                    if (generator == 'CZ'):
-                        filepath_lookup_table = os.path.join(path_currentdir, 'recovery_rb_table.pickle')
-                    elif (generator == 'iSWAP'):
-                        filepath_lookup_table = os.path.join(path_currentdir, 'recovery_rb_table_iSWAP.pickle')
-                    
-                if filepath_lookup_table != self.filepath_lookup_table:
-                    log.info("Load Look-up table.")
-                    self.filepath_lookup_table = filepath_lookup_table
-                    self.dict_lookup_table = cliffords.loadData(filepath_lookup_table)
-                stabilizer = cliffords.get_stabilizer(qubit_state)
-                for index, item in enumerate(self.dict_lookup_table['psi_stabilizer']):
-                    if stabilizer == item:
-                        seq1 = self.dict_lookup_table['recovery_gates_QB1'][index]
-                        for str_Gate in seq1:
-                            cheapest_recovery_seq_1.append(cliffords.strGate_to_Gate(str_Gate))
-                        seq2 = self.dict_lookup_table['recovery_gates_QB2'][index]
-                        for str_Gate in seq2:
-                            cheapest_recovery_seq_2.append(cliffords.strGate_to_Gate(str_Gate))
-
-                        log.info("=== FOUND THE CHEAPEST RECOVERY GATE IN THE LOOK-UP TABLE. ===")
-                        log.info("QB1 recovery gate sequence: " + str(seq1))
-                        log.info("QB2 recovery gate sequence: " + str(seq2))
-                        log.info("=================================================")
-                        return(cheapest_recovery_seq_1, cheapest_recovery_seq_2)
-
-            log.info("--- COULDN'T FIND THE RECOVERY GATE IN THE LOOK-UP TABLE... ---")
-
-
-        # Calculate the matrix of the clifford sequence
-        matrix_cliffords = self.evaluate_sequence(gate_seq_1,gate_seq_2, generator = generator)
-
-        for i in range(total_num_cliffords):
-            recovery_seq_1 = []
-            recovery_seq_2 = []
-            add_twoQ_clifford(i, recovery_seq_1, recovery_seq_2, generator = generator)
-
-            # Calculate the matrix of the recovery clifford
-            matrix_recovery = self.evaluate_sequence(recovery_seq_1, recovery_seq_2, generator = generator)
-
-            # Calculate the matrix of the total clifford sequence
-            matrix_total = np.matmul(matrix_recovery,matrix_cliffords)
-            if (CheckIdentity(matrix_total)):
-                if (find_cheapest == True):
-                    # Less 2QB Gates, Less 1QB Gates, and More I Gates = the cheapest gates.
-                    # The priority: less 2QB gates > less 1QB gates > more I gates
-                    N_2QB_gate = 0
-                    N_1QB_gate = 0
-                    N_I_gate = 0
-
-                    # count the numbers of the gates
-                    for j in range(len(recovery_seq_1)):
-                        if (recovery_seq_1[j] == gates.CZ or recovery_seq_2[j] == gates.CZ):
-                            N_2QB_gate += 1
-                        elif (recovery_seq_1[j] == gates.iSWAP or recovery_seq_2[j] == gates.iSWAP):
-                            N_2QB_gate += 1
-                        else:
-                            N_1QB_gate += 2
-                        if (recovery_seq_1[j] == gates.I):
-                            N_I_gate += 1
-                        if (recovery_seq_2[j] == gates.I):
-                            N_I_gate += 1
-
-                    if (N_2QB_gate <= min_N_2QB_gate): # if it has less 2QB gates, always update it
-                        min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                        if (N_1QB_gate <= min_N_1QB_gate): # *only if it has less 2QB gates*, check whether it has less 1QB gates
-                            min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                            if (N_I_gate >= max_N_I_gate): # *only if it has less 2QB gates & only if it has less 1QB gates*, check whether it has more I gates
-                                min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                    # check whether it is the cheapest
-                    # if it has less 2QB gates, always update it.
-                    if (N_2QB_gate < min_N_2QB_gate):
-                        min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                        log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                    else:
-                        # if it has equal # of 2QB gates and less 1QB gates, update it.
-                        if (N_2QB_gate == min_N_2QB_gate and
-                            N_1QB_gate < min_N_1QB_gate):
-                            min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                            log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                        else:
-                            # if it has equal # of 2QB & 1QB gates, and more 1QB gates, update it.
-                            if (N_2QB_gate == min_N_2QB_gate and
-                                N_1QB_gate == min_N_1QB_gate and
-                                N_I_gate >= max_N_I_gate):
-                                min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                                log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-
-                else:
-                    return(recovery_seq_1,recovery_seq_2)
-
-        if (find_cheapest == True):
-            recovery_seq_1 = []
-            recovery_seq_2 = []
-            log.info('The index of the cheapest recovery clifford: %d'%(cheapest_index))
-            add_twoQ_clifford(cheapest_index, recovery_seq_1, recovery_seq_2, generator = generator)
-
+        if find_cheapest and use_lookup_table:
+            # only return the final state to the initial state |00>
+            index = group.state_recovery[element]
+        elif find_cheapest:
+            index = group.recovery[element]
+        else:
+            index = group.inverse[element]
+        log.info('The index of the recovery clifford: %d' % index)
+        (recovery_seq_1, recovery_seq_2) = group.get_gates(index)
 
         if (recovery_seq_1 == [] and recovery_seq_2 == []):
             recovery_seq_1 = [None]
             recovery_seq_2 = [None]
 
-
         return (recovery_seq_1, recovery_seq_2)
 
 
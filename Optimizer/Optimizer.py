@@ -2,6 +2,7 @@
 import InstrumentDriver
 import numpy as np
 import copy
+import optimizers
 
 class Driver(InstrumentDriver.InstrumentWorker):
     """ This class implements a Nelder-Mead optimization driver"""
@@ -12,6 +13,10 @@ class Driver(InstrumentDriver.InstrumentWorker):
         self.cost = 0
         self.step = 'None'
         self.i = -1
+        # batch optimization
+        self.scheduler = None
+        self.batch_x = np.zeros((0, 0))
+        self.batch_cost = np.zeros(0)
 
 
     def performClose(self, bError=False, options={}):
@@ -25,14 +30,25 @@ class Driver(InstrumentDriver.InstrumentWorker):
 
         if quant.name == 'Cost':
             self.cost += value
+        elif quant.name == 'Batch cost':
+            cost = value['y'] if isinstance(value, dict) else value
+            cost = np.asarray(cost, dtype=float)
+            if cost.shape == self.batch_cost.shape:
+                self.batch_cost += cost
+            else:
+                self.batch_cost = cost
         return value
 
 
     def performGetValue(self, quant, options={}):
         """Perform the Get Value instrument operation"""
+        if self.getValue('Method') != 'Nelder-Mead':
+            return self.getBatchValue(quant)
         if quant.name.startswith('Parameter'):
             n = int(quant.name.split('#')[1]) - 1
             if int(self.getValue('Iteration')) != self.i:
+                if 0 <= self.i == int(self.getValue('Iteration')) - 1:
+                    self.add_history([self.x], [self.cost])
                 self.nelder_mead()
                 self.cost = 0
             value = self.x[n]
@@ -44,12 +60,125 @@ class Driver(InstrumentDriver.InstrumentWorker):
             value = quant.getValue()
         return value
 
+    def getBatchValue(self, quant):
+        """Get value in batch mode, all points of an iteration are evaluated
+        together and the costs are set as a vector"""
+        if (quant.name.startswith('Parameter') or
+                quant.name.startswith('Batch parameter') or
+                quant.name.startswith('Best')):
+            if int(self.getValue('Iteration')) != self.i:
+                self.batch_step()
+                self.batch_cost = np.zeros(len(self.batch_x))
+                self.cost = 0
+        if quant.name.startswith('Batch parameter'):
+            n = int(quant.name.split('#')[1]) - 1
+            value = quant.getTraceDict(self.batch_x[:, n], x0=0, dx=1)
+        elif quant.name.startswith('Parameter'):
+            # first point of the batch, for sequential evaluation
+            n = int(quant.name.split('#')[1]) - 1
+            value = self.batch_x[0, n]
+        elif quant.name.startswith('Best parameter'):
+            n = int(quant.name.split('#')[1]) - 1
+            value = self.scheduler.best_x[n]
+        elif quant.name == 'Best cost':
+            value = self.scheduler.best_cost
+            if self.getValue('Maximize'):
+                value = -value
+        elif quant.name == 'Number of evaluations':
+            value = 0 if self.scheduler is None else \
+                self.scheduler.n_evaluations
+        elif quant.name == 'Batch cost':
+            value = quant.getTraceDict(self.batch_cost, x0=0, dx=1)
+        elif quant.name == 'Cost':
+            value = self.cost
+        else:
+            value = quant.getValue()
+        return value
+
     def cost_function(self):
         if self.getValue('Maximize'):
             return -self.cost
         else:
             return self.cost
 
+    def get_names(self):
+        """Names of parameters, for identifying evaluations in history"""
+        n_parameters = int(self.getValue('Number of parameters'))
+        return [self.getValue('Name parameter #{}'.format(i+1)) or
+                'Parameter #{}'.format(i+1) for i in range(n_parameters)]
+
+    def add_history(self, points, costs):
+        """Add evaluated points and measured costs to history"""
+        history = optimizers.get_history(self.getValue('History file'))
+        history.add(self.get_names(), points, costs)
+
+    def batch_step(self):
+        """Report costs of last batch and propose points for next iteration"""
+        i_previous = self.i
+        self.i = int(self.getValue('Iteration'))
+        if self.i == 0 or self.scheduler is None:
+            self.n_parameters = int(self.getValue('Number of parameters'))
+            x_start = np.array([
+                self.getValue('Start value parameter #{}'.format(i+1))
+                for i in range(self.n_parameters)])
+            x_step = np.array([
+                self.getValue('Step size parameter #{}'.format(i+1))
+                for i in range(self.n_parameters)])
+            batch_size = int(self.getValue('Batch size'))
+            mode = self.getValue('Method')
+            if mode == 'Parallel Nelder-Mead':
+                # one point per vertex, or two if expansion or contraction
+                opts = [optimizers.parallel_nelder_mead(
+                    x_start, x_step, batch_size)]
+            elif mode == 'Multi-start Nelder-Mead':
+                # one simplex per point in batch, first at start value
+                rng = np.random.RandomState(0)
+                spread = self.getValue('Start point spread')
+                starts = [x_start] + [
+                    x_start + spread * x_step *
+                    rng.uniform(-1, 1, self.n_parameters)
+                    for n in range(batch_size - 1)]
+                opts = [optimizers.nelder_mead(x, x_step) for x in starts]
+            elif mode == 'Bayesian':
+                (x_prior, y_prior) = (None, None)
+                names = self.get_names()
+                # default names do not identify the parameters
+                named = all(name != 'Parameter #{}'.format(i+1)
+                            for i, name in enumerate(names))
+                if self.getValue('Warm start from history') and not named:
+                    self.log('No warm start, parameters must be named')
+                elif self.getValue('Warm start from history'):
+                    history = optimizers.get_history(
+                        self.getValue('History file'))
+                    (x_prior, y_prior) = history.get(names)
+                    if self.getValue('Maximize'):
+                        y_prior = -y_prior
+                    self.log('Warm start from %d evaluations' % len(y_prior))
+                opts = [optimizers.bayesian(
+                    x_start, x_step, self.getValue('Search range'),
+                    int(self.getValue('Initial points')), x_prior, y_prior,
+                    batch_size)]
+            else:
+                opts = [optimizers.cma_es(x_start, x_step, batch_size)]
+            self.scheduler = optimizers.BatchScheduler(opts, batch_size)
+        else:
+            if len(self.batch_cost) != len(self.batch_x):
+                raise ValueError(
+                    'Batch cost has %d elements, expected %d' %
+                    (len(self.batch_cost), len(self.batch_x)))
+            cost = self.batch_cost
+            # with a single point, the scalar cost can be used
+            if len(cost) == 1:
+                cost = cost + self.cost
+            if self.i == i_previous + 1:
+                self.add_history(self.batch_x, cost)
+            if self.getValue('Maximize'):
+                cost = -cost
+            self.scheduler.tell(cost)
+            self.log('Iteration %d, best cost: %g' %
+                     (self.i, self.scheduler.best_cost))
+        self.batch_x = self.scheduler.ask()
+
 
     def nelder_mead(self):
         '''
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+"""Batch optimizers for the Optimizer driver.
+
+The optimizers are written as generators, which yield a list of points to
+evaluate and receive the list of costs of those points. A BatchScheduler
+collects points from one or more optimizers into batches of fixed size, so
+that each batch can be evaluated as one hardware-looped sequence.
+
+All evaluations can be stored in an EvaluationHistory, which is used to
+warm-start the Bayesian optimizer from previous runs with the same parameters.
+"""
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+
+
+def nelder_mead(x_start, x_step, alpha=1., gamma=2., rho=0.5, sigma=0.5):
+    """Nelder-Mead simplex optimizer, vertices are evaluated together on
+    initialization and reduction.
+
+    Parameters
+    ----------
+    x_start : numpy array
+        Start point.
+    x_step : numpy array
+        Step size of each parameter, for creating the initial simplex.
+    alpha, gamma, rho, sigma : float
+        Reflection, expansion, contraction and reduction coefficients.
+
+    """
+    x_start = np.asarray(x_start, dtype=float)
+    simplex = [x_start] + [x_start + np.diag(x_step)[k]
+                           for k in range(len(x_start))]
+    costs = yield simplex
+    res = list(zip(simplex, costs))
+    while True:
+        # order
+        res.sort(key=lambda x: x[1])
+        # centroid
+        x0 = np.mean([x for (x, f) in res[:-1]], axis=0)
+        # reflection
+        xr = x0 + alpha * (x0 - res[-1][0])
+        (fr,) = yield [xr]
+        if res[0][1] <= fr < res[-2][1]:
+            res[-1] = (xr, fr)
+            continue
+        # expansion
+        if fr < res[0][1]:
+            xe = x0 + gamma * (xr - x0)
+            (fe,) = yield [xe]
+            res[-1] = (xe, fe) if fe < fr else (xr, fr)
+            continue
+        # contraction
+        xc = x0 + rho * (res[-1][0] - x0)
+        (fc,) = yield [xc]
+        if fc < res[-1][1]:
+            res[-1] = (xc, fc)
+            continue
+        # reduction towards best point, all vertices at once
+        x1 = res[0][0]
+        points = [x1 + sigma * (x - x1) for (x, f) in res[1:]]
+        costs = yield points
+        res = [res[0]] + list(zip(points, costs))
+
+
+def parallel_nelder_mead(x_start, x_step, n_parallel, alpha=1., gamma=2.,
+                         rho=0.5, sigma=0.5):
+    """Nelder-Mead optimizer updating the n_parallel worst vertices at once.
+
+    The worst vertices are reflected through the centroid of the remaining
+    ones, and expansion or contraction points for all of them are evaluated
+    together. If no vertex improves, the simplex is reduced towards the best
+    point. With n_parallel = 1, this is the standard Nelder-Mead method.
+    The centroid degenerates if most vertices are updated, n_parallel is
+    therefore limited to half the number of vertices. See nelder_mead for a
+    description of the parameters.
+
+    """
+    x_start = np.asarray(x_start, dtype=float)
+    n = len(x_start)
+    n_parallel = max(1, min(int(n_parallel), (n + 1) // 2))
+    simplex = [x_start] + [x_start + np.diag(x_step)[k] for k in range(n)]
+    costs = yield simplex
+    res = list(zip(simplex, costs))
+    while True:
+        res.sort(key=lambda x: x[1])
+        keep = res[:-n_parallel]
+        worst = res[-n_parallel:]
+        x0 = np.mean([x for (x, f) in keep], axis=0)
+        # reflect all worst vertices
+        xr = [x0 + alpha * (x0 - x) for (x, f) in worst]
+        fr = yield xr
+        new = list(worst)
+        second = []
+        for k in range(n_parallel):
+            if res[0][1] <= fr[k] < keep[-1][1]:
+                new[k] = (xr[k], fr[k])
+            elif fr[k] < res[0][1]:
+                second.append((k, 'expansion', x0 + gamma * (xr[k] - x0)))
+            else:
+                second.append((k, 'contraction',
+                               x0 + rho * (worst[k][0] - x0)))
+        # expansion and contraction points are evaluated together
+        if len(second) > 0:
+            costs = yield [x for (k, step, x) in second]
+            for (k, step, x), f in zip(second, costs):
+                if step == 'expansion':
+                    new[k] = (x, f) if f < fr[k] else (xr[k], fr[k])
+                elif f < worst[k][1]:
+                    new[k] = (x, f)
+        if any(a is not b for (a, b) in zip(new, worst)):
+            res = keep + new
+            continue
+        # no improvement, reduction towards best point
+        x1 = res[0][0]
+        points = [x1 + sigma * (x - x1) for (x, f) in res[1:]]
+        costs = yield points
+        res = [res[0]] + list(zip(points, costs))
+
+
+def cma_es(x_start, x_step, population, seed=0):
+    """Covariance matrix adaptation evolution strategy.
+
+    Parameters
+    ----------
+    x_start : numpy array
+        Start point, mean of the first population.
+    x_step : numpy array
+        Step size of each parameter, spread of the first population.
+    population : int
+        Number of points in each generation.
+    seed : int
+        Seed for random number generation.
+
+    """
+    rng = np.random.RandomState(seed)
+    x_start = np.asarray(x_start, dtype=float)
+    x_step = np.asarray(x_step, dtype=float)
+    n = len(x_start)
+    lam = max(2, int(population))
+    mu = lam // 2
+    # recombination weights and strategy parameters
+    w = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    w /= np.sum(w)
+    mueff = 1 / np.sum(w**2)
+    cc = (4 + mueff / n) / (n + 4 + 2 * mueff / n)
+    cs = (mueff + 2) / (n + mueff + 5)
+    c1 = 2 / ((n + 1.3)**2 + mueff)
+    cmu = min(1 - c1, 2 * (mueff - 2 + 1 / mueff) / ((n + 2)**2 + mueff))
+    damps = 1 + 2 * max(0, np.sqrt((mueff - 1) / (n + 1)) - 1) + cs
+    chiN = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n**2))
+    # parameters are normalized by step size
+    mean = np.zeros(n)
+    step = 1.0
+    C = np.eye(n)
+    (pc, ps) = (np.zeros(n), np.zeros(n))
+    generation = 0
+    while True:
+        (D, B) = np.linalg.eigh(C)
+        D = np.sqrt(np.maximum(D, 1E-20))
+        z = rng.standard_normal((lam, n))
+        y = mean + step * (z * D) @ B.T
+        costs = yield list(x_start + y * x_step)
+        generation += 1
+        # update mean from best points
+        index = np.argsort(costs)[:mu]
+        old_mean = mean
+        mean = w @ y[index]
+        # update evolution paths
+        dmean = (mean - old_mean) / step
+        ps = ((1 - cs) * ps +
+              np.sqrt(cs * (2 - cs) * mueff) * (B @ ((B.T @ dmean) / D)))
+        hsig = (np.linalg.norm(ps) /
+                np.sqrt(1 - (1 - cs)**(2 * generation)) / chiN <
+                1.4 + 2 / (n + 1))
+        pc = (1 - cc) * pc + hsig * np.sqrt(cc * (2 - cc) * mueff) * dmean
+        # update covariance matrix and step size
+        artmp = (y[index] - old_mean) / step
+        C = ((1 - c1 - cmu) * C +
+             c1 * (np.outer(pc, pc) + (1 - hsig) * cc * (2 - cc) * C) +
+             cmu * (artmp.T * w) @ artmp)
+        step *= np.exp((cs / damps) * (np.linalg.norm(ps) / chiN - 1))
+
+
+def expected_improvement(mu, sigma, y_best):
+    """Expected improvement of a minimization below y_best"""
+    from scipy.stats import norm
+    sigma = np.maximum(sigma, 1E-12)
+    z = (y_best - mu) / sigma
+    return (y_best - mu) * norm.cdf(z) + sigma * norm.pdf(z)
+
+
+def bayesian(x_start, x_step, x_range, n_initial, x_prior=None,
+             y_prior=None, batch_size=1, max_points=500, seed=0):
+    """Bayesian optimizer, with a Gaussian process surrogate model.
+
+    The next points are picked by maximizing the expected improvement over
+    the lowest predicted cost of the evaluated points, which is robust to
+    measurement noise. For batches, the points after the first are picked
+    assuming that the cost of the earlier points equals the prediction.
+
+    Parameters
+    ----------
+    x_start : numpy array
+        Start point, center of the search region.
+    x_step : numpy array
+        Step size of each parameter.
+    x_range : float
+        Half width of the search region, in units of step size.
+    n_initial : int
+        Number of evaluated points before using the surrogate model, the
+        first points are the start point and random points.
+    x_prior, y_prior : numpy array, optional
+        Previous evaluations, shape (n, n_parameters) and (n,).
+    batch_size : int
+        Number of points yielded at once.
+    max_points : int
+        Max number of points for the surrogate model, older points are
+        dropped.
+    seed : int
+        Seed for random number generation.
+
+    """
+    from scipy.optimize import minimize
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import (ConstantKernel, Matern,
+                                                  WhiteKernel)
+    rng = np.random.RandomState(seed)
+    x_start = np.asarray(x_start, dtype=float)
+    n = len(x_start)
+    # search in normalized coordinates, with unit cube as search region
+    lower = x_start - x_range * np.abs(x_step)
+    width = np.maximum(2 * x_range * np.abs(x_step), 1E-300)
+    if x_prior is None or len(x_prior) == 0:
+        (U, y) = (np.zeros((0, n)), np.zeros(0))
+    else:
+        U = (np.asarray(x_prior, dtype=float) - lower) / width
+        y = np.asarray(y_prior, dtype=float)
+    # initial points, starting with the start point
+    if len(y) < n_initial:
+        u = rng.uniform(size=(n_initial - len(y), n))
+        if len(y) == 0:
+            u[0] = 0.5
+        costs = yield list(lower + u * width)
+        (U, y) = (np.vstack((U, u)), np.concatenate((y, costs)))
+    kernel = (ConstantKernel(1.0, (1E-3, 1E3)) *
+              Matern(np.full(n, 0.3), (1E-3, 1E2), nu=2.5) +
+              WhiteKernel(1E-3, (1E-8, 1E0)))
+    while True:
+        (U, y) = (U[-max_points:], y[-max_points:])
+        gp = GaussianProcessRegressor(kernel, normalize_y=True,
+                                      n_restarts_optimizer=2,
+                                      random_state=rng)
+        # hyperparameters at the bounds are expected for few points
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            gp.fit(U, y)
+        # start next fit from current hyperparameters
+        kernel = gp.kernel_
+        (U_batch, y_batch) = (U, y)
+        points = []
+        for k in range(batch_size):
+            y_best = np.min(gp.predict(U_batch))
+
+            def negative_ei(u):
+                (mu, sigma) = gp.predict(np.atleast_2d(u), return_std=True)
+                return -expected_improvement(mu, sigma, y_best)
+
+            # random candidates and candidates around best point, followed
+            # by local optimization of the best candidates
+            u_best = U_batch[np.argmin(y_batch)]
+            candidates = np.vstack((
+                rng.uniform(size=(1000, n)),
+                np.clip(u_best + 0.05 * rng.standard_normal((200, n)), 0, 1)))
+            ei = -negative_ei(candidates)
+            u_next = candidates[np.argmax(ei)]
+            ei_next = np.max(ei)
+            for u0 in candidates[np.argsort(ei)[-3:]]:
+                res = minimize(lambda u: negative_ei(u)[0], u0,
+                               method='L-BFGS-B', bounds=[(0, 1)] * n)
+                if -res.fun > ei_next:
+                    (u_next, ei_next) = (res.x, -res.fun)
+            points.append(lower + u_next * width)
+            if k < batch_size - 1:
+                # assume predicted cost, keep hyperparameters
+                (U_batch, y_batch) = (
+                    np.vstack((U_batch, u_next)),
+                    np.append(y_batch, gp.predict(np.atleast_2d(u_next))))
+                gp = GaussianProcessRegressor(kernel, normalize_y=True,
+                                              optimizer=None)
+                gp.fit(U_batch, y_batch)
+        costs = yield points
+        U = np.vstack([U] + [(x - lower) / width for x in points])
+        y = np.concatenate((y, costs))
+
+
+class EvaluationHistory:
+    """Evaluated points and costs, identified by parameter names.
+
+    If a file is given, evaluations are appended to it as JSON lines, so that
+    the history is kept between runs and driver restarts.
+
+    Parameters
+    ----------
+    path : str
+        Path of history file, if empty the history is only kept in memory.
+
+    """
+
+    def __init__(self, path=''):
+        self.path = path
+        self.records = []
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.records = [json.loads(line) for line in f
+                                if line.strip()]
+
+    def add(self, names, points, costs):
+        """Add evaluations of parameters with the given names"""
+        records = [dict(parameters=dict(zip(names, map(float, x))),
+                        cost=float(cost), time=time.time())
+                   for x, cost in zip(points, costs)]
+        self.records += records
+        if self.path:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(self.path, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+
+    def get(self, names):
+        """Get evaluations with the same set of parameters.
+
+        Returns
+        -------
+        points : numpy array
+            Points, with parameters ordered as names, shape (n, len(names)).
+        costs : numpy array
+            Cost of each point.
+
+        """
+        records = [r for r in self.records
+                   if set(r['parameters']) == set(names)]
+        points = np.array([[r['parameters'][name] for name in names]
+                           for r in records]).reshape(len(records), len(names))
+        costs = np.array([r['cost'] for r in records])
+        return (points, costs)
+
+
+_histories = dict()
+
+
+def get_history(path=''):
+    """Get evaluation history, shared between driver instances"""
+    if path not in _histories:
+        _histories[path] = EvaluationHistory(path)
+    return _histories[path]
+
+
+class BatchScheduler:
+    """Collect points from optimizers into batches of fixed size.
+
+    Points are taken from the optimizers in turn. If the optimizers have
+    fewer points waiting for evaluation than the batch size, the batch is
+    padded with the best point found so far.
+
+    Parameters
+    ----------
+    optimizers : list of generator
+        Optimizers, see nelder_mead.
+    batch_size : int
+        Number of points in each batch.
+
+    """
+
+    def __init__(self, optimizers, batch_size):
+        self.optimizers = list(optimizers)
+        self.batch_size = int(batch_size)
+        # points waiting for evaluation and their costs, for each optimizer
+        self.pending = [list(next(opt)) for opt in self.optimizers]
+        self.costs = [[] for opt in self.optimizers]
+        self.n_asked = [0] * len(self.optimizers)
+        self.batch = []
+        self.best_x = np.asarray(self.pending[0][0], dtype=float)
+        self.best_cost = np.inf
+        self.n_evaluations = 0
+
+    def ask(self):
+        """Get next batch of points, shape (batch_size, n_parameters)"""
+        self.batch = []
+        while len(self.batch) < self.batch_size:
+            added = False
+            for n in range(len(self.optimizers)):
+                if (self.n_asked[n] < len(self.pending[n]) and
+                        len(self.batch) < self.batch_size):
+                    self.batch.append((n, self.pending[n][self.n_asked[n]]))
+                    self.n_asked[n] += 1
+                    added = True
+            if not added:
+                break
+        points = [x for (n, x) in self.batch]
+        points += [self.best_x] * (self.batch_size - len(points))
+        return np.array(points)
+
+    def tell(self, costs):
+        """Report costs of last batch, padded points are ignored"""
+        for (n, x), cost in zip(self.batch, costs):
+            self.costs[n].append(cost)
+            self.n_evaluations += 1
+            if cost < self.best_cost:
+                (self.best_x, self.best_cost) = (x, cost)
+        # send costs to optimizers with all points evaluated
+        for n, opt in enumerate(self.optimizers):
+            if len(self.costs[n]) == len(self.pending[n]):
+                self.pending[n] = list(opt.send(self.costs[n]))
+                self.costs[n] = []
+                self.n_asked[n] = 0
+        self.batch = []
+
+
+if __name__ == '__main__':
+    pass
@@ -18,6 +18,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
 		"""Perform the operation of opening the instrument connection"""
 		# init variables
 		self.multiqubit = MultiQubitHamiltonian()
+		self.solver = EigenSolver()
 		# self.vPolarization = np.zeros((4,))
 		# self.lTrace = [np.array([], dtype=float) for n in range(4)]
 
@@ -88,6 +89,10 @@ class Driver(InstrumentDriver.InstrumentWorker):
 					dFlux_Q3 = self.getValue('Q3 Flux Bias'))
 		# update config
 		self.multiqubit.updateSimCfg(Config)
+		self.solver.updateSimCfg(dict(
+					sMethod = self.getValue('Eigensolver'),
+					nLevel = int(self.getValue('Number of Levels')),
+					sIdentify = self.getValue('Level Identification')))
 		if self.multiqubit.nQubit == 1:
 			self.multiqubit.generateLabel_1Q()
 			self.multiqubit.list_label_select = ['0','1','2','3']
@@ -103,8 +108,9 @@ class Driver(InstrumentDriver.InstrumentWorker):
 		# log.info(str(self.multiqubit.dC1))
 		#
 		# find eigensolution of system Hamiltonian
-		self.multiqubit.vals_unlabel, self.multiqubit.vecs_unlabel = eigensolve(self.multiqubit.H_sys)
-		self.multiqubit.vals_label, self.multiqubit.vecs_label = level_identify(self.multiqubit.vals_unlabel, self.multiqubit.vecs_unlabel, self.multiqubit.list_label_table, self.multiqubit.list_label_select)
+		(self.multiqubit.vals_unlabel, self.multiqubit.vecs_unlabel,
+			self.multiqubit.vals_label, self.multiqubit.vecs_label) = self.solver.solve(
+			self.multiqubit.H_sys, self.multiqubit.list_label_table, self.multiqubit.list_label_select)
 		self.vals_unlabel_show = self.multiqubit.vals_unlabel
 		self.vals_label_show = self.multiqubit.vals_label
 
@@ -5,8 +5,12 @@ Created on Wed Jan 24 2018
 @author: Fei Yan
 """
 
+import itertools
 import numpy as np
-from scipy.linalg import eig
+import scipy.sparse as sp
+from scipy.linalg import eig, eigh
+from scipy.sparse.linalg import eigsh
+from scipy.optimize import linear_sum_assignment
 from qutip import *
 
 import logging
@@ -54,7 +58,7 @@ def Qflatten(Q):
 
 def eigensolve(H):
 	# find eigensolution of H
-	H = H.full()
+	H = H.full() if isinstance(H, Qobj) else toSparse(H).toarray()
 	vals, vecs = eig(H)    
 	#idx = vals.argsort()[::-1] #Descending Order
 	idx = vals.argsort() #Ascending Order
@@ -76,6 +80,179 @@ def level_identify(vals, vecs, list_table, list_select):
 				break			
 	return vals[v_idx], vecs[:,v_idx]
 
+def toSparse(H):
+	# convert Hamiltonian to a scipy CSR matrix, for both QuTiP 4 and 5
+	if isinstance(H, Qobj):
+		if hasattr(H, 'data_as'):
+			H = H.to('csr').data_as('csr_matrix')
+		else:
+			H = H.data
+	return sp.csr_matrix(H)
+
+def eigensolve_hermitian(H, nLevel=None, bSparse=False, vals_guess=None, vecs_guess=None):
+	# find the lowest nLevel eigensolutions of Hermitian H, either by dense
+	# diagonalization or by sparse Lanczos iterations. The solution of a
+	# previous sweep point can be given to warm-start the Lanczos iterations.
+	H = toSparse(H)
+	nDim = H.shape[0]
+	nLevel = nDim if nLevel is None else max(1, min(int(nLevel), nDim))
+	# Lanczos needs the number of levels to be small compared to dimension
+	if not bSparse or 3 * nLevel >= nDim:
+		return eigh(H.toarray(), subset_by_index=[0, nLevel-1])
+	if vecs_guess is not None and vecs_guess.shape == (nDim, nLevel):
+		# shift-invert around a point below the previous lowest levels
+		dSigma = vals_guess[0] - (vals_guess[-1] - vals_guess[0]) - 1.0
+		vals, vecs = eigsh(H.tocsc(), k=nLevel, sigma=dSigma, which='LM',
+			v0=vecs_guess.sum(axis=1))
+		# levels below shift point may be missed, if so solve without guess
+		if np.min(vals) > dSigma:
+			idx = vals.argsort()
+			return vals[idx], vecs[:,idx]
+	vals, vecs = eigsh(H, k=nLevel, which='SA')
+	idx = vals.argsort()
+	return vals[idx], vecs[:,idx]
+
+def track_levels(vecs_ref, vecs):
+	# match eigenvectors to reference vectors by maximum total overlap,
+	# returns indices of matching vectors and their overlap
+	mOverlap = np.abs(np.dot(np.conj(vecs_ref.T), vecs))**2
+	row, col = linear_sum_assignment(-mOverlap)
+	return col, mOverlap[row, col]
+
+
+
+class OperatorBasis():
+	# sparse operators of a multi-qubit system, stored with a common sparsity
+	# pattern so that a linear combination is a single vector-matrix product
+
+	def __init__(self, nQubit, nTrunc):
+		self.nQubit = nQubit
+		self.nTrunc = nTrunc
+		# single-qubit operators, truncated at nTrunc
+		a = np.diag(np.sqrt(np.arange(1, nTrunc)), 1).astype(complex)
+		ad = a.conj().T
+		OP = {'I': np.eye(nTrunc), 'x': a + ad, 'p': -1j*(a - ad),
+			'aa': ad @ a, 'aaaa': ad @ ad @ a @ a}
+		def tensor_op(dOp):
+			# tensor product with operators dOp[k] at qubit k, identity elsewhere
+			mOp = sp.identity(1, dtype=complex, format='csr')
+			for k in range(nQubit):
+				mOp = sp.kron(mOp, sp.csr_matrix(OP[dOp.get(k, 'I')]), format='csr')
+			return mOp
+		dOperators = dict()
+		for k in range(nQubit):
+			# self Hamiltonian and drive operators
+			for name in ('aa', 'aaaa'):
+				dOperators['Q%d_%s' % (k+1, name)] = tensor_op({k: name})
+			for name in ('x', 'p'):
+				dOperators['dr_Q%d_%s' % (k+1, name)] = tensor_op({k: name})
+			# coupling operators
+			for k2 in range(k+1, nQubit):
+				for name in ('x', 'p'):
+					dOperators['%d%d_%s%s' % (k+1, k2+1, name, name)] = \
+						tensor_op({k: name, k2: name})
+		self.list_name = list(dOperators.keys())
+		self.index = {name: n for n, name in enumerate(self.list_name)}
+		# common sparsity pattern, with sorted indices
+		pattern = sum(abs(m) for m in dOperators.values()).tocsr()
+		pattern.sort_indices()
+		self.shape = pattern.shape
+		self.indices = pattern.indices
+		self.indptr = pattern.indptr
+		vRow = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+		vLinear = vRow * self.shape[1] + self.indices
+		# data of all operators, aligned to the common pattern
+		self.mData = np.zeros((len(self.list_name), len(vLinear)), dtype=complex)
+		for n, name in enumerate(self.list_name):
+			m = dOperators[name].tocoo()
+			vPos = np.searchsorted(vLinear, m.row * self.shape[1] + m.col)
+			self.mData[n, vPos] = m.data
+		# operators as separate matrices, for direct access
+		self.dOperators = dOperators
+		# number state labels, same order as tensor product basis
+		self.list_label = [''.join(label) for label in
+			itertools.product(*[[str(n) for n in range(nTrunc)]]*nQubit)]
+
+
+	def combine(self, dCoeff):
+		# linear combination of operators, given as {name: coefficient}
+		vCoeff = np.zeros(len(self.list_name))
+		for name, value in dCoeff.items():
+			vCoeff[self.index[name]] = value
+		return sp.csr_matrix((vCoeff @ self.mData, self.indices, self.indptr),
+			shape=self.shape)
+
+
+# operator bases, keyed by number of qubits and truncation
+_operator_cache = dict()
+
+def getOperatorBasis(nQubit, nTrunc):
+	# get cached operator basis, or generate if not already available
+	key = (int(nQubit), int(nTrunc))
+	if key not in _operator_cache:
+		_operator_cache[key] = OperatorBasis(*key)
+	return _operator_cache[key]
+
+
+
+class EigenSolver():
+
+	def __init__(self):
+		# 'General', 'Hermitian dense' or 'Hermitian sparse'
+		self.sMethod = 'General'
+		# number of levels for Hermitian solvers
+		self.nLevel = 20
+		# identify levels by 'Bare state' component, or by 'Continuation' of
+		# eigenvector overlap with the previous sweep point
+		self.sIdentify = 'Bare state'
+		# re-identify by bare state if overlap with previous point is smaller
+		self.dMinOverlap = 0.5
+		self.reset()
+
+
+	def updateSimCfg(self, simCfg):
+		# update solver options
+		for key, value in simCfg.items():
+			if hasattr(self, key):
+				setattr(self, key, value)
+
+
+	def reset(self):
+		# forget solution of previous sweep point
+		self.vals_prev = None
+		self.vecs_prev = None
+		self.vecs_label_prev = None
+		self.key_prev = None
+
+
+	def solve(self, H, list_table, list_select):
+		# find eigensolution of H, and identify levels in "list_select". The
+		# solution is kept for warm-starting the next sweep point.
+		# all labelled levels must be among the computed levels
+		nLevel = max(int(self.nLevel), len(list_select))
+		key = (self.sMethod, nLevel, H.shape[0], tuple(list_select))
+		if key != self.key_prev:
+			self.reset()
+		if self.sMethod == 'General':
+			vals, vecs = eigensolve(H)
+		else:
+			vals, vecs = eigensolve_hermitian(H, nLevel,
+				self.sMethod == 'Hermitian sparse', self.vals_prev, self.vecs_prev)
+		vals_label = vecs_label = None
+		if self.sIdentify == 'Continuation' and self.vecs_label_prev is not None:
+			# follow levels by overlap with previous sweep point
+			idx, overlap = track_levels(self.vecs_label_prev, vecs)
+			if np.min(overlap) >= self.dMinOverlap:
+				vals_label, vecs_label = vals[idx], vecs[:,idx]
+			else:
+				log.info('Level continuity lost, identifying levels by bare state')
+		if vals_label is None:
+			vals_label, vecs_label = level_identify(vals, vecs, list_table, list_select)
+		self.vals_prev, self.vecs_prev = vals, vecs
+		self.vecs_label_prev = vecs_label
+		self.key_prev = key
+		return vals, vecs, vals_label, vecs_label
+
 
 
 class MultiQubitHamiltonian():
@@ -159,135 +336,75 @@ class MultiQubitHamiltonian():
 				setattr(self, 'dAnh_Q3', -self.dEc_Q3)
 
 
-	def generateOperators(self):
-		# generate basic operators. matrix truncated at nTrunc 
-		I = qeye(self.nTrunc)
-		a = destroy(self.nTrunc)
-		x = a + a.dag()
-		p = -1j*(a - a.dag())
-		aa = a.dag() * a
-		aaaa = a.dag() * a.dag() * a * a
-		return {'I':I, 'a':a, 'x':x, 'p':p, 'aa':aa, 'aaaa':aaaa}
+	def generateSubHamiltonian(self, nQubit):
+		# get partial Hamiltonian operators, only generated once for each
+		# number of qubits and truncation
+		self.basis = getOperatorBasis(nQubit, self.nTrunc)
+		for name, op in self.basis.dOperators.items():
+			setattr(self, 'H_' + name, op)
 
 
 	def generateSubHamiltonian_1Q(self):
-		# generate partial Hamiltonian in 3-qubit system
-		OP = self.generateOperators()
-		# self Hamiltonian operators
-		self.H_Q1_aa = Qflatten(tensor(OP['aa']))
-		self.H_Q1_aaaa = Qflatten(tensor(OP['aaaa']))
-		# drive Hamiltonian operators
-		self.H_dr_Q1_x = Qflatten(tensor(OP['x']))
-		self.H_dr_Q1_p = Qflatten(tensor(OP['p']))
+		# generate partial Hamiltonian in 1-qubit system
+		self.generateSubHamiltonian(1)
 
 
 	def generateHamiltonian_1Q_cap(self):
-		# construct 3-qubit Hamiltonian
+		# construct 1-qubit Hamiltonian
 		self.generateSubHamiltonian_1Q()
-		# self Hamiltonian
-		self.H_Q1 = self.dFreq_Q1 * self.H_Q1_aa + self.dAnh_Q1/2 * self.H_Q1_aaaa
 		# system Hamiltonian
-		self.H_sys = self.H_Q1 + self.H_Q2 + self.H_12
+		self.H_sys = self.basis.combine({
+			'Q1_aa': self.dFreq_Q1, 'Q1_aaaa': self.dAnh_Q1/2})
 
 
 	def generateLabel_1Q(self):
 		# generate 3-qubit number state label list
-		list_label_gen = ["0","1","2","3","4","5","6","7"]
-		self.list_label_table = []
-		for k1 in np.arange(self.nTrunc):
-			self.list_label_table.append(list_label_gen[k1])
+		self.list_label_table = getOperatorBasis(1, self.nTrunc).list_label
 
 
 	def generateSubHamiltonian_2Q(self):
-		# generate partial Hamiltonian in 3-qubit system
-		OP = self.generateOperators()
-		# self Hamiltonian operators
-		self.H_Q1_aa = Qflatten(tensor(OP['aa'], OP['I']))
-		self.H_Q1_aaaa = Qflatten(tensor(OP['aaaa'], OP['I']))
-		self.H_Q2_aa = Qflatten(tensor(OP['I'], OP['aa']))
-		self.H_Q2_aaaa = Qflatten(tensor(OP['I'], OP['aaaa']))
-		# coupling Hamiltonian operators
-		self.H_12_xx = Qflatten(tensor(OP['x'], OP['x']))#
-		self.H_12_pp = Qflatten(tensor(OP['p'], OP['p']))
-		# drive Hamiltonian operators
-		self.H_dr_Q1_x = Qflatten(tensor(OP['x'], OP['I']))
-		self.H_dr_Q2_x = Qflatten(tensor(OP['I'], OP['x']))
-		self.H_dr_Q1_p = Qflatten(tensor(OP['p'], OP['I']))
-		self.H_dr_Q2_p = Qflatten(tensor(OP['I'], OP['p']))
+		# generate partial Hamiltonian in 2-qubit system
+		self.generateSubHamiltonian(2)
 
 
 	def generateHamiltonian_2Q_cap(self):
-		# construct 3-qubit Hamiltonian
+		# construct 2-qubit Hamiltonian
 		self.generateSubHamiltonian_2Q()
-		# self Hamiltonian
-		self.H_Q1 = self.dFreq_Q1 * self.H_Q1_aa + self.dAnh_Q1/2 * self.H_Q1_aaaa
-		self.H_Q2 = self.dFreq_Q2 * self.H_Q2_aa + self.dAnh_Q2/2 * self.H_Q2_aaaa
 		# coupling Hamiltonian
 		self.g_12 = 0.5 * self.c12 * np.sqrt(self.dFreq_Q1 * self.dFreq_Q2)
-		self.H_12 = self.g_12 * self.H_12_pp
 		# system Hamiltonian
-		self.H_sys = self.H_Q1 + self.H_Q2 + self.H_12
+		self.H_sys = self.basis.combine({
+			'Q1_aa': self.dFreq_Q1, 'Q1_aaaa': self.dAnh_Q1/2,
+			'Q2_aa': self.dFreq_Q2, 'Q2_aaaa': self.dAnh_Q2/2,
+			'12_pp': self.g_12})
 
 
 	def generateLabel_2Q(self):
 		# generate 3-qubit number state label list
-		list_label_gen = ["0","1","2","3","4","5","6","7"]
-		self.list_label_table = []
-		for k1 in np.arange(self.nTrunc):
-			for k2 in np.arange(self.nTrunc):
-				self.list_label_table.append(list_label_gen[k1] + list_label_gen[k2])
+		self.list_label_table = getOperatorBasis(2, self.nTrunc).list_label
 
 
 	def generateSubHamiltonian_3Q(self):
 		# generate partial Hamiltonian in 3-qubit system
-		OP = self.generateOperators()
-		# self Hamiltonian operators
-		self.H_Q1_aa = Qflatten(tensor(OP['aa'], OP['I'], OP['I']))
-		self.H_Q1_aaaa = Qflatten(tensor(OP['aaaa'], OP['I'], OP['I']))
-		self.H_Q2_aa = Qflatten(tensor(OP['I'], OP['aa'], OP['I']))
-		self.H_Q2_aaaa = Qflatten(tensor(OP['I'], OP['aaaa'], OP['I']))
-		self.H_Q3_aa = Qflatten(tensor(OP['I'], OP['I'], OP['aa']))
-		self.H_Q3_aaaa = Qflatten(tensor(OP['I'], OP['I'], OP['aaaa']))
-		# coupling Hamiltonian operators
-		self.H_12_xx = Qflatten(tensor(OP['x'], OP['x'], OP['I']))
-		self.H_23_xx = Qflatten(tensor(OP['I'], OP['x'], OP['x']))
-		self.H_13_xx = Qflatten(tensor(OP['x'], OP['I'], OP['x']))		#
-		self.H_12_pp = Qflatten(tensor(OP['p'], OP['p'], OP['I']))
-		self.H_23_pp = Qflatten(tensor(OP['I'], OP['p'], OP['p']))
-		self.H_13_pp = Qflatten(tensor(OP['p'], OP['I'], OP['p']))
-		# drive Hamiltonian operators
-		self.H_dr_Q1_x = Qflatten(tensor(OP['x'], OP['I'], OP['I']))
-		self.H_dr_Q2_x = Qflatten(tensor(OP['I'], OP['x'], OP['I']))
-		self.H_dr_Q3_x = Qflatten(tensor(OP['I'], OP['I'], OP['x']))
-		self.H_dr_Q1_p = Qflatten(tensor(OP['p'], OP['I'], OP['I']))
-		self.H_dr_Q2_p = Qflatten(tensor(OP['I'], OP['p'], OP['I']))
-		self.H_dr_Q3_p = Qflatten(tensor(OP['I'], OP['I'], OP['p']))
+		self.generateSubHamiltonian(3)
 
 
 	def generateHamiltonian_3Q_cap(self):
 		# construct 3-qubit Hamiltonian
 		self.generateSubHamiltonian_3Q()
-		# self Hamiltonian
-		self.H_Q1 = self.dFreq_Q1 * self.H_Q1_aa + self.dAnh_Q1/2 * self.H_Q1_aaaa
-		self.H_Q2 = self.dFreq_Q2 * self.H_Q2_aa + self.dAnh_Q2/2 * self.H_Q2_aaaa
-		self.H_Q3 = self.dFreq_Q3 * self.H_Q3_aa + self.dAnh_Q3/2 * self.H_Q3_aaaa
 		# coupling Hamiltonian
 		self.g_12 = 0.5 * self.c12 * np.sqrt(self.dFreq_Q1 * self.dFreq_Q2)
-		self.H_12 = self.g_12 * self.H_12_pp
 		self.g_23 = 0.5 * self.c23 * np.sqrt(self.dFreq_Q2 * self.dFreq_Q3)
-		self.H_23 = self.g_23 * self.H_23_pp
 		self.g_13 = 0.5 * (self.c12 * self.c23 + self.c13) * np.sqrt(self.dFreq_Q1 * self.dFreq_Q3)
-		self.H_13 = self.g_13 * self.H_13_pp
 		# system Hamiltonian
-		self.H_sys = self.H_Q1 + self.H_Q2 + self.H_Q3 + self.H_12 + self.H_23 + self.H_13
+		self.H_sys = self.basis.combine({
+			'Q1_aa': self.dFreq_Q1, 'Q1_aaaa': self.dAnh_Q1/2,
+			'Q2_aa': self.dFreq_Q2, 'Q2_aaaa': self.dAnh_Q2/2,
+			'Q3_aa': self.dFreq_Q3, 'Q3_aaaa': self.dAnh_Q3/2,
+			'12_pp': self.g_12, '23_pp': self.g_23, '13_pp': self.g_13})
 
 
 	def generateLabel_3Q(self):
 		# generate 3-qubit number state label list
-		list_label_gen = ["0","1","2","3","4","5","6","7"]
-		self.list_label_table = []
-		for k1 in np.arange(self.nTrunc):
-			for k2 in np.arange(self.nTrunc):
-				for k3 in np.arange(self.nTrunc):
-					self.list_label_table.append(list_label_gen[k1] + list_label_gen[k2] + list_label_gen[k3])
+		self.list_label_table = getOperatorBasis(3, self.nTrunc).list_label
 
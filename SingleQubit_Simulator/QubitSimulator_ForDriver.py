@@ -3,6 +3,7 @@ import numpy as np
 import scipy.linalg as splin
 import time
 import sys
+import os
 
 # add logger, to allow logging to Labber's instrument log
 import logging
@@ -21,10 +22,11 @@ else:
 #                      "include_dirs":np.get_include()},
 #                      reload_support=True)
 
-from _integrateHNoNumpy_ForDriver import integrateH, integrateHy
+from integrators import integrateHBatch, get_backend
 
 #import matplotlib.pyplot as plt
 
+
 class NoiseCfg():
     
     # define local variables
@@ -168,6 +170,16 @@ class QubitSimulator():
         self.bRotFrame = True
         self.bRemoveNoise = False
         self.bDriveCharge = True
+        # propagate all noise realizations together, using nThread threads
+        self.bBatch = True
+        self.nThread = os.cpu_count() or 1
+        # max number of elements in noise matrices of each batch
+        self.nBatchSize = 2**23
+        # integrator backend, 'Auto' selects the fastest available
+        self.sBackend = 'Auto'
+        self.backend = get_backend(self.sBackend)
+        self.simulationTime = 0.0
+        self.integrationTime = 0.0
         self.lNoiseCfg = [] # [NoiseCfg(bEmpty = True)]
         if simCfg is not None:
             # update simulation options
@@ -181,6 +193,17 @@ class QubitSimulator():
                 setattr(self, key, value)
         
        
+    def integrate(self, vStart, dTimeStep, mDelta, mDetuning, mY, nReshape,
+                  nThread=1):
+        # integrate a batch of trajectories with the selected backend, see
+        # integrators.integrateHBatch, and keep track of integration time
+        start_time = time.perf_counter()
+        mState = integrateHBatch(vStart, dTimeStep, mDelta, mDetuning, mY,
+                                 nReshape, nThread, self.backend)
+        self.integrationTime += time.perf_counter() - start_time
+        return mState
+
+
     def integrateH(self, vStart, vTime, vDelta, vDetuning, vY, nReshape):
         # simulate the time evolution for the start state vStart
         # a state is defined as [Psi0 Psi1]'
@@ -344,71 +367,146 @@ class QubitSimulator():
         # rotatation matrice
         mRotX = splin.expm(-1j*0.5*np.pi*0.5*mSx)
         mRotY = splin.expm(-1j*0.5*np.pi*0.5*mSy)
-        for n1 in range(nRep):
-            # create new vectors for delta and detuning for each time step
-            vDelta = np.zeros(len(vTime)) + vStaticDelta[n1]
-            vDetuning = np.zeros(len(vTime)) + vStaticDet[n1]
-
-            # add noise to both delta and epsilon from all noise sources
-            if nRep>1:
-                for noise in lNoise:
-                    noise.addNoise(vDelta, vDetuning, dTimeStep*1E-9, 1E-9)
-
-            # add externally applied noise for the right repetition
-            if (noise_epsilon is not None):
-                noise_data = np.interp(vTime, noise_epsilon_t, noise_eps_m[n1])
-                vDetuning += noise_data
-            if (noise_delta is not None):
-                noise_data = np.interp(vTime, noise_delta_t, noise_delta_m[n1])
-                vDelta += noise_data
-
-            # if wanted, remove noise where pulses are applied
-            if self.bRemoveNoise:
-                vDelta[pulse_indx] = 0.0
-                vDetuning[pulse_indx] = 0.0
-
-            # combine noise with static bias points
-            vDelta += dDelta
-            vDetuning += dDetuning
+        if self.bBatch:
+            # simulate repetitions in chunks, to limit memory usage
+            nChunk = max(1, int(self.nBatchSize // len(vTime)))
+            for n0 in range(0, nRep, nChunk):
+                vRep = np.arange(n0, min(n0 + nChunk, nRep))
+                # create delta and detuning for all repetitions in chunk, noise
+                # is generated in the same order as for non-batched simulation
+                mDelta = np.zeros((len(vRep), len(vTime)))
+                mDelta += vStaticDelta[vRep, np.newaxis]
+                mDetuning = np.zeros((len(vRep), len(vTime)))
+                mDetuning += vStaticDet[vRep, np.newaxis]
+                for n1, nIndx in enumerate(vRep):
+                    # add noise to both delta and epsilon from all sources
+                    if nRep>1:
+                        for noise in lNoise:
+                            noise.addNoise(mDelta[n1], mDetuning[n1],
+                                           dTimeStep*1E-9, 1E-9)
+                    # add externally applied noise for the right repetition
+                    if (noise_epsilon is not None):
+                        mDetuning[n1] += np.interp(vTime, noise_epsilon_t,
+                                                   noise_eps_m[nIndx])
+                    if (noise_delta is not None):
+                        mDelta[n1] += np.interp(vTime, noise_delta_t,
+                                                noise_delta_m[nIndx])
+                # if wanted, remove noise where pulses are applied
+                if self.bRemoveNoise:
+                    mDelta[:, pulse_indx] = 0.0
+                    mDetuning[:, pulse_indx] = 0.0
+                # combine noise with static bias points
+                mDelta += dDelta
+                mDetuning += dDetuning
+                # do simulation, either using RWA or full Hamiltonian
+                if bRWA:
+                    # new frame, refer to drive frequency
+                    mDetuning = np.sqrt(mDetuning**2 + mDelta**2) - dDriveFreq
+                    mState = self.integrate(
+                        vStart, dTimeStep, np.real(vDrive), mDetuning,
+                        -np.imag(vDrive), nReshape, self.nThread)
+                else:
+                    vDriveScale = 1.0 + vStaticDrive[vRep, np.newaxis]
+                    if self.bDriveCharge:
+                        # drive on Y (= charge)
+                        mState = self.integrate(
+                            vStart, dTimeStep, mDelta, mDetuning,
+                            vDrive * vDriveScale, nReshape, self.nThread)
+                    else:
+                        # drive on Z (= flux)
+                        mDetuning += vDrive * vDriveScale
+                        mState = self.integrate(
+                            vStart, dTimeStep, mDelta, mDetuning, None,
+                            nReshape, self.nThread)
+                    # convert the results to an eigenbasis of dDelta, dDetuning
+                    shape = mState.shape
+                    mState = self.convertToEigen(
+                        mState.reshape((2, -1)), dDelta0,
+                        dDetuning).reshape(shape)
+                    # go to the rotating frame (add timeStep/2 to get the
+                    # right phase)
+                    if bRotFrame:
+                        mState = self.goToRotatingFrame(
+                            mState, vTimeReshape, dDriveFreq,
+                            dTimeZero+dTimeStep/2)
+                # get probablity of measuring p1, and projections on X and Y
+                self.mPz[vRep] = np.abs(mState[1])**2
+                self.mPx[vRep] = np.abs(
+                    mRotX[1, 0]*mState[0] + mRotX[1, 1]*mState[1])**2
+                self.mPy[vRep] = np.abs(
+                    mRotY[1, 0]*mState[0] + mRotY[1, 1]*mState[1])**2
+            vP1 = np.sum(self.mPz, 0)
+            vPx = np.sum(self.mPx, 0)
+            vPy = np.sum(self.mPy, 0)
+        else:
+            for n1 in range(nRep):
+                # create new vectors for delta and detuning for each time step
+                vDelta = np.zeros(len(vTime)) + vStaticDelta[n1]
+                vDetuning = np.zeros(len(vTime)) + vStaticDet[n1]
+
+                # add noise to both delta and epsilon from all noise sources
+                if nRep>1:
+                    for noise in lNoise:
+                        noise.addNoise(vDelta, vDetuning, dTimeStep*1E-9, 1E-9)
+
+                # add externally applied noise for the right repetition
+                if (noise_epsilon is not None):
+                    noise_data = np.interp(vTime, noise_epsilon_t, noise_eps_m[n1])
+                    vDetuning += noise_data
+                if (noise_delta is not None):
+                    noise_data = np.interp(vTime, noise_delta_t, noise_delta_m[n1])
+                    vDelta += noise_data
+
+                # if wanted, remove noise where pulses are applied
+                if self.bRemoveNoise:
+                    vDelta[pulse_indx] = 0.0
+                    vDetuning[pulse_indx] = 0.0
+
+                # combine noise with static bias points
+                vDelta += dDelta
+                vDetuning += dDetuning
  
-             # do simulation, either using RWA or full Hamiltonian
-            if bRWA:
-                # new frame, refer to drive frequency
-                vDetuning = np.sqrt(vDetuning**2 + vDelta**2) - dDriveFreq
-                mState = integrateHy(vStart, vTime, np.real(vDrive), vDetuning, 
-                                     -np.imag(vDrive), nReshape)
-                # mState = self.integrateH(vStart, vTime, np.real(vDrive), vDetuning, 
-                #     np.imag(vDrive), nReshape)
+                 # do simulation, either using RWA or full Hamiltonian
+                if bRWA:
+                    # new frame, refer to drive frequency
+                    vDetuning = np.sqrt(vDetuning**2 + vDelta**2) - dDriveFreq
+                    mState = self.integrate(vStart, dTimeStep, np.real(vDrive),
+                                            vDetuning, -np.imag(vDrive),
+                                            nReshape)[:, 0]
+                    # mState = self.integrateH(vStart, vTime, np.real(vDrive), vDetuning, 
+                    #     np.imag(vDrive), nReshape)
 
-            else:
-                # two different methonds depending if using Y-drive or not
-                if self.bDriveCharge:
-                    # drive on Y (= charge)
-                    vY = vDrive * (1.0 + vStaticDrive[n1])
-                    mState = integrateHy(vStart, vTime, vDelta, vDetuning, vY, nReshape)
-                    # mState = self.integrateH(vStart, vTime, vDelta, vDetuning, vY, nReshape)
                 else:
-                    # drive on Z (= flux)
-                    vDetuning += vDrive * (1.0 + vStaticDrive[n1])
-                    mState = integrateH(vStart, vTime, vDelta, vDetuning, nReshape)
-                    # vY = np.zeros_like(vDrive)
-                    # mState = self.integrateH(vStart, vTime, vDelta, vDetuning, vY, nReshape)
-                # convert the results to an eigenbasis of dDelta, dDetuning
-                mState = self.convertToEigen(mState, dDelta0, dDetuning)
-                # go to the rotating frame (add timeStep/2 to get the right phase)
-                if bRotFrame:
-                    mState = self.goToRotatingFrame(mState, vTimeReshape, dDriveFreq, dTimeZero+dTimeStep/2)
-            # get probablity of measuring p1
-            mStateEig = mState
-            self.mPz[n1,:] = np.real(mStateEig[1,:]*np.conj(mStateEig[1,:]))
-            vP1 += self.mPz[n1,:]
-            # get projection on X and Y
-            mStateEig = np.dot(mRotX,mState)
-            self.mPx[n1,:] = np.real(mStateEig[1,:]*np.conj(mStateEig[1,:]))
-            vPx += self.mPx[n1,:]
-            mStateEig = np.dot(mRotY,mState)
-            self.mPy[n1,:] = np.real(mStateEig[1,:]*np.conj(mStateEig[1,:]))
-            vPy += self.mPy[n1,:]
+                    # two different methonds depending if using Y-drive or not
+                    if self.bDriveCharge:
+                        # drive on Y (= charge)
+                        vY = vDrive * (1.0 + vStaticDrive[n1])
+                        mState = self.integrate(vStart, dTimeStep, vDelta,
+                                                vDetuning, vY, nReshape)[:, 0]
+                        # mState = self.integrateH(vStart, vTime, vDelta, vDetuning, vY, nReshape)
+                    else:
+                        # drive on Z (= flux)
+                        vDetuning += vDrive * (1.0 + vStaticDrive[n1])
+                        mState = self.integrate(vStart, dTimeStep, vDelta,
+                                                vDetuning, None, nReshape)[:, 0]
+                        # vY = np.zeros_like(vDrive)
+                        # mState = self.integrateH(vStart, vTime, vDelta, vDetuning, vY, nReshape)
+                    # convert the results to an eigenbasis of dDelta, dDetuning
+                    mState = self.convertToEigen(mState, dDelta0, dDetuning)
+                    # go to the rotating frame (add timeStep/2 to get the right phase)
+                    if bRotFrame:
+                        mState = self.goToRotatingFrame(mState, vTimeReshape, dDriveFreq, dTimeZero+dTimeStep/2)
+                # get probablity of measuring p1
+                mStateEig = mState
+                self.mPz[n1,:] = np.real(mStateEig[1,:]*np.conj(mStateEig[1,:]))
+                vP1 += self.mPz[n1,:]
+                # get projection on X and Y
+                mStateEig = np.dot(mRotX,mState)
+                self.mPx[n1,:] = np.real(mStateEig[1,:]*np.conj(mStateEig[1,:]))
+                vPx += self.mPx[n1,:]
+                mStateEig = np.dot(mRotY,mState)
+                self.mPy[n1,:] = np.real(mStateEig[1,:]*np.conj(mStateEig[1,:]))
+                vPy += self.mPy[n1,:]
 
         # divide to get average
         vP1 = vP1/nRep
@@ -453,6 +551,8 @@ class QubitSimulator():
     def performSimulation(self, vI, vQ, dTimeStepIn, dTimeStepOut,
                           noise_epsilon=None, noise_delta=None):
         start_time = time.time()
+        self.integrationTime = 0.0
+        self.backend = get_backend(self.sBackend)
         # update sample rate to match time step
         if dTimeStepIn != self.dTimeStep:
             # resample drive waveforms
@@ -480,4 +580,4 @@ class QubitSimulator():
         end_time = time.time()
         self.simulationTime = end_time-start_time
         return (vPz, vPx, vPy, dTimeStepOut)
- 
\ No newline at end of file
+ 
\ No newline at end of file
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import os
 import InstrumentDriver
 import numpy as np
 from QubitSimulator_ForDriver import NoiseCfg, QubitSimulator
@@ -48,6 +49,12 @@ class Driver(InstrumentDriver.InstrumentWorker):
                 # get correct data and return as trace dict
                 vData = self.lTrace[dTrace[quant.name]]
                 value = quant.getTraceDict(vData, dt=self.dTimeStepOut)
+        elif quant.name == 'Integrator in use':
+            value = self.qubitSim.backend.name
+        elif quant.name == 'Simulation time':
+            value = self.qubitSim.simulationTime
+        elif quant.name == 'Integration time':
+            value = self.qubitSim.integrationTime
         else:
             # otherwise, just return current value
             value = quant.getValue()
@@ -66,7 +73,12 @@ class Driver(InstrumentDriver.InstrumentWorker):
                        bRelFreq=bool(self.getValue('Drive relative to qubit frequency')),
                        bRotFrame=bool(self.getValue('Use rotating frame')),
                        bRemoveNoise=bool(self.getValue('Disable noise during pulses')),
-                       bRWA=bool(self.getValue('Use rotating-wave approximation')))
+                       bRWA=bool(self.getValue('Use rotating-wave approximation')),
+                       bBatch=bool(self.getValue('Batch randomizations')),
+                       sBackend=self.getValue('Integrator backend'))
+        # number of threads, use all cores if zero
+        nThread = int(self.getValue('Number of threads'))
+        dConfig['nThread'] = nThread if nThread > 0 else (os.cpu_count() or 1)
         if self.getValue('Drive type') == 'Charge':
             dConfig['bDriveCharge'] = True
         else:
@@ -2,6 +2,7 @@
 #cython: wraparound=False
 import numpy as np
 cimport numpy as np 
+from libc.math cimport sqrt, sin, cos, M_PI
 
 def integrateH(np.ndarray[double, ndim=1] vStart, np.ndarray[double, ndim=1] vTime, \
   np.ndarray[double, ndim=1] vDelta, np.ndarray[double, ndim=1] vDetuning, int nReshape):
@@ -113,6 +114,47 @@ def integrateH_RWA(np.ndarray[double, ndim=1] vStart, np.ndarray[double, ndim=1]
        mState = mState[:,0::nReshape]
     return mState
 
+def integrateHBatch(double complex[:] vStart, double dTimeStep, \
+  const double[:, :] mDelta, const double[:, :] mDetuning, \
+  const double[:, :] mY, int nReshape):
+    # simulate the time evolution of a batch of trajectories, all starting
+    # in state vStart. Input arrays have shape (nRep, nTime), the output has
+    # shape (2, nRep, nOut), with every nReshape:th state.
+    # The GIL is released, so trajectories can be split between threads.
+    cdef Py_ssize_t nRep = mDelta.shape[0]
+    cdef Py_ssize_t nTime = mDelta.shape[1]
+    cdef Py_ssize_t nOut = (nTime + nReshape - 1) // nReshape
+    cdef Py_ssize_t n1, n2
+    cdef double dEnergy, dAngle, dSinEn
+    cdef double complex U11, U12, Psi0, Psi1, Temp
+    mStateOut = np.zeros((2, nRep, nOut), dtype='complex')
+    cdef double complex[:, :, :] mState = mStateOut
+    with nogil:
+        for n1 in range(nRep):
+            Psi0 = vStart[0]
+            Psi1 = vStart[1]
+            mState[0, n1, 0] = Psi0
+            mState[1, n1, 0] = Psi1
+            # apply hamiltonian N times
+            for n2 in range(nTime - 1):
+                dEnergy = 0.5 * sqrt(mDelta[n1, n2]**2 +
+                                     mDetuning[n1, n2]**2 + mY[n1, n2]**2)
+                dAngle = 2 * M_PI * dEnergy * dTimeStep
+                # take care of sin(x)/x division by zero
+                if dEnergy == 0:
+                    dSinEn = 2 * M_PI * dTimeStep
+                else:
+                    dSinEn = sin(dAngle) / dEnergy
+                U11 = cos(dAngle) + 0.5j * mDetuning[n1, n2] * dSinEn
+                U12 = (mY[n1, n2] + 1j * mDelta[n1, n2]) * 0.5 * dSinEn
+                Temp = U11 * Psi0 + U12 * Psi1
+                Psi1 = -U12.conjugate() * Psi0 + U11.conjugate() * Psi1
+                Psi0 = Temp
+                if (n2 + 1) % nReshape == 0:
+                    mState[0, n1, (n2 + 1) // nReshape] = Psi0
+                    mState[1, n1, (n2 + 1) // nReshape] = Psi1
+    return mStateOut
+
 #    mSx = np.array([[0.,1.],[1.,0.]])
 #    mSy = np.array([[0.,-1j],[1j,0.]])
 #    mSz = np.array([[1.,0.],[0.,-1.]])
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Benchmark noise averaging of the single-qubit simulator.
+
+A Rabi-type pulse is simulated with 1/f and static noise, looping over noise
+realizations one by one and with all realizations propagated together. The
+same random seed is used for both, and the difference between the averaged
+traces is reported.
+
+Run from the driver folder, for example::
+
+    python benchmark.py --repetitions 1000 --length 100 --backend NumPy
+
+The compiled backend is only available after building it with
+compileCython.py, otherwise the simulator falls back to NumPy.
+
+"""
+import argparse
+import time
+
+import numpy as np
+
+from QubitSimulator_ForDriver import NoiseCfg, QubitSimulator
+
+
+def time_simulation(batch, n_rep, length, n_thread=1, seed=0,
+                    backend='Auto'):
+    """Run simulation and return traces and simulation time.
+
+    Parameters
+    ----------
+    batch : bool
+        If True, all noise realizations are propagated together.
+    n_rep : int
+        Number of noise realizations.
+    length : float
+        Length of simulation, in ns.
+    n_thread : int
+        Number of threads for the batched simulation.
+    seed : int
+        Seed for random noise generation.
+    backend : str
+        Integrator backend, see integrators.get_backend.
+
+    Returns
+    -------
+    traces : tuple of numpy array
+        Averaged Pz, Px and Py traces.
+    float
+        Simulation time, in seconds.
+    str
+        Integrator backend in use.
+
+    """
+    np.random.seed(seed)
+    sim = QubitSimulator(dict(nRep=n_rep, bBatch=batch, nThread=n_thread,
+                              dDelta=5.0, dRabiAmp=0.05, dTimeStep=0.01,
+                              sBackend=backend))
+    noise_1f = NoiseCfg()
+    noise_1f.model = NoiseCfg.NOISE1F
+    noise_1f.deltaAmp = 1E6
+    noise_1f.hiCutOff = 1E9
+    noise_static = NoiseCfg()
+    noise_static.model = NoiseCfg.NOISESTATIC
+    noise_static.epsAmp = 1E6
+    sim.lNoiseCfg = [noise_1f, noise_static]
+    # drive pulse during first half of simulation
+    dt = 0.01
+    time_vec = dt * np.arange(int(length / dt))
+    vI = np.where(time_vec < length / 2, 1.0, 0.0)
+    vQ = np.zeros_like(vI)
+    t0 = time.perf_counter()
+    (vPz, vPx, vPy, dt_out) = sim.performSimulation(vI, vQ, dt, 0.1)
+    return ((vPz, vPx, vPy), time.perf_counter() - t0, sim.backend.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repetitions', type=int, default=100)
+    parser.add_argument('--length', type=float, default=50.0,
+                        help='Length of simulation, in ns')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--backend', default='Auto',
+                        choices=['Auto', 'NumPy', 'Cython'])
+    args = parser.parse_args()
+
+    reference, t_reference, name = time_simulation(
+        False, args.repetitions, args.length, backend=args.backend)
+    batched, t_batched, name = time_simulation(
+        True, args.repetitions, args.length, args.threads,
+        backend=args.backend)
+    error = max([np.max(np.abs(x - y)) for x, y in zip(reference, batched)])
+    print('%d noise realizations, %.0f ns' % (args.repetitions, args.length))
+    print('Backend:   %s' % name)
+    print('Loop:      %.3f s' % t_reference)
+    print('Batched:   %.3f s' % t_batched)
+    print('Speedup:   %.1fx' % (t_reference / t_batched))
+    print('Max diff:  %.2e' % error)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,25 @@
-from distutils.core import setup
-from distutils.extension import Extension
+try:
+    from setuptools import setup, Extension
+except ImportError:
+    # older python installations without setuptools
+    from distutils.core import setup
+    from distutils.extension import Extension
 from Cython.Build import cythonize
 import numpy as np
 extensions = [
     Extension("_integrateHNoNumpy_ForDriver", ["_integrateHNoNumpy_ForDriver.pyx"],
         include_dirs = [np.get_include()]),]
 setup(
-    ext_modules = cythonize(extensions))
+    ext_modules = cythonize(extensions, language_level=3))
 
 # WIN: use same compiler as for python, Microsoft Build Tools for Visual Studio 2017 or 
 # Microsoft Visual C++ Build Tools 2015.
 # see https://wiki.python.org/moin/WindowsCompilers  
 # run with python .\compileCython.py build_ext --inplace 
 
-# MAC, Py3: run with python compileCython.py build_ext --inplace
-                
+# MAC/LINUX, Py3: run with python compileCython.py build_ext --inplace
 
+# The simulator falls back to the NumPy integrator if the compiled module is
+# missing or built from an older version of the .pyx file, select backend
+# "Cython" in the driver and check "Integrator in use" to verify the build.
+                
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""Backends for integrating the time evolution of the qubit simulator.
+
+All backends integrate a batch of trajectories with the Hamiltonian
+H = -0.5 * (Delta * Sx + Detuning * Sz + Y * Sy), with the state at each time
+step given by the product of the SU(2) time-evolution operators of all
+previous steps.
+
+The NumPy backend is always available. The compiled backend is built from
+_integrateHNoNumpy_ForDriver.pyx by running compileCython.py, and is only
+used if the compiled module matches the current Python version and source.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# add logger, to allow logging to Labber's instrument log
+import logging
+log = logging.getLogger('LabberDriver')
+
+
+def get_operators(dTimeStep, mDelta, mDetuning, mY):
+    """Get time-evolution operators for each time step.
+
+    Each operator is an SU(2) matrix [[U11, U12], [-U12*, U11*]].
+
+    Parameters
+    ----------
+    dTimeStep : float
+        Time step of the simulation.
+    mDelta, mDetuning, mY : numpy array
+        Hamiltonian terms, broadcastable to the same shape.
+
+    Returns
+    -------
+    mU11, mU12 : numpy array
+        Matrix elements of the time-evolution operators.
+
+    """
+    vEnergy = 0.5 * np.sqrt(mDelta**2 + mDetuning**2 + mY**2)
+    vAngle = 2 * np.pi * vEnergy * dTimeStep
+    # take care of sin(x)/x division by zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vSinEn = np.sin(vAngle) / vEnergy
+    vSinEn[vEnergy == 0] = 2 * np.pi * dTimeStep
+    mU11 = np.cos(vAngle) + 0.5j * mDetuning * vSinEn
+    mU12 = (mY + 1j * mDelta) * 0.5 * vSinEn
+    return (mU11, mU12)
+
+
+def multiply(a2, b2, a1, b1):
+    """Multiply SU(2) operators U2 * U1, given by their first rows"""
+    return (a2 * a1 - b2 * np.conj(b1), a2 * b1 + b2 * np.conj(a1))
+
+
+def cumulative_product(mU11, mU12):
+    """Cumulative products of SU(2) operators along the last axis.
+
+    The products are calculated by an associative scan, with log2(n) steps
+    of vectorized multiplications.
+
+    Parameters
+    ----------
+    mU11, mU12 : numpy array
+        Operators, later time steps are multiplied from the left.
+
+    Returns
+    -------
+    mP11, mP12 : numpy array
+        Products of all operators up to and including each element.
+
+    """
+    mP11 = np.array(mU11, dtype='complex128')
+    mP12 = np.array(mU12, dtype='complex128')
+    nShift = 1
+    while nShift < mP11.shape[-1]:
+        (a, b) = multiply(mP11[..., nShift:], mP12[..., nShift:],
+                          mP11[..., :-nShift], mP12[..., :-nShift])
+        mP11[..., nShift:] = a
+        mP12[..., nShift:] = b
+        nShift *= 2
+    return (mP11, mP12)
+
+
+class NumpyBackend:
+    """Vectorized integrator, implemented in NumPy.
+
+    Small batches are integrated by cumulative products of the operators,
+    calculated by associative scans over blocks of time steps. Large batches
+    are integrated step by step, vectorized over the trajectories.
+
+    Parameters
+    ----------
+    nScanMax : int
+        Largest number of trajectories integrated by associative scans.
+    nElements : int
+        Approximate number of operators calculated at once, time steps are
+        processed in blocks to limit memory usage and stay in cache.
+
+    """
+
+    name = 'NumPy'
+    available = True
+    error = ''
+
+    def __init__(self, nScanMax=32, nElements=2**12):
+        self.nScanMax = nScanMax
+        self.nElements = nElements
+
+    def integrate(self, vStart, dTimeStep, mDelta, mDetuning, mY, nReshape):
+        """Integrate batch of trajectories, see integrateHBatch"""
+        if mDelta.shape[0] <= self.nScanMax:
+            return self.integrateScan(vStart, dTimeStep, mDelta, mDetuning,
+                                      mY, nReshape)
+        else:
+            return self.integrateSteps(vStart, dTimeStep, mDelta, mDetuning,
+                                       mY, nReshape)
+
+    def integrateScan(self, vStart, dTimeStep, mDelta, mDetuning, mY,
+                      nReshape):
+        """Integrate by cumulative products of time-evolution operators"""
+        (nRep, nTime) = mDelta.shape
+        vOutIndx = np.arange(0, nTime, nReshape)
+        mState = np.zeros((2, nRep, len(vOutIndx)), dtype='complex128')
+        # product of all operators so far, starting with identity
+        vC11 = np.ones((nRep, 1), dtype='complex128')
+        vC12 = np.zeros((nRep, 1), dtype='complex128')
+        nBlock = max(64, self.nElements // nRep)
+        for n0 in range(0, nTime - 1, nBlock):
+            n1 = min(n0 + nBlock, nTime - 1)
+            (mU11, mU12) = get_operators(
+                dTimeStep, mDelta[:, n0:n1], mDetuning[:, n0:n1], mY[:, n0:n1])
+            (mP11, mP12) = cumulative_product(mU11, mU12)
+            (mP11, mP12) = multiply(mP11, mP12, vC11, vC12)
+            # state at index n is given by product of first n operators
+            vIndx = vOutIndx[(vOutIndx > n0) & (vOutIndx <= n1)]
+            if len(vIndx) > 0:
+                mA = mP11[:, vIndx - n0 - 1]
+                mB = mP12[:, vIndx - n0 - 1]
+                vOut = vIndx // nReshape
+                mState[0, :, vOut] = (mA * vStart[0] + mB * vStart[1]).T
+                mState[1, :, vOut] = (-np.conj(mB) * vStart[0] +
+                                      np.conj(mA) * vStart[1]).T
+            vC11 = mP11[:, -1:]
+            vC12 = mP12[:, -1:]
+        mState[0, :, 0] = vStart[0]
+        mState[1, :, 0] = vStart[1]
+        return mState
+
+    def integrateSteps(self, vStart, dTimeStep, mDelta, mDetuning, mY,
+                       nReshape):
+        """Integrate step by step, vectorized over trajectories"""
+        (nRep, nTime) = mDelta.shape
+        nOut = len(range(0, nTime, nReshape))
+        mState = np.zeros((2, nRep, nOut), dtype='complex128')
+        # state of all trajectories at current time step
+        vPsi0 = np.full(nRep, vStart[0], dtype='complex128')
+        vPsi1 = np.full(nRep, vStart[1], dtype='complex128')
+        mState[0, :, 0] = vPsi0
+        mState[1, :, 0] = vPsi1
+        # calculate operators in blocks of time steps, with time as first
+        # index to make each step contiguous in memory
+        nBlock = max(16, self.nElements * 64 // nRep)
+        for n0 in range(0, nTime - 1, nBlock):
+            n1 = min(n0 + nBlock, nTime - 1)
+            (mU11, mU12) = get_operators(
+                dTimeStep, mDelta[:, n0:n1].T, mDetuning[:, n0:n1].T,
+                mY[:, n0:n1].T)
+            mU11 = np.ascontiguousarray(mU11)
+            mU12 = np.ascontiguousarray(mU12)
+            mU21 = -np.conj(mU12)
+            mU22 = np.conj(mU11)
+            for n2 in range(n1 - n0):
+                vPsi0, vPsi1 = (mU11[n2] * vPsi0 + mU12[n2] * vPsi1,
+                                mU21[n2] * vPsi0 + mU22[n2] * vPsi1)
+                (nOutIndx, nRem) = divmod(n0 + n2 + 1, nReshape)
+                if nRem == 0:
+                    mState[0, :, nOutIndx] = vPsi0
+                    mState[1, :, nOutIndx] = vPsi1
+        return mState
+
+
+class CompiledBackend:
+    """Integrator compiled from _integrateHNoNumpy_ForDriver.pyx"""
+
+    name = 'Cython'
+
+    def __init__(self):
+        try:
+            import _integrateHNoNumpy_ForDriver as module
+            # binaries built from older sources lack the batch integrator
+            if not hasattr(module, 'integrateHBatch'):
+                raise ImportError('Compiled module is outdated, rebuild it '
+                                  'with compileCython.py')
+            self.module = module
+            self.available = True
+            self.error = ''
+        except ImportError as e:
+            self.module = None
+            self.available = False
+            self.error = str(e)
+
+    def integrate(self, vStart, dTimeStep, mDelta, mDetuning, mY, nReshape):
+        """Integrate batch of trajectories, see integrateHBatch"""
+        return self.module.integrateHBatch(
+            np.asarray(vStart, dtype='complex128'), dTimeStep,
+            mDelta, mDetuning, mY, nReshape)
+
+
+BACKENDS = {'NumPy': NumpyBackend, 'Cython': CompiledBackend}
+_backends = dict()
+
+
+def get_backend(name='Auto'):
+    """Get integrator backend, falling back to NumPy if not available.
+
+    Parameters
+    ----------
+    name : str
+        Name of backend, 'Auto' selects the fastest available backend.
+
+    Returns
+    -------
+    backend
+        Backend instance, the name attribute gives the backend in use.
+
+    """
+    if name == 'Auto':
+        name = 'Cython'
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    backend = _backends[name]
+    if not backend.available:
+        log.info('Integrator backend "%s" not available, using NumPy: %s' %
+                 (name, backend.error))
+        return get_backend('NumPy')
+    return backend
+
+
+def integrateHBatch(vStart, dTimeStep, mDelta, mDetuning, mY=None,
+                    nReshape=1, nThread=1, backend=None):
+    """Integrate the time evolution of a batch of noise realizations.
+
+    Parameters
+    ----------
+    vStart : numpy array
+        Start state [Psi0, Psi1], same for all trajectories.
+    dTimeStep : float
+        Time step of the simulation.
+    mDelta, mDetuning, mY : numpy array
+        Delta, detuning and Y-drive, shape (nRep, nTime). Rows of length one
+        or a single row are broadcast. mY is zero if None.
+    nReshape : int
+        Only every nReshape:th state is returned.
+    nThread : int
+        Number of threads, the trajectories are split between threads.
+    backend : backend, optional
+        Integrator backend, by default the fastest available.
+
+    Returns
+    -------
+    numpy array
+        States, with shape (2, nRep, nOut).
+
+    """
+    if backend is None:
+        backend = get_backend()
+    if mY is None:
+        mY = 0.0
+    shape = np.broadcast(np.atleast_2d(mDelta), np.atleast_2d(mDetuning),
+                         np.atleast_2d(mY)).shape
+    (mDelta, mDetuning, mY) = [
+        np.broadcast_to(np.asarray(x, dtype=float), shape)
+        for x in (mDelta, mDetuning, mY)]
+    vStart = np.asarray(vStart, dtype='complex128')
+    nThread = max(1, min(nThread, shape[0]))
+    if nThread == 1:
+        return backend.integrate(vStart, dTimeStep, mDelta, mDetuning, mY,
+                                 nReshape)
+    # split trajectories in chunks
+    lIndx = np.array_split(np.arange(shape[0]), nThread)
+    with ThreadPoolExecutor(nThread) as executor:
+        lState = list(executor.map(
+            lambda vIndx: backend.integrate(
+                vStart, dTimeStep, mDelta[vIndx], mDetuning[vIndx], mY[vIndx],
+                nReshape),
+            lIndx))
+    return np.concatenate(lState, axis=1)
+
+
+if __name__ == '__main__':
+    pass
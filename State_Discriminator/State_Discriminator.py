@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 
+import os
+
 from BaseDriver import LabberDriver
 import numpy as np
 from sklearn.svm import SVC
 from sklearn.metrics import accuracy_score
+from sklearn.model_selection import train_test_split
+
+from discriminators import (PairwiseClassifier, StateAccumulator, classify,
+                            fit_gaussian, reduce_training_data)
 
 
 class Error(Exception):
@@ -70,6 +76,16 @@ class Driver(LabberDriver):
         elif quant.name.startswith('Use median value'):
             self.training_valid = False
 
+        # clear accumulated joint states
+        elif quant.name == 'Reset accumulated states':
+            self.accumulator.reset()
+
+        # if changing discriminator or training reduction, re-train
+        elif quant.name in ('Discriminator', 'Training reduction',
+                            'Max training points per state',
+                            'Estimate fidelity loss from reduction'):
+            self.training_valid = False
+
         # if changing pointer states, flag need for for re-training
         elif (quant.name.startswith('Training source') or
                 (self.getValue('Training source') == 'Pointer states' and
@@ -96,11 +112,22 @@ class Driver(LabberDriver):
             #qubit = int(quant.name[22]) - 1
             qubit = int(quant.name.split('QB')[1].split(' ')[0]) - 1
             value = self.assignment_fidelity[qubit]
+        elif quant.name == 'Fidelity loss from reduction':
+            value = quant.getTraceDict(
+                np.array(self.fidelity_loss[:self.n_qubit]), x0=1, dx=1)
         elif quant.name.startswith('Average state vector'):
             # states are encoded in array of ints
-            m = self.n_state ** self.n_qubit
-            value = (np.bincount(self.state_vector, minlength=m) /
-                     len(self.state_vector))
+            value = self.state_counts / max(len(self.state_vector), 1)
+        elif quant.name == 'Accumulated shots':
+            value = self.accumulator.n_shot
+        elif quant.name == 'Accumulated state counts':
+            value = quant.getTraceDict(self.accumulator.counts, x0=0, dx=1)
+        elif quant.name == 'Accumulated <Z>':
+            value = quant.getTraceDict(
+                self.accumulator.get_expectation_z(), x0=1, dx=1)
+        elif quant.name == 'Accumulated <ZiZj>':
+            value = quant.getTraceDict(
+                self.accumulator.get_correlators(), x0=0, dx=1)
 
         elif quant.name.startswith('System state'):
             value = self.state_vector
@@ -134,6 +161,9 @@ class Driver(LabberDriver):
         self.training_data = [
             [None for n1 in range(n_total)] for n2 in range(d['n_qubit'])]
         self.assignment_fidelity = [0.0] * self.MAX_QUBITS
+        self.fidelity_loss = [0.0] * self.MAX_QUBITS
+        # counts of joint states, accumulated over calls
+        self.accumulator = StateAccumulator(self.n_qubit, self.n_state)
 
     def _prepare_data(self, qubit, data, use_median=False):
         """Prepare data to right format for SVM"""
@@ -166,6 +196,66 @@ class Driver(LabberDriver):
             k += len(x)
         return (X, y)
 
+    def _fit_classifier(self, X, y, kwargs, means=None):
+        """Fit classifier to training data. Returns classifier and, if the
+        training data was reduced, the estimated loss of assignment fidelity
+        caused by the reduction"""
+        if self.getValue('Discriminator') == 'Gaussian':
+            (means, covariances) = fit_gaussian(X, y, self.n_state, means)
+            classifier = PairwiseClassifier.from_gaussian(means, covariances)
+            return (classifier, None)
+        # SVM, reduce training data to make training time independent of the
+        # number of shots. Centroids are weighted by number of shots.
+        method = self.getValue('Training reduction')
+        n_max = int(self.getValue('Max training points per state'))
+        svc = self._fit_svc(X, y, kwargs, method, n_max)
+        # use fast classifier for linear kernels
+        if kwargs['kernel'] == 'linear':
+            classifier = PairwiseClassifier.from_linear_svc(svc)
+        else:
+            classifier = svc
+        if (method == 'None' or np.all(np.bincount(y) <= n_max) or
+                not self.getValue('Estimate fidelity loss from reduction')):
+            return (classifier, None)
+        return (classifier, self._get_fidelity_loss(X, y, kwargs, method,
+                                                    n_max))
+
+    def _fit_svc(self, X, y, kwargs, method, n_max):
+        """Fit SVM to training data, reduced unless method is 'None'"""
+        weight = None
+        if method != 'None':
+            (X, y, weight) = reduce_training_data(X, y, n_max, method)
+        svc = SVC(**kwargs)
+        svc.fit(X, y, sample_weight=weight)
+        return svc
+
+    def _get_fidelity_loss(self, X, y, kwargs, method, n_max):
+        """Estimate loss of assignment fidelity from training reduction, as
+        accuracy of a SVM trained on full data minus accuracy of a SVM trained
+        on reduced data, both tested on the same held-out data"""
+        (X_train, X_test, y_train, y_test) = train_test_split(
+            X, y, test_size=0.25, random_state=0, stratify=y)
+        full = self._fit_svc(X_train, y_train, kwargs, 'None', n_max)
+        reduced = self._fit_svc(X_train, y_train, kwargs, method, n_max)
+        return (accuracy_score(y_test, full.predict(X_test)) -
+                accuracy_score(y_test, reduced.predict(X_test)))
+
+    def _get_svm_config(self):
+        """Get SVM configuration"""
+        return dict(
+            kernel=self.getValue('Kernel'),
+            degree=int(self.getValue('Degree')),
+            gamma=self.getValue('Gamma'),
+            coef0=self.getValue('Coef0'),
+            C=self.getValue('C-parameter'),
+            shrinking=self.getValue('Shrinking')
+        )
+
+    def _get_n_thread(self):
+        """Get number of threads, all cores if zero"""
+        n_thread = int(self.getValue('Number of threads'))
+        return n_thread if n_thread > 0 else (os.cpu_count() or 1)
+
     def train_discriminator(self):
         """Train discriminator based on training data"""
         # don't do anything is training data is unchanged
@@ -173,14 +263,7 @@ class Driver(LabberDriver):
             return
 
         # get SVM configuration
-        kwargs = dict(
-            kernel=self.getValue('Kernel'),
-            degree=self.getValue('Degree'),
-            gamma=self.getValue('Gamma'),
-            coef0=self.getValue('Coef0'),
-            C=self.getValue('C-parameter'),
-            shrinking=self.getValue('Shrinking')
-        )
+        kwargs = self._get_svm_config()
         use_median = self.getValue('Use median value')
 
         # special case if training from pointer states
@@ -190,7 +273,8 @@ class Driver(LabberDriver):
 
         # train for all active qubits
         self.svm = [None] * self.n_qubit
-        self.assignment_fidelity = [0.0] * self.n_qubit
+        self.assignment_fidelity = [0.0] * self.MAX_QUBITS
+        self.fidelity_loss = [0.0] * self.MAX_QUBITS
         for qubit, data in enumerate(self.training_data):
             # prepare data both for full set and just median
             if np.any([x is None for x in data]):
@@ -198,16 +282,26 @@ class Driver(LabberDriver):
             (X, y) = self._prepare_data(qubit, data, use_median=False)
             (Xm, ym) = self._prepare_data(qubit, data, use_median=True)
 
-            # create SVM and fit data
-            svc = SVC(**kwargs)
-            if use_median:
-                svc.fit(Xm, ym)
+            # create classifier and fit data
+            if use_median and self.getValue('Discriminator') == 'Gaussian':
+                # median gives state positions, spread is from full data set
+                means = np.array([
+                    np.median(X[y == m, 0]) + 1j * np.median(X[y == m, 1])
+                    for m in range(self.n_state)])
+                (classifier, loss) = self._fit_classifier(X, y, kwargs, means)
+            elif use_median:
+                (classifier, loss) = self._fit_classifier(Xm, ym, kwargs)
             else:
-                svc.fit(X, y)
-            # store in list of SVMs
-            self.svm[qubit] = svc
+                (classifier, loss) = self._fit_classifier(X, y, kwargs)
+            # store in list of classifiers
+            self.svm[qubit] = classifier
             # calculate assignment fidelity using full data set
-            self.assignment_fidelity[qubit] = accuracy_score(y, svc.predict(X))
+            states = classify([classifier], [X[:, 0] + 1j * X[:, 1]],
+                              self._get_n_thread())[0]
+            self.assignment_fidelity[qubit] = accuracy_score(y, states)
+            # fidelity lost by training on reduced data set
+            if loss is not None:
+                self.fidelity_loss[qubit] = loss
 
         # mark training as valid
         self.training_valid = True
@@ -228,11 +322,20 @@ class Driver(LabberDriver):
                 X[m, 1] = x.imag
                 y[m] = m
 
-            # create SVM and fit data
-            svc = SVC(**kwargs)
-            svc.fit(X, y)
-            # store in list of SVMs
-            self.svm.append(svc)
+            # create classifier and fit data
+            if self.getValue('Discriminator') == 'Gaussian':
+                # equal spread for all states gives closest pointer state
+                classifier = PairwiseClassifier.from_gaussian(
+                    X[:, 0] + 1j * X[:, 1], [np.eye(2)] * self.n_state)
+            else:
+                svc = SVC(**kwargs)
+                svc.fit(X, y)
+                if kwargs['kernel'] == 'linear':
+                    classifier = PairwiseClassifier.from_linear_svc(svc)
+                else:
+                    classifier = svc
+            # store in list of classifiers
+            self.svm.append(classifier)
 
         # mark training as valid
         self.training_valid = True
@@ -245,18 +348,10 @@ class Driver(LabberDriver):
         self.state_vector = np.array([], dtype=int)
         # calculate states for all active qubits
         self.qubit_states = [[]] * self.MAX_QUBITS
-        for n, svm in enumerate(self.svm):
-            x = self.getValueArray('Input data, QB%d' % (n + 1))
-            if len(x) > 0:
-                if svm is None:
-                    output = np.zeros(len(x), dtype=int)
-                else:
-                    input_data = np.zeros((len(x), 2))
-                    input_data[:, 0] = x.real
-                    input_data[:, 1] = x.imag
-                    output = svm.predict(input_data)
-            else:
-                output = np.array([], dtype=int)
+        data = [self.getValueArray('Input data, QB%d' % (n + 1))
+                for n in range(len(self.svm))]
+        states = classify(self.svm, data, self._get_n_thread())
+        for n, output in enumerate(states):
             self.qubit_states[n] = output
 
             # update mean value controls
@@ -267,6 +362,11 @@ class Driver(LabberDriver):
                 self.state_vector = np.zeros(len(output), dtype=int)
             self.state_vector += (output * (self.n_state ** n))
 
+        # update joint state counts, optionally accumulating over calls
+        if not self.getValue('Accumulate states'):
+            self.accumulator.reset()
+        self.state_counts = self.accumulator.add(self.state_vector)
+
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+"""Fast state classification for the state discriminator.
+
+Linear SVMs and Gaussian models are converted to pairwise decision functions
+that are quadratic in the I/Q values, so that shots can be classified with a
+few vectorized operations instead of calling the SVM. Other SVM kernels are
+evaluated with sklearn. Chunks of shots from all qubits are classified in
+parallel threads.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+
+class PairwiseClassifier:
+    """Classifier defined by pairwise decision functions.
+
+    For each pair of states (i, j), i < j, the decision function is
+    d = w0 x**2 + w1 x y + w2 y**2 + w3 x + w4 y + w5, with x and y the real
+    and imaginary part of the data. If d > 0, the pair votes for state i,
+    otherwise for state j. The state with the most votes is assigned, ties go
+    to the lowest state, as for one-vs-one SVMs.
+
+    Parameters
+    ----------
+    weights : numpy array
+        Weights of the decision functions, shape (n_pair, 6).
+    classes : numpy array
+        Labels of the states.
+
+    """
+
+    def __init__(self, weights, classes):
+        self.weights = np.asarray(weights, dtype=float)
+        self.classes = np.asarray(classes, dtype=int)
+
+    @classmethod
+    def from_linear_svc(cls, svc):
+        """Create classifier from SVM trained with a linear kernel"""
+        weights = np.zeros((len(svc.intercept_), 6))
+        weights[:, 3:5] = svc.coef_
+        weights[:, 5] = svc.intercept_
+        # sklearn reverses the sign of the binary decision function
+        if len(svc.classes_) == 2:
+            weights = -weights
+        return cls(weights, svc.classes_)
+
+    @classmethod
+    def from_gaussian(cls, means, covariances, classes=None):
+        """Create classifier assigning the state with highest likelihood.
+
+        Parameters
+        ----------
+        means : numpy array
+            Mean value of each state, as complex numbers.
+        covariances : numpy array
+            Covariance matrices of (real, imag) for each state, shape
+            (n_state, 2, 2).
+        classes : numpy array, optional
+            Labels of the states, default is 0, 1, 2, ...
+
+        """
+        # log likelihood of each state, as quadratic form in (x, y)
+        scores = []
+        for mean, cov in zip(means, covariances):
+            inv = np.linalg.inv(cov)
+            mu = np.array([mean.real, mean.imag])
+            b = inv @ mu
+            scores.append([
+                -0.5 * inv[0, 0], -inv[0, 1], -0.5 * inv[1, 1], b[0], b[1],
+                -0.5 * mu @ b - 0.5 * np.log(np.linalg.det(cov))])
+        scores = np.array(scores)
+        weights = [scores[i] - scores[j]
+                   for (i, j) in combinations(range(len(scores)), 2)]
+        if classes is None:
+            classes = np.arange(len(scores))
+        return cls(weights, classes)
+
+    def decision_function(self, data):
+        """Pairwise decision functions for complex data, shape (n_pair, n)"""
+        data = np.ascontiguousarray(data, dtype=complex)
+        # view as (n, 2) array of (real, imag), for a single matrix product
+        v = data.view(float).reshape(-1, 2)
+        d = self.weights[:, 3:5] @ v.T
+        d += self.weights[:, 5:6]
+        if np.any(self.weights[:, :3]):
+            (x, y) = (v[:, 0], v[:, 1])
+            (xx, xy, yy) = (x * x, x * y, y * y)
+            for p, w in enumerate(self.weights):
+                d[p] += w[0] * xx + w[1] * xy + w[2] * yy
+        return d
+
+    def predict(self, data):
+        """Classify complex single-shot data"""
+        d = self.decision_function(data)
+        if len(self.classes) == 2:
+            return np.where(d[0] > 0, self.classes[0], self.classes[1])
+        votes = np.zeros((len(self.classes), d.shape[1]), dtype=np.int8)
+        for p, (i, j) in enumerate(combinations(range(len(self.classes)), 2)):
+            positive = d[p] > 0
+            votes[i] += positive
+            votes[j] += ~positive
+        # state with most votes, ties go to lowest state
+        return self.classes[np.argmax(votes, axis=0)]
+
+
+def fit_gaussian(X, y, n_state, means=None):
+    """Fit a Gaussian distribution for each state.
+
+    Parameters
+    ----------
+    X : numpy array
+        Training data, shape (n, 2).
+    y : numpy array
+        State of each training point.
+    n_state : int
+        Number of states.
+    means : numpy array, optional
+        Mean values to use instead of the mean of the training data.
+
+    Returns
+    -------
+    means : numpy array
+        Complex mean value of each state.
+    covariances : numpy array
+        Covariance matrix of each state, shape (n_state, 2, 2).
+
+    """
+    if means is None:
+        means = np.array([X[y == m, 0].mean() + 1j * X[y == m, 1].mean()
+                          for m in range(n_state)])
+    covariances = np.array([np.cov(X[y == m].T) for m in range(n_state)])
+    # avoid singular matrices for degenerate training data
+    scale = max(np.max(np.trace(covariances, axis1=1, axis2=2)), 1E-30)
+    covariances += 1E-9 * scale * np.eye(2)
+    return (means, covariances)
+
+
+def reduce_training_data(X, y, n_max, method='Subsample', seed=0):
+    """Reduce training data to at most n_max points per state.
+
+    Parameters
+    ----------
+    X : numpy array
+        Training data, shape (n, 2).
+    y : numpy array
+        State of each training point.
+    n_max : int
+        Max number of points per state.
+    method : str
+        'Subsample' picks random points, 'Cluster centroids' replaces the
+        data with k-means cluster centroids.
+    seed : int
+        Seed for random number generation.
+
+    Returns
+    -------
+    X, y : numpy array
+        Reduced training data and states.
+    weight : numpy array
+        Number of original points represented by each point.
+
+    """
+    rng = np.random.RandomState(seed)
+    (lX, ly, lw) = ([], [], [])
+    for state in np.unique(y):
+        x = X[y == state]
+        if len(x) <= n_max:
+            (x, w) = (x, np.ones(len(x)))
+        elif method == 'Cluster centroids':
+            kmeans = MiniBatchKMeans(n_clusters=n_max, n_init=1,
+                                     random_state=seed)
+            labels = kmeans.fit_predict(x)
+            (x, w) = (kmeans.cluster_centers_,
+                      np.bincount(labels, minlength=n_max).astype(float))
+        else:
+            indx = rng.choice(len(x), n_max, replace=False)
+            (x, w) = (x[indx], np.ones(n_max))
+        lX.append(x)
+        ly.append(np.full(len(x), state, dtype=int))
+        lw.append(w)
+    return (np.concatenate(lX), np.concatenate(ly), np.concatenate(lw))
+
+
+def classify(classifiers, data, n_thread=1, chunk_size=2**18):
+    """Classify single-shot data for all qubits.
+
+    Parameters
+    ----------
+    classifiers : list
+        PairwiseClassifier, sklearn classifier or None for each qubit.
+    data : list of numpy array
+        Complex single-shot data for each qubit.
+    n_thread : int
+        Number of threads, chunks of data are classified in parallel.
+    chunk_size : int
+        Number of shots classified at once.
+
+    Returns
+    -------
+    list of numpy array
+        States of each qubit, as integers. Qubits without classifier are
+        assigned to state zero.
+
+    """
+    output = [np.zeros(len(x), dtype=int) for x in data]
+    jobs = []
+    for n, (classifier, x) in enumerate(zip(classifiers, data)):
+        if classifier is None:
+            continue
+        jobs += [(n, n0, min(n0 + chunk_size, len(x)))
+                 for n0 in range(0, len(x), chunk_size)]
+
+    def classify_chunk(job):
+        (n, n0, n1) = job
+        x = data[n][n0:n1]
+        if isinstance(classifiers[n], PairwiseClassifier):
+            output[n][n0:n1] = classifiers[n].predict(x)
+        else:
+            output[n][n0:n1] = classifiers[n].predict(
+                np.column_stack((x.real, x.imag)))
+
+    if n_thread > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(n_thread) as executor:
+            list(executor.map(classify_chunk, jobs))
+    else:
+        for job in jobs:
+            classify_chunk(job)
+    return output
+
+
+class StateAccumulator:
+    """Streaming histogram of joint qubit states.
+
+    Chunks of single-shot states are added as they arrive, only the counts of
+    each joint state are kept. Single-qubit and pairwise Z expectation values
+    are calculated from the counts, with state 0 counted as +1 and all other
+    states as -1.
+
+    Parameters
+    ----------
+    n_qubit : int
+        Number of qubits.
+    n_state : int
+        Number of states per qubit.
+
+    """
+
+    def __init__(self, n_qubit, n_state):
+        self.n_qubit = n_qubit
+        self.n_state = n_state
+        self.n_bin = n_state ** n_qubit
+        # Z eigenvalue of each qubit for all joint states, shape
+        # (n_qubit, n_bin), joint state index is sum of state * n_state**qubit
+        index = np.arange(self.n_bin)
+        digits = np.array([(index // n_state ** n) % n_state
+                           for n in range(n_qubit)])
+        self.z = np.where(digits == 0, 1.0, -1.0)
+        self.pairs = list(combinations(range(n_qubit), 2))
+        self.reset()
+
+    def reset(self):
+        """Clear accumulated counts"""
+        self.counts = np.zeros(self.n_bin, dtype=np.int64)
+
+    @property
+    def n_shot(self):
+        """Number of accumulated shots"""
+        return int(self.counts.sum())
+
+    def add(self, state_vector):
+        """Add chunk of joint states, given as integers.
+
+        Parameters
+        ----------
+        state_vector : numpy array
+            Joint state of each shot, as sum of state * n_state**qubit.
+
+        Returns
+        -------
+        numpy array
+            Counts of each joint state in the chunk.
+
+        """
+        counts = np.bincount(state_vector, minlength=self.n_bin)
+        self.counts += counts
+        return counts
+
+    def get_populations(self):
+        """Population of each joint state"""
+        return self.counts / max(self.n_shot, 1)
+
+    def get_expectation_z(self):
+        """Expectation value <Zi> of each qubit"""
+        return self.z @ self.get_populations()
+
+    def get_correlators(self):
+        """Correlators <ZiZj> for all pairs of qubits, ordered as self.pairs"""
+        populations = self.get_populations()
+        return np.array([(self.z[i] * self.z[j]) @ populations
+                         for (i, j) in self.pairs])
+
+
+if __name__ == '__main__':
+    pass
@@ -6,7 +6,7 @@ from pyvisa.constants import (
     VI_READ_BUF, VI_WRITE_BUF)
 import numpy as np
 
-from pyte16 import download_binary_data
+from pyte16 import download_binary_blocks
 
 class Driver(VISA_Driver):
     """Tabor Labber driver"""
@@ -129,6 +129,8 @@ class Driver(VISA_Driver):
 
     def sendWaveformAndStart(self):
         """Rescale and send waveform data to the Tek"""
+        # binary blocks with segment definition and data of all channels
+        lBlock = []
         # go through all channels
         for n in range(self.nCh):
             # channels are numbered 1-4
@@ -136,7 +138,10 @@ class Driver(VISA_Driver):
             vData = self.getValueArray('Ch %d' % channel)
             vMark1 = self.getValueArray('Ch %d - Marker 1' % channel)
             vMark2 = self.getValueArray('Ch %d - Marker 2' % channel)
-            self.sendWaveformToAWG(channel, vData, vMark1, vMark2)
+            self.sendWaveformToAWG(channel, vData, vMark1, vMark2, lBlock)
+        # send data of all channels in one transaction
+        if len(lBlock) > 0:
+            download_binary_blocks(self.com, lBlock, paranoia_level=0)
 
         # turn on channels in use
         sOutput = ''
@@ -162,8 +167,9 @@ class Driver(VISA_Driver):
         return vU16
 
 
-    def sendWaveformToAWG(self, channel, vData, vMark1, vMark2):
-        """Send waveform to Tek"""
+    def sendWaveformToAWG(self, channel, vData, vMark1, vMark2, lBlock):
+        """Send waveform to Tek. The segment data is added to the list of
+        binary blocks, which is sent by the caller"""
         # turn off output and clear old traces
         self.writeAndLog(':INST %d;:OUTP 0' % channel)
         self.writeAndLog(':TRAC:DEL:ALL')
@@ -204,10 +210,9 @@ class Driver(VISA_Driver):
             vU16 = np.pad(vU16, (0, 32 - (len(vU16) % 32)), 'constant',
                           constant_values=2047)
 
-        self.writeAndLog(':TRAC:DEF 1, %d' % len(vU16))
-        self.writeAndLog(':TRAC:SEL 1')
-        download_binary_data(self.com, 'TRAC:DATA', vU16, len(vU16) * 2,
-                             paranoia_level=0)
+        # define and select segment, then add data to transfer
+        lBlock.append((':INST %d;:TRAC:DEF 1, %d;:TRAC:SEL 1;:TRAC:DATA' %
+                       (channel, len(vU16)), vU16))
         return True
 
 
@@ -33,6 +33,7 @@ import socket
 import ctypes
 import struct
 import math
+import time
 import warnings
 import numpy as np
 import visa
@@ -47,10 +48,12 @@ __all__ = [
     'open_session',
     'send_cmd',
     'download_binary_data',
+    'download_binary_blocks',
     'download_binary_file',
     'download_binary_file',
     'download_arbcon_wav_file',
     'download_segment_lengths',
+    'download_segments',
     'download_sequencer_table',
     'download_adv_seq_table',
     'download_fast_pattern_table',
@@ -495,7 +498,8 @@ def write_raw_bin_dat(vi, bin_dat, dat_size, max_chunk_size = 1024):
 
         if count < 0 or err_code < 0:
             err_desc = get_visa_err_desc(err_code)
-            wrn_msg = 'write_raw_bin_dat(dat_size={0})={1}, wr_offs={2}, err_code={3} ({4})'.format(dat_size, count, err_code, err_desc)
+            wrn_msg = 'write_raw_bin_dat(dat_size={0})={1}, wr_offs={2}, err_code={3} ({4})'.format(dat_size, count, wr_offs, err_code, err_desc)
+            warnings.warn(wrn_msg)
     except:
         ret_count = min(ret_count, -1)
         wrn_msg = 'write_raw_bin_dat(dat_size={0}) failed\n{1}'.format(dat_size, sys.exc_info())
@@ -504,6 +508,59 @@ def write_raw_bin_dat(vi, bin_dat, dat_size, max_chunk_size = 1024):
     vi.write_termination = write_termination
     return ret_count
 
+def write_raw_bin_dat_fast(vi, bin_dat, min_chunk_size=4096, max_chunk_size=2**24, chunk_time=0.05):
+    """Write raw binary data to device, in large chunks of adaptive size.
+
+    The data is written directly from the memory of the given buffer (a
+    contiguous `numpy` array or a bytes-like object), without copies.
+    The chunk-size is adapted to the interface throughput measured by the
+    previous writes, such that each write takes about `chunk_time` seconds.
+    The measured throughput is stored in the `vi` instance for later calls.
+
+    Unlike `write_raw_bin_dat`, errors are not caught: VISA errors raise
+    `pyvisa.errors.VisaIOError`, and incomplete writes raise `IOError`.
+
+    :param vi: `pyvisa` instrument.
+    :param bin_dat: the binary data buffer.
+    :param min_chunk_size: minimal chunk-size (in bytes).
+    :param max_chunk_size: maximal chunk-size (in bytes).
+    :param chunk_time: desired duration of each write (in seconds).
+    :returns: written-bytes count.
+    """
+    if isinstance(bin_dat, np.ndarray):
+        # a copy is only made if the array is not contiguous
+        dat = np.ascontiguousarray(bin_dat).reshape(-1).view(np.uint8)
+    else:
+        dat = np.frombuffer(bin_dat, dtype=np.uint8)
+    dat_size = dat.nbytes
+    dat_addr = dat.ctypes.data
+
+    throughput = vi.__dict__.get('write_throughput', None)
+    if throughput is None:
+        chunk_size = 16 * min_chunk_size
+    else:
+        chunk_size = throughput * chunk_time
+    ret_cnt = ctypes.c_ulong(0)
+    wr_offs = 0
+    while wr_offs < dat_size:
+        chunk_size = int(min(max(chunk_size, min_chunk_size), max_chunk_size))
+        chunk_size = chunk_size - chunk_size % min_chunk_size
+        chunk_sz = min(chunk_size, dat_size - wr_offs)
+        ptr = ctypes.cast(dat_addr + wr_offs, ctypes.POINTER(ctypes.c_byte))
+        t0 = time.perf_counter()
+        vi.visalib.viWrite(vi.session, ptr, ctypes.c_ulong(chunk_sz), ctypes.byref(ret_cnt))
+        dt = time.perf_counter() - t0
+        if ret_cnt.value != chunk_sz:
+            raise IOError('write_raw_bin_dat_fast(dat_size={0}): wrote {1} of {2} bytes at wr_offs={3}'.format(dat_size, ret_cnt.value, chunk_sz, wr_offs))
+        wr_offs = wr_offs + chunk_sz
+        # only full chunks give a reliable throughput
+        if dt > 0 and chunk_sz == chunk_size:
+            throughput = chunk_sz / dt
+            vi.__dict__['write_throughput'] = throughput
+            chunk_size = throughput * chunk_time
+
+    return wr_offs
+
 def send_cmd(vi, cmd_str, paranoia_level=1):
     '''Send (SCPI) Command to Instrument
 
@@ -548,7 +605,7 @@ def _pre_download_binary_data(vi, bin_dat_size=None):
     max_chunk_size = 4096
 
     try:
-        max_chunk_size = vi.__dict__.get('write_buff_size', default=max_chunk_size)
+        max_chunk_size = vi.__dict__.get('write_buff_size', max_chunk_size)
         intf_type = vi.get_visa_attribute(vc.VI_ATTR_INTF_TYPE)
         if intf_type == vc.VI_INTF_GPIB:
             _ = vi.write("*OPC?")
@@ -577,18 +634,21 @@ def _post_download_binary_data(vi, orig_timeout):
     if orig_timeout is not None and vi.timeout != orig_timeout:
         vi.timeout = orig_timeout
 
-def download_binary_data(vi, pref, bin_dat, dat_size, paranoia_level=1):
+def download_binary_data(vi, pref, bin_dat, dat_size, paranoia_level=1, high_speed=False):
     """Download binary data to instrument.
 
     Notes:
       1. The caller needs not add the binary-data header (#<data-length>)
       2. The header-prefix, `pref`, can be empty string or `None`
+      3. In high-speed mode the data is written with `download_binary_blocks`,
+         and errors are raised instead of returning a negative count.
 
     :param vi: `pyvisa` instrument.
     :param pref: the header prefix (e.g. ':TRACe:DATA').
     :param bin_dat: the binary data buffer.
     :param dat_size: the data-size in bytes.
     :param paranoia_level: paranoia-level (0:low, 1:normal, 2:high)
+    :param high_speed: write in large chunks, directly from the buffer.
     :returns: written-bytes count.
 
     Example:
@@ -609,6 +669,13 @@ def download_binary_data(vi, pref, bin_dat, dat_size, paranoia_level=1):
         >>> print vi.ask(':SYST:ERR?')
         >>> vi.close()
     """
+    if high_speed:
+        if isinstance(bin_dat, np.ndarray):
+            bin_dat = bin_dat.reshape(-1).view(np.uint8)[:dat_size]
+        else:
+            bin_dat = memoryview(bin_dat)[:dat_size]
+        return download_binary_blocks(vi, [(pref, bin_dat)], paranoia_level=paranoia_level)
+
     ret_count = 0
 
     try:
@@ -662,6 +729,70 @@ def download_binary_data(vi, pref, bin_dat, dat_size, paranoia_level=1):
 
     return ret_count
 
+def download_binary_blocks(vi, blocks, paranoia_level=1):
+    """Download several binary-data blocks to instrument in one transaction.
+
+    The blocks are sent as a single message of commands separated by
+    semicolons, each with its own binary-data header. Each block may
+    consist of several buffers, which are written one after the other,
+    so that segments can be combined without copying them.
+
+    Unlike `download_binary_data`, errors are raised: VISA errors raise
+    `pyvisa.errors.VisaIOError`, incomplete writes raise `IOError`, and
+    instrument errors (paranoia-level 2 or higher) raise `NameError`.
+
+    :param vi: `pyvisa` instrument.
+    :param blocks: list of (pref, bin_dat), where `pref` is the header prefix
+                   (which may start with other commands, e.g.
+                   ':TRAC:SEL 1;:TRAC:DATA') and `bin_dat` is a buffer or a
+                   list of buffers.
+    :param paranoia_level: paranoia-level (0:low, 1:normal, 2:high)
+    :returns: written-bytes count.
+
+    Example:
+        >>> # download waveforms of both channels
+        >>> pyte.download_binary_blocks(vi, [
+        >>>     (':INST 1;:TRAC:DEF 1,1024;:TRAC:SEL 1;:TRAC:DATA', wav1),
+        >>>     (':INST 2;:TRAC:DEF 1,1024;:TRAC:SEL 1;:TRAC:DATA', wav2)])
+    """
+    block_list = []
+    for pref, bin_dat in blocks:
+        if not isinstance(bin_dat, (list, tuple)):
+            bin_dat = [bin_dat]
+        block_list.append((pref, bin_dat, sum(memoryview(dat).nbytes for dat in bin_dat)))
+    total_size = sum(dat_size for _, _, dat_size in block_list)
+
+    ret_count = 0
+    orig_timeout, _ = _pre_download_binary_data(vi, total_size)
+    try:
+        for n, (pref, bin_dat, dat_size) in enumerate(block_list):
+            dat_header = make_bin_dat_header(dat_size, pref)
+            if n > 0:
+                dat_header = ';' + dat_header
+            elif paranoia_level >= 1:
+                # Add *OPC? to the beginning of the binary-data header:
+                dat_header = '*OPC? ;' + dat_header
+            ret_count += write_raw_bin_dat_fast(vi, dat_header.encode())
+            for dat in bin_dat:
+                ret_count += write_raw_bin_dat_fast(vi, dat)
+        # terminate the message
+        ret_count += write_raw_bin_dat_fast(vi, vi.write_termination.encode())
+
+        if paranoia_level >= 1:
+            # Read the response to the *OPC? query that was sent with the binary-data header
+            _ = vi.read()
+    finally:
+        _post_download_binary_data(vi, orig_timeout)
+
+    if paranoia_level >= 2:
+        syst_err = vi.ask(':SYST:ERR?')
+        if not syst_err.startswith('0'):
+            syst_err = syst_err.rstrip()
+            _ = vi.ask('*CLS; *OPC?') # clear the error-list
+            raise NameError('ERR: "{0}" after sending binary data (blocks={1}, total_size={2})'.format(syst_err, len(block_list), total_size))
+
+    return ret_count
+
 def download_binary_file(vi, pref, file_path, offset=0, data_size=None, paranoia_level=1):
     """Download binary data from file to instrument.
 
@@ -880,6 +1011,31 @@ def download_segment_lengths(vi, seg_len_list, pref=':SEGM:DATA', paranoia_level
 
     return download_binary_data(vi, pref, seg_len_list, seg_len_list.nbytes, paranoia_level=paranoia_level)
 
+def download_segments(vi, seg_list, pref=':TRAC:DATA', seg_pref=':SEGM:DATA', paranoia_level=1):
+    '''Download Multiple Segments and their Lengths in one Transaction
+
+    The wave-data of all segments is downloaded into the selected (pseudo)
+    segment, directly from the given buffers, followed by the table of the
+    segment-lengths (see `download_segment_lengths`). The caller must
+    include the segment-prefixes (idle-points) in the wave-data of all
+    segments except the 1st. Errors are raised (see `download_binary_blocks`).
+
+    :param vi: `pyvisa` instrument.
+    :param seg_list: the list of segments wave-data (uint16 arrays).
+    :param pref: the binary-data-header prefix of the wave-data.
+    :param seg_pref: the binary-data-header prefix of the segment-lengths.
+    :param paranoia_level: paranoia-level (0:low, 1:normal, 2:high)
+    :returns: written-bytes count.
+
+    Example:
+        >>> _ = vi.ask(':TRACe:SELect 1; *OPC?')
+        >>> pyte.download_segments(vi, [wav1, wav2, wav3])
+    '''
+    seg_list = [np.asarray(seg, dtype=np.uint16) for seg in seg_list]
+    seg_len_list = np.array([seg.size for seg in seg_list], dtype=np.uint32)
+
+    return download_binary_blocks(vi, [(pref, seg_list), (seg_pref, seg_len_list)], paranoia_level=paranoia_level)
+
 def download_sequencer_table(vi, seq_table, pref=':SEQ:DATA', paranoia_level=1):
     '''Download Sequencer-Table to Instrument
 
@@ -2,14 +2,68 @@
 
 import InstrumentDriver
 from VISA_Driver import VISA_Driver
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import re
+import time
 
-__version__ = '1.3.0'
+__version__ = '1.4.0'
 
 MIN_WAVE_LENGTH = 2400
+# pending waveform data is sent once it exceeds this size
+MAX_TRANSFER_BYTES = 2**24
 channel_re = re.compile(r'Ch (\d)$')
 marker_re = re.compile(r'Ch (\d) - Marker (\d)$')
+
+
+class TransferScheduler():
+    """Coalesce binary block writes into few large messages.
+
+    Blocks are kept until flushed, then sent as a single message of commands
+    separated by semicolons. The data is only copied once, when the message
+    is created. Blocks are flushed automatically once the pending data
+    exceeds nMaxBytes.
+    """
+
+    def __init__(self, write_raw, log, nMaxBytes=MAX_TRANSFER_BYTES):
+        self.write_raw = write_raw
+        self.log = log
+        self.nMaxBytes = nMaxBytes
+        self.lBlock = []
+        self.nBytes = 0
+
+    def clear(self):
+        """Remove pending blocks without sending, returns their keys"""
+        lKey = [key for (key, sHead, data) in self.lBlock]
+        self.lBlock = []
+        self.nBytes = 0
+        return lKey
+
+    def add(self, sCmd, data, key=None):
+        """Add binary block with data for command, key identifies the block"""
+        data = np.ascontiguousarray(data)
+        sLen = b'%d' % data.nbytes
+        sHead = b'%s#%d%s' % (sCmd, len(sLen), sLen)
+        self.lBlock.append((key, sHead, memoryview(data).cast('B')))
+        self.nBytes += data.nbytes
+        if self.nBytes >= self.nMaxBytes:
+            self.flush()
+
+    def flush(self):
+        """Send all pending blocks in one message"""
+        if len(self.lBlock) == 0:
+            return
+        t0 = time.perf_counter()
+        lPart = []
+        for (key, sHead, data) in self.lBlock:
+            lPart += [b';', sHead, data]
+        self.write_raw(b''.join(lPart[1:]))
+        dt = time.perf_counter() - t0
+        self.log(f'Sent {len(self.lBlock)} blocks, {self.nBytes} bytes of '
+                 f'waveform data in {dt:.3f} s')
+        self.clear()
+
+
 class Driver(VISA_Driver):
     """ This class implements the Tektronix AWG5200 series driver"""
 
@@ -26,6 +80,7 @@ class Driver(VISA_Driver):
         elif sModel == '5202':
             self.nCh = 2
         self.nMarker = 4
+        self.transfer = TransferScheduler(self.write_raw, self.log)
         self.initSetConfig()
 
     def performClose(self, bError=False, options={}):
@@ -39,6 +94,8 @@ class Driver(VISA_Driver):
         # turn off run mode
         self.bIsStopped = False
         self.awg_stop()
+        # drop data not sent, waveforms are created again below
+        self.transfer.clear()
         # init vectors with old values
         self.bWaveUpdated = False
         self.nOldSeq = -1
@@ -74,15 +131,18 @@ class Driver(VISA_Driver):
                     # variable for keepin track of sequence updating
                     self.awg_stop()
                     self.bSeqUpdate = False
+                    self.clearTransfers()
                 # if different sequence length, re-create buffer
                 if seq_no==0 and n_seq != len(self.lOldReal):
                     self.lOldReal = [[np.array([], dtype='f4') \
                         for n1 in range(self.nCh)] for n2 in range(n_seq)]
                     self.lOldMark = [[np.array([], dtype='u1') \
                         for n1 in range(self.nCh)] for n2 in range(n_seq)]
-            elif self.isHardwareTrig(options):
-                # if hardware triggered, always stop outputting before setting
-                self.awg_stop()
+            else:
+                self.clearTransfers()
+                if self.isHardwareTrig(options):
+                    # if hardware triggered, always stop outputting first
+                    self.awg_stop()
         if channel_re.match(quant.name) or marker_re.match(quant.name):
             # set value, then mark that waveform needs an update
             quant.setValue(value)
@@ -147,21 +207,34 @@ class Driver(VISA_Driver):
         """Rescale and send waveform data to the Tek"""
         self.nPrevData = 0
         self.bIsStopped = False
-        # go through all channels
-        for n in range(self.nCh):
-            # channels are numbered 1-8
-            channel = n+1
-            vData = self.getValueArray(f'Ch {channel}')
-            vMark = []
-            for m in range(self.nMarker):
-                vMark.append(self.getValueArray(f'Ch {channel} - Marker {m+1}'))
-            bWaveUpdate = self.sendWaveformToTek(channel, vData, vMark, seq)
+        # scale waveforms in a background thread, so that the next channel is
+        # scaled while the current one is compared and queued. Data is sent
+        # when the transfer queue is flushed
+        with ThreadPoolExecutor(1) as executor:
+            lScaled = []
+            for n in range(self.nCh):
+                # channels are numbered 1-8
+                channel = n+1
+                vData = self.getValueArray(f'Ch {channel}')
+                vMark = []
+                for m in range(self.nMarker):
+                    vMark.append(
+                        self.getValueArray(f'Ch {channel} - Marker {m+1}'))
+                dVpp = self.getValue('Ch%d - Range' % channel)
+                lScaled.append(executor.submit(
+                    self.scaleWaveform, channel, vData, vMark, dVpp))
+            bWaveUpdate = False
+            for n, scaled in enumerate(lScaled):
+                bWaveUpdate = (self.sendWaveformToTek(
+                    n+1, scaled.result(), seq) or bWaveUpdate)
         # check if sequence mode
         if seq is not None:
-            # if not final seq call, just return here
+            # if not final seq call, just return here, data is sent later
             self.bSeqUpdate = self.bSeqUpdate or bWaveUpdate
             if (seq+1) < n_seq:
                 return
+            # send data of all sequence elements
+            self.transfer.flush()
             filename = 'Labber_SEQ'
             # final call, check if sequence has changed
             if self.bSeqUpdate or n_seq != self.nOldSeq:
@@ -192,6 +265,8 @@ class Driver(VISA_Driver):
             # turn on channels in use 
             self.turn_on_in_use(seq=True)
             return
+        # send waveform data
+        self.transfer.flush()
         # turn on channels in use 
         self.turn_on_in_use()
         # if not starting, make sure AWG is not running, then return
@@ -236,50 +311,41 @@ class Driver(VISA_Driver):
             self.writeAndLog(':WLIS:WAV:NEW "%s",%d,REAL;' % (name, length))
     
 
-    def sendWaveformToTek(self, channel, vData, vMark, seq=None):
-        """Send waveform to Tek"""
-        # check if sequence. iSeq is used for index
-        if seq is None:
-            iSeq = 0
-        else:
-            iSeq = seq
-        # channels are named 1-8
-        n = channel-1
+    def clearTransfers(self):
+        """Drop data left from an interrupted upload. Waveforms with data not
+        sent are created again at next upload"""
+        for (iSeq, n) in self.transfer.clear():
+            if iSeq < len(self.lOldReal):
+                self.lOldReal[iSeq][n] = np.array([], dtype='f4')
+                self.lOldMark[iSeq][n] = np.array([], dtype='u1')
+
+
+    def scaleWaveform(self, channel, vData, vMark, dVpp):
+        """Pad and scale waveform, and combine markers into bytes. Returns
+        None if channel is not in use, otherwise a tuple with scaled data,
+        marker bytes and length of data before padding"""
         # length of markers
         mark_len = np.fromiter(map(len, vMark), 'i')
         if len(vData)==0:
             nMark = max(mark_len)
             if nMark==0:
-                # if channel in use, turn off, clear, go to next channel
-                if self.lInUse[n]:
-                    self.createWaveformOnTek(channel, 0, seq, bOnlyClear=True)
-                    self.lOldReal[iSeq][n] = np.array([], dtype='f4')
-                    self.lOldMark[iSeq][n] = np.array([], dtype='u1')
-                    self.lInUse[n] = False
-                return False
+                return None
             else:
                 # no data, but markers exist, output zeros for data
                 vData = np.zeros((nMark,), dtype='f4')
         # make sure length of data is the same
-        if (np.any(np.logical_and(mark_len>0, mark_len!=len(vData)))) or \
-           (self.nPrevData>0 and self.nPrevData!=len(vData)):
+        if np.any(np.logical_and(mark_len>0, mark_len!=len(vData))):
             raise InstrumentDriver.Error(\
                   'All channels need to have the same number of elements')
-        self.nPrevData = len(vData)
+        nData = len(vData)
         if len(vData) < MIN_WAVE_LENGTH:
-            self.log(
-                f'Seq:{seq} Waveform length is shorter than minimum value. '
-                f'Padding to {MIN_WAVE_LENGTH} points with edge value.')
             vData = np.pad(vData, (0,MIN_WAVE_LENGTH-len(vData)), mode='edge')
             for m, marker in enumerate(vMark):
                 if len(marker)!=0:
                     vMark[m] = np.pad(marker, (0,MIN_WAVE_LENGTH-len(marker)),
                         mode='edge')
-        # channel in use, mark
-        self.lInUse[n] = True
-        # get range and scale to Real
-        Vpp = self.getValue('Ch%d - Range' % channel)
-        vReal = self.scaleWaveformToReal(vData, Vpp, channel)
+        # scale to Real
+        vReal = self.scaleWaveformToReal(vData, dVpp, channel)
         # check for marker traces
         vMarkByte = np.zeros((len(vReal),), dtype='u1')
         for m, marker in enumerate(vMark):
@@ -289,6 +355,38 @@ class Driver(VISA_Driver):
                 # add marker trace to data trace, with bit shift
                 # Bit 7 stores marker 1, Bit 6 stores marker 2, ...
                 vMarkByte += vMarkBit << (7-m)
+        return (vReal, vMarkByte, nData)
+
+
+    def sendWaveformToTek(self, channel, scaled, seq=None):
+        """Send scaled waveform to Tek, data is added to transfer queue"""
+        # check if sequence. iSeq is used for index
+        if seq is None:
+            iSeq = 0
+        else:
+            iSeq = seq
+        # channels are named 1-8
+        n = channel-1
+        if scaled is None:
+            # if channel in use, turn off, clear, go to next channel
+            if self.lInUse[n]:
+                self.createWaveformOnTek(channel, 0, seq, bOnlyClear=True)
+                self.lOldReal[iSeq][n] = np.array([], dtype='f4')
+                self.lOldMark[iSeq][n] = np.array([], dtype='u1')
+                self.lInUse[n] = False
+            return False
+        (vReal, vMarkByte, nData) = scaled
+        # make sure length of data is the same
+        if self.nPrevData>0 and self.nPrevData!=nData:
+            raise InstrumentDriver.Error(\
+                  'All channels need to have the same number of elements')
+        self.nPrevData = nData
+        if nData < MIN_WAVE_LENGTH:
+            self.log(
+                f'Seq:{seq} Waveform length is shorter than minimum value. '
+                f'Padding to {MIN_WAVE_LENGTH} points with edge value.')
+        # channel in use, mark
+        self.lInUse[n] = True
         # send waveform data
         Rstart, Rlength = 0, len(vReal)
         Mstart, Mlength = 0, len(vReal)
@@ -328,14 +426,16 @@ class Driver(VISA_Driver):
         else:
             # sequence mode, get name
             name = b'Labber_%d_%d' % (channel, seq+1)
+        # queue data, sent together with other channels and sequence steps
         if Rlength > 0:
             sSend = b':WLIS:WAV:DATA "%s",%d,%d,' % (name, Rstart, Rlength)
-            self.write_binary(sSend, vReal[Rstart:Rstart+Rlength])
+            self.transfer.add(sSend, vReal[Rstart:Rstart+Rlength], (iSeq, n))
             # store new waveform for next call
             self.lOldReal[iSeq][n] = vReal
         if Mlength > 0:
             sSend = b':WLIS:WAV:MARK:DATA "%s",%d,%d,' % (name, Mstart, Mlength)
-            self.write_binary(sSend, vMarkByte[Mstart:Mstart+Mlength])
+            self.transfer.add(sSend, vMarkByte[Mstart:Mstart+Mlength],
+                              (iSeq, n))
             self.lOldMark[iSeq][n] = vMarkByte
         return True
 
@@ -388,14 +488,6 @@ class Driver(VISA_Driver):
                 if seq is not None:
                     self.writeAndLog(f':SOUR{n+1}:CASS:SEQ "Labber_SEQ",{n+1}')
 
-    def write_binary(self, sCmd, data):
-        """Write binary data, no log"""
-        # create binary data as bytes with header
-        sLen = b'%d' % (data.dtype.itemsize*len(data))
-        sHead = b'#%d%s' % (len(sLen), sLen)
-        sSend = b'%s%s' % (sCmd, sHead + data.tobytes())
-        self.write_raw(sSend)
-
     
 if __name__ == '__main__':
     pass
@@ -55,42 +55,159 @@ class Driver(InstrumentDriver.InstrumentWorker):
             value = quant.getValue()
         return value
         
-    def demodulate(self, vWaveform):   
-      
-        #demodulate
-        nModFreq = self.getValue('Modulation Freq')
-        nSampleRate = self.getValue('Sample Rate')
-        nWavLength = len(vWaveform)
-        vTvals = np.linspace(0,nWavLength/nSampleRate, nWavLength, endpoint = False)
-        
-        
-        
-        mod_period = 1/nModFreq
-        #period_num = int(np.floor((self.vRTime[-1]+dt)/mod_period))
-        response_int = []
-        t_int = []
-        
-        period_num = (vTvals[-1] - vTvals[0]) * nModFreq
-        samples_period = int(nSampleRate/nModFreq)
-        
-        vWaveform = resample(vWaveform, int(period_num*samples_period))#sinc function interpolation
-        
-        vTvals = np.linspace(0, nWavLength/nSampleRate, len(vWaveform), endpoint = False)
-
-        avg = np.mean(vWaveform)
-        demod = 2*(vWaveform-avg)*np.exp(-1j*(2*np.pi*(nModFreq)*vTvals))
-
-        #integrate over each modulation period
-        vResponse = np.array([], dtype = complex)
-        t_int = []
-        for n in range(0,int(np.floor(period_num))):
-            start = n*samples_period
-            end = (n+1)*samples_period
-            vResponse = np.append(vResponse, np.mean(demod[start:end]))
-            t_int.append(np.mean(vTvals[start:end]))
-
-        return mod_period, vResponse      
-      
+    def demodulate(self, vWaveform):
+        """Demodulate waveform and integrate over each modulation period"""
+        dModFreq = self.getValue('Modulation Freq')
+        dSampleRate = self.getValue('Sample Rate')
+        vResponse = demodulateWaveform(vWaveform, dSampleRate, dModFreq)
+        return 1/dModFreq, vResponse
+
+
+def getPeriodSamples(dSampleRate, dModFreq, dTolerance=1E-9):
+    """Number of samples per modulation period, or None if not an integer"""
+    dSamples = dSampleRate / dModFreq
+    nSamples = int(round(dSamples))
+    if nSamples > 0 and abs(dSamples - nSamples) <= dTolerance * dSamples:
+        return nSamples
+    return None
+
+
+def sumPeriods(vWaveform, nSamples, dPhaseStep, nPeriodStart=0):
+    """Sum waveform times demodulation phasor over each full period.
+
+    The phasor of sample k in period n is exp(-i*dPhaseStep*(n*nSamples+k)),
+    which is split in a phase per period and a phasor within the period, so
+    that all periods are summed by a single matrix-vector product.
+
+    Parameters
+    ----------
+    vWaveform : numpy array
+        Waveform, starting at the beginning of a period. Samples after the
+        last full period are ignored.
+    nSamples : int
+        Number of samples per period.
+    dPhaseStep : float
+        Phase step of demodulation phasor per sample.
+    nPeriodStart : int
+        Index of first period in the waveform.
+
+    Returns
+    -------
+    vSum : numpy array
+        Sum of waveform times phasor over each period.
+    vPhasorSum : numpy array
+        Sum of phasor over each period.
+
+    """
+    nPeriod = len(vWaveform) // nSamples
+    mWaveform = np.reshape(vWaveform[:nPeriod*nSamples], (nPeriod, nSamples))
+    vPhasor = np.exp(-1j*dPhaseStep*np.arange(nSamples))
+    vPeriodPhasor = np.exp(-1j*dPhaseStep*nSamples*
+                           (nPeriodStart + np.arange(nPeriod)))
+    vSum = (mWaveform @ vPhasor) * vPeriodPhasor
+    vPhasorSum = np.sum(vPhasor) * vPeriodPhasor
+    return (vSum, vPhasorSum)
+
+
+def demodulateChunks(lChunk, dSampleRate, dModFreq):
+    """Demodulate waveform given in chunks, integrating over each period.
+
+    Only one chunk at a time is kept in memory, so traces longer than memory
+    can be demodulated from slices of a file, for example an h5py dataset.
+    The number of samples per modulation period must be an integer.
+
+    Parameters
+    ----------
+    lChunk : iterable of numpy array
+        Consecutive chunks of waveform, of any length.
+    dSampleRate : float
+        Sample rate of waveform.
+    dModFreq : float
+        Modulation frequency.
+
+    Returns
+    -------
+    numpy array
+        Demodulated response, averaged over each full modulation period.
+
+    """
+    nSamples = getPeriodSamples(dSampleRate, dModFreq)
+    if nSamples is None:
+        raise ValueError('Sample rate must be an integer multiple of the '
+                         'modulation frequency for chunked demodulation')
+    dPhaseStep = 2*np.pi*dModFreq/dSampleRate
+    lSum, lPhasorSum = [], []
+    dTotal = 0.0
+    nTotal = 0
+    nPeriod = 0
+    vRemain = np.zeros(0)
+    for vChunk in lChunk:
+        vChunk = np.asarray(vChunk, dtype=float)
+        dTotal += np.sum(vChunk)
+        nTotal += len(vChunk)
+        # complete period left from previous chunk
+        if len(vRemain) > 0:
+            nFill = nSamples - len(vRemain)
+            vRemain = np.concatenate((vRemain, vChunk[:nFill]))
+            vChunk = vChunk[nFill:]
+            if len(vRemain) < nSamples:
+                continue
+            (vSum, vPhasorSum) = sumPeriods(vRemain, nSamples, dPhaseStep,
+                                            nPeriod)
+            lSum.append(vSum)
+            lPhasorSum.append(vPhasorSum)
+            nPeriod += 1
+        (vSum, vPhasorSum) = sumPeriods(vChunk, nSamples, dPhaseStep, nPeriod)
+        lSum.append(vSum)
+        lPhasorSum.append(vPhasorSum)
+        nPeriod += len(vSum)
+        vRemain = vChunk[len(vSum)*nSamples:]
+    if nTotal == 0:
+        return np.zeros(0, dtype=complex)
+    # remove average, which is only known after the last chunk
+    dAverage = dTotal / nTotal
+    vSum = np.concatenate(lSum)
+    vPhasorSum = np.concatenate(lPhasorSum)
+    return 2*(vSum - dAverage*vPhasorSum)/nSamples
+
+
+def demodulateWaveform(vWaveform, dSampleRate, dModFreq):
+    """Demodulate waveform and integrate over each modulation period.
+
+    If a period is an integer number of samples, the waveform is used as is.
+    Otherwise, it is first resampled by sinc interpolation to an integer
+    number of samples per period.
+
+    Parameters
+    ----------
+    vWaveform : numpy array
+        Waveform.
+    dSampleRate : float
+        Sample rate of waveform.
+    dModFreq : float
+        Modulation frequency.
+
+    Returns
+    -------
+    numpy array
+        Demodulated response, averaged over each modulation period.
+
+    """
+    vWaveform = np.asarray(vWaveform, dtype=float)
+    nWavLength = len(vWaveform)
+    if getPeriodSamples(dSampleRate, dModFreq) is not None:
+        return demodulateChunks([vWaveform], dSampleRate, dModFreq)
+    # resample to integer number of samples per period
+    period_num = (nWavLength - 1) / dSampleRate * dModFreq
+    samples_period = int(dSampleRate/dModFreq)
+    vWaveform = resample(vWaveform, int(period_num*samples_period))
+    # phase step of resampled waveform
+    dPhaseStep = 2*np.pi*dModFreq*nWavLength/(dSampleRate*len(vWaveform))
+    (vSum, vPhasorSum) = sumPeriods(vWaveform, samples_period, dPhaseStep)
+    nPeriod = int(np.floor(period_num))
+    avg = np.mean(vWaveform)
+    return 2*(vSum[:nPeriod] - avg*vPhasorSum[:nPeriod])/samples_period
+
 
 if __name__ == '__main__':
     pass
\ No newline at end of file
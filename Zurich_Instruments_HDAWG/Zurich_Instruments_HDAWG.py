@@ -30,6 +30,12 @@ class Driver(LabberDriver):
         self.n_ch = 8
         self.waveform_updated = [False] * self.n_ch
         self.buffer_sizes = [0] * 4
+        # last uploaded waveforms in native format, and conversion buffers,
+        # for each core
+        self.uploaded_waves = [None] * 4
+        self.wave_buffers = [None] * 4
+        # time, size and skipped cores of last upload
+        self.upload_stats = dict(time=0.0, bytes=0, skipped=0)
         self.log('Connected', self.device)
 
     def performClose(self, bError=False, options={}):
@@ -82,6 +88,7 @@ class Driver(LabberDriver):
                 self._configure_sequencer()
                 # after configuring sequencer, all waveforms must be uploaded
                 self.waveform_updated = [True] * self.n_ch
+                self.uploaded_waves = [None] * 4
 
             if np.any(self.waveform_updated):
                 self._upload_waveforms(self.waveform_updated)
@@ -94,6 +101,12 @@ class Driver(LabberDriver):
         return the actual value set by the instrument"""
         if quant.get_cmd != '':
             value = self._get_node_value(quant)
+        elif quant.name == 'Waveform upload time':
+            value = self.upload_stats['time']
+        elif quant.name == 'Waveform bytes uploaded':
+            value = self.upload_stats['bytes']
+        elif quant.name == 'Waveform uploads skipped':
+            value = self.upload_stats['skipped']
         else:
             # for all others, return local value
             value = quant.getValue()
@@ -227,12 +240,19 @@ class Driver(LabberDriver):
 
 
     def _upload_waveforms(self, awg_updated=None):
-        """Upload all waveforms to device"""
+        """Upload all waveforms to device.
+
+        Waveforms are converted to the native int16 format, and only uploaded
+        to a core if different from the last upload to that core.
+        """
         # check version of API
         new_style = hasattr(self.daq, 'setVector')
         # get updated channels
         if awg_updated is None:
             awg_updated = [True] * self.n_ch
+        t0 = time.perf_counter()
+        n_bytes = 0
+        n_skipped = 0
 
         # upload waveforms pairwise
         for ch in range(0, self.n_ch, 2):
@@ -257,26 +277,43 @@ class Driver(LabberDriver):
                     n = self.buffer_sizes[0]
                 else:
                     n = max(len(x1), len(x2))
-                data = np.zeros((n, 2))
-                data[:len(x1), 0] = x1
-                data[:len(x2), 1] = x2
+                # convert to native format, reuse buffer if size is unchanged
+                data = self.wave_buffers[core]
+                if data is None or data.shape != (n, 2):
+                    data = np.empty((n, 2), dtype=np.int16)
+                convert_waveform(x1, data[:, 0])
+                convert_waveform(x2, data[:, 1])
+                # skip upload if identical to data on instrument
+                if (self.uploaded_waves[core] is not None and
+                        np.array_equal(data, self.uploaded_waves[core])):
+                    n_skipped += 1
+                    continue
                 base = '/%s/awgs/%d/' % (self.device, core)
 
                 # check old or new-style uploads
                 if new_style:
-                    # new-style call
-                    data_zh = zhinst.utils.convert_awg_waveform(data.flatten())
+                    # new-style call, interleaved data in native format
                     self.daq.setVector(
-                        base + 'waveform/waves/0', data_zh)
+                        base + 'waveform/waves/0', data.ravel())
+                    n_bytes += data.nbytes
                 else:
                     # old-style call
+                    data_float = np.zeros((n, 2))
+                    data_float[:len(x1), 0] = x1
+                    data_float[:len(x2), 1] = x2
                     self.daq.setInt(base + 'waveform/index', 0)
                     self.daq.sync()
                     self.daq.vectorWrite(
-                        base + 'waveform/data', data.flatten())
+                        base + 'waveform/data', data_float.flatten())
+                    n_bytes += data_float.nbytes
+                # keep uploaded data, previous buffer is used for next upload
+                (self.uploaded_waves[core], self.wave_buffers[core]) = (
+                    data, self.uploaded_waves[core])
 
                 # set enabled
                 self.daq.setInt(base + 'enable', 1)
+        self.upload_stats = dict(time=time.perf_counter() - t0,
+                                 bytes=n_bytes, skipped=n_skipped)
 
 
     def _upload_awg_program(self, awg_program, core=0):
@@ -431,5 +468,17 @@ class Driver(LabberDriver):
         self.log('Datatype:', node, dtype)
         return dtype
 
+
+def convert_waveform(x, out):
+    """Convert waveform with values from -1 to 1 to int16, in place.
+
+    Scaling and rounding are the same as zhinst.utils.convert_awg_waveform.
+    Samples after the end of the waveform are set to zero.
+    """
+    n = len(x)
+    np.multiply(x, 2**15 - 1, out=out[:n], casting='unsafe')
+    out[n:] = 0
+
+
 if __name__ == '__main__':
     pass